@@ -1,25 +1,107 @@
 from gevent import monkey
 monkey.patch_all()
 
+import atexit
+import hmac
+import json
 import os
 import random
-import requests
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+import time
+from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, session
 from flask_socketio import SocketIO, emit
 
-from models import db, User, TagRequest, MagicLink, VIBE_AVAILABLE
-from geo_utils import haversine_distance
+from models import db, User, TagRequest, MagicLink, Zone, STATUS_MAX_LENGTH, VIBE_AVAILABLE, VIBES
+from geo_utils import detect_zone, haversine_distance, parse_coordinates
+from zones import ZoneFileWatcher, ZoneRegistry, init_zones, save_zones
+from state_sync import StateTracker
+from broadcaster import BroadcastScheduler, LocationThrottle
+from presence import PresenceStore
+from cluster_engine import ClusterEngine
+from tag_index import PendingTag, PendingTagIndex
+from expiry import ExpirySweeper
+from liveness import LivenessIndex, LivenessSweeper
+from occupancy import OccupancyPublisher, ZoneOccupancy
+from history import (MAX_POINTS, LocationHistory, default_range, downsample, parse_amount,
+                     parse_time)
+from migrations import create_tables, upgrade_schema
+from pubsub import leader_lock, open_bus, socketio_queue_options
+from replication import Replicator
+from rooms import STATE_PACKED_ROOM, STATE_ROOM, RoomRouter, area_room, team_room
+from viewport import AreaOfInterest, AreaSubscriptions, filter_delta, filter_snapshot
+from wire import encode_state
+from serialization import SerializationCache
+from mailer import BrevoProvider, EmailMessage, EmailQueue, FakeProvider, LogProvider
+from metrics import SIZE_BUCKETS, Instrumentation
+from storage import storage_profile
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///office.db')
+# SQLite runs in WAL mode with a read pool; Postgres pools and batches (see storage.py)
+storage = storage_profile(os.environ.get('DATABASE_URL', 'sqlite:///office.db'), os.environ.get('DATABASE_READ_URL'))
+app.config['SQLALCHEMY_DATABASE_URI'] = storage.url
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = storage.engine_options()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['BROADCAST_INTERVAL_MS'] = int(os.environ.get('BROADCAST_INTERVAL_MS', 250))
+app.config['LOCATION_MIN_INTERVAL_MS'] = int(os.environ.get('LOCATION_MIN_INTERVAL_MS', 1000))
+# Max time a presence change may sit in memory before it is written (0 = write-through)
+app.config['PRESENCE_MAX_LAG_MS'] = int(os.environ.get('PRESENCE_MAX_LAG_MS', 2000))
+# Users with no open socket and no update for this long are taken off the map (0 = never)
+app.config['IDLE_TIMEOUT_S'] = float(os.environ.get('IDLE_TIMEOUT_S', 600))
+# Shared bus for running several workers, e.g. local:///tmp/catch-me-bus or redis://host:6379/0
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+# Email delivery: 'brevo', 'log' (print links) or 'fake' (keep in memory); by default
+# Brevo when BREVO_API_KEY and FROM_EMAIL are set, otherwise log
+app.config['EMAIL_PROVIDER'] = os.environ.get('EMAIL_PROVIDER', '')
+app.config['EMAIL_WORKERS'] = int(os.environ.get('EMAIL_WORKERS', 2))
+# Handler timing and the /metrics endpoint; profiling is only allowed with a token
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN', '')
+# Token for the zone admin API, and an optional JSON file of zones to watch and load
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN', '')
+app.config['ZONES_FILE'] = os.environ.get('ZONES_FILE', '')
+# Where location history is logged (empty = keep only the latest points in memory) and for how many days
+app.config['HISTORY_DIR'] = os.environ.get('HISTORY_DIR', os.path.join(app.instance_path, 'history'))
+app.config['HISTORY_RETENTION_DAYS'] = int(os.environ.get('HISTORY_RETENTION_DAYS', 7))
 
 # Initialize extensions
 db.init_app(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='gevent')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='gevent',
+                    **socketio_queue_options(app.config['SOCKETIO_MESSAGE_QUEUE']))
+
+# Workers share live state over the bus; one leader broadcasts and expires
+replicator = Replicator(open_bus(app.config['SOCKETIO_MESSAGE_QUEUE'], 'presence'))
+leader = leader_lock(app.config['SOCKETIO_MESSAGE_QUEUE'])
+if app.config['SOCKETIO_MESSAGE_QUEUE'] and not replicator.enabled:
+    print("Warning: presence is not shared on this message queue; run a single worker")
+
+# Per-user, per-team and per-area rooms for events that concern a few people
+rooms = RoomRouter(socketio)
+
+
+def email_provider(name):
+    brevo_api_key = os.environ.get('BREVO_API_KEY', '')
+    from_email = os.environ.get('FROM_EMAIL', '')
+    if not name:
+        name = 'brevo' if brevo_api_key and from_email else 'log'
+    if name == 'brevo':
+        return BrevoProvider(brevo_api_key, from_email, os.environ.get('FROM_NAME', 'Catch Me If You Can'))
+    if name == 'fake':
+        return FakeProvider()
+    return LogProvider()
+
+
+# Handler latency and query histograms, broadcast sizes and gauges for /metrics
+instrumentation = Instrumentation()
+broadcast_bytes = instrumentation.metrics.histogram(
+    'broadcast_payload_bytes', 'Size of state broadcasts (JSON ones sampled).', SIZE_BUCKETS, ('event', 'wire'))
+
+# JSON payloads are measured on one flush in this many, since that means encoding them again
+JSON_SIZE_SAMPLE_EVERY = 10
+
+# Outbound email, sent by background workers so requests never wait on the provider
+email_queue = EmailQueue(socketio, email_provider(app.config['EMAIL_PROVIDER']), app.config['EMAIL_WORKERS'])
 
 # Fun emoji avatars for users
 AVATAR_EMOJIS = [
@@ -31,6 +113,49 @@ AVATAR_EMOJIS = [
 # Connection distance threshold (meters) - how close to "connect"
 CONNECTION_DISTANCE = 30
 
+# Versioned view of what clients have been sent
+state_tracker = StateTracker()
+
+# Live user state, written back to the database in batches
+presence = PresenceStore(app.config['PRESENCE_MAX_LAG_MS'] / 1000)
+
+# Zones, loaded from the database at startup and reloadable while running,
+# and proximity clusters, updated as people move
+zone_registry = ZoneRegistry()
+zone_index = zone_registry.index
+cluster_engine = ClusterEngine(zone_index=zone_index)
+cluster_events = []
+
+# People per zone and zone type, kept up to date as they move
+occupancy = ZoneOccupancy()
+
+# Pending tags by participant, so location updates can check them without SQL
+pending_tags = PendingTagIndex()
+
+# Idle deadlines of active users, so people who went away leave the map
+liveness = LivenessIndex(app.config['IDLE_TIMEOUT_S'])
+
+# Extra wait before the leader expires an idle user when there are several workers,
+# for a touch from a worker holding their socket to arrive (seconds)
+LIVENESS_GRACE = 5.0
+
+# How long someone whose last socket closed stays on the map, so a page reload
+# or a tab still open on another worker doesn't take them off (seconds)
+DISCONNECT_GRACE = 15.0
+
+# User id -> when their last socket on some worker closed, until the sweeper decides
+disconnected_at = {}
+
+# Every accepted location, in memory per user and logged to disk by a background task
+location_history = LocationHistory(app.config['HISTORY_DIR'] or None, replicator.origin,
+                                   retention_days=app.config['HISTORY_RETENTION_DAYS'])
+
+# Sockets on this worker that only want people and clusters in an area
+area_subscriptions = AreaSubscriptions()
+
+# Serialised tags, rebuilt only when the tag or either participant changes
+tag_cache = SerializationCache()
+
 
 def get_random_emoji():
     return random.choice(AVATAR_EMOJIS)
@@ -38,40 +163,408 @@ def get_random_emoji():
 
 def get_active_people():
     """Get all active people with location."""
-    return [u.to_dict() for u in User.query.filter_by(is_active=True).filter(User.latitude.isnot(None)).all()]
+    return presence.active_people()
+
+
+def _version(user_id):
+    record = presence.get(user_id)
+    return record.version if record else None
+
+
+def serialize_tag(tag):
+    """
+    Tag dict with tagger/tagged taken from live presence. Don't mutate it.
+    It carries expires_at, not a countdown, so it stays valid until the tag
+    or either user changes; clients count down themselves.
+    """
+    stamp = (tag.status, tag.expires_at, _version(tag.tagger_id), _version(tag.tagged_id))
+    return tag_cache.get(tag.id, stamp, lambda: tag.to_dict(
+        tagger=presence.user_dict(tag.tagger_id),
+        tagged=presence.user_dict(tag.tagged_id)
+    ))
 
 
 def get_active_tags():
-    """Get all pending tag requests."""
-    tags = TagRequest.query.filter_by(status='pending').all()
-    # Clean up expired tags
-    for tag in tags:
-        if tag.is_expired:
-            tag.status = 'expired'
-    db.session.commit()
-    return [t.to_dict() for t in TagRequest.query.filter_by(status='pending').all()]
+    """Get all pending, unexpired tag requests. Expiry itself is done by the sweeper."""
+    with storage.read_session() as read:
+        return [serialize_tag(t) for t in TagRequest.active_query(session=read).all()]
 
 
 def broadcast_state():
-    """Broadcast full state to all clients."""
-    socketio.emit('state_update', {
-        'people': get_active_people(),
-        'tags': get_active_tags()
-    })
+    """Schedule a state broadcast; calls within one tick are merged."""
+    broadcaster.mark_dirty()
+
+
+def flush_state():
+    """
+    Emit what changed since the last flush. The leader computes the delta for
+    everyone; followers get it replicated and only serve their area subscribers.
+    """
+    if leader.is_leader():
+        with app.app_context():
+            delta = state_tracker.update(get_active_people(), get_active_tags())
+        if delta:
+            rooms.emit('state_delta', delta, 'state', [STATE_ROOM])
+            if app.config['METRICS_ENABLED'] and broadcaster.flushes % JSON_SIZE_SAMPLE_EVERY == 0:
+                broadcast_bytes.observe(len(json.dumps(delta, separators=(',', ':'))), ('state_delta', 'json'))
+            # Packed clients may be connected to other workers too
+            if rooms.packed_count() or replicator.enabled:
+                packed = encode_state(delta)
+                rooms.emit('state_delta', packed, 'state', [STATE_PACKED_ROOM])
+                broadcast_bytes.observe(len(packed), ('state_delta', 'packed'))
+            replicator.publish('state_delta', delta=delta)
+            send_area_deltas(delta)
+
+    if cluster_events:
+        events = list(cluster_events)
+        del cluster_events[:]
+        if leader.is_leader():
+            rooms.emit('cluster_changes', {'events': events}, 'state', [STATE_ROOM])
+        for sid, selected in area_subscriptions.cluster_events(events):
+            socketio.emit('cluster_changes', {'events': selected}, to=sid, ignore_queue=True)
+
+
+def state_payload(sid, payload):
+    """A snapshot or delta in the wire format the socket asked for at connect."""
+    return encode_state(payload) if rooms.is_packed(sid) else payload
+
+
+def send_area_deltas(delta):
+    """Send each area subscriber on this worker its slice of a state delta."""
+    for sid, filtered in area_subscriptions.deltas(delta):
+        socketio.emit('state_delta', state_payload(sid, filtered), to=sid, ignore_queue=True)
+
+
+def send_area_snapshots():
+    """Restart every area subscriber on this worker from the current state."""
+    snapshot = state_tracker.snapshot()
+    clusters = cluster_engine.clusters()
+    for sid, area in area_subscriptions.areas():
+        socketio.emit('state_snapshot', state_payload(sid, area_subscriptions.subscribe(sid, area, snapshot, clusters)),
+                      to=sid, ignore_queue=True)
+
+
+def track_cluster(record):
+    """Keep the cluster engine, zone occupancy and the user's rooms in step with a presence record."""
+    if record.is_active and record.latitude is not None:
+        cluster_events.extend(cluster_engine.update(record.id, record.latitude, record.longitude))
+        zone = zone_index.lookup(record.latitude, record.longitude)
+        occupancy.update(record.id, zone)
+        if rooms.has_sockets(record.id):
+            rooms.move(record.id, team=record.team, area=zone['name'] if zone else None)
+        return
+    cluster_events.extend(cluster_engine.remove(record.id))
+    occupancy.remove(record.id)
+    if rooms.has_sockets(record.id):
+        rooms.move(record.id, team=record.team, area=area_of(record))
+
+
+def area_of(record):
+    """Name of the zone a user is in, or None."""
+    if record.latitude is None or record.longitude is None:
+        return None
+    zone = detect_zone(record.latitude, record.longitude, zone_index)
+    return zone['name'] if zone else None
+
+
+broadcaster = BroadcastScheduler(socketio, flush_state, app.config['BROADCAST_INTERVAL_MS'] / 1000)
+location_throttle = LocationThrottle(app.config['LOCATION_MIN_INTERVAL_MS'] / 1000)
+
+
+def expire_tags(expired):
+    """Mark tags that passed their deadline as expired and tell both users."""
+    for tag in expired:
+        tag_cache.invalidate(tag.id)
+    if not leader.is_leader():
+        return  # Every worker drops them from its index; the leader does the rest
+
+    with app.app_context():
+        TagRequest.query.filter(
+            TagRequest.id.in_([tag.id for tag in expired]),
+            TagRequest.status == 'pending'
+        ).update({'status': 'expired'}, synchronize_session=False)
+        db.session.commit()
+    replicator.publish('tags_removed', tag_ids=[tag.id for tag in expired])
+
+    for tag in expired:
+        rooms.emit_to_users('tag_expired', {
+            'tag_id': tag.id,
+            'tagger_id': tag.tagger_id,
+            'tagged_id': tag.tagged_id
+        }, tag.tagger_id, tag.tagged_id)
+    broadcast_state()
+
+
+def sweep_magic_links():
+    """Delete magic links past their expiry. Returns how many were removed."""
+    if not leader.is_leader():
+        return 0
+
+    with app.app_context():
+        deleted = MagicLink.query.filter(
+            MagicLink.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    return deleted
+
+
+expiry_sweeper = ExpirySweeper(socketio, pending_tags, expire_tags, sweep_magic_links)
+
+
+def sweep_idle(user_ids):
+    """
+    Users whose idle or disconnect deadline passed. Anyone with a socket
+    here is still around and gets touched; the leader takes the rest off
+    the map in one batch, with one commit and one broadcast, if they've
+    been idle too long or closed their last socket and weren't seen since.
+    """
+    now = datetime.utcnow()
+    grace = timedelta(seconds=LIVENESS_GRACE if replicator.enabled else 0)
+    idle = []
+    for user_id in user_ids:
+        closed_at = disconnected_at.pop(user_id, None)
+        record = presence.get(user_id)
+        if record is None or not record.is_active:
+            continue
+        if rooms.has_sockets(user_id):
+            update_presence(user_id, touch=True)
+            continue
+        last_seen = record.last_seen or now
+        gone = closed_at is not None and last_seen <= closed_at
+        timed_out = liveness.idle_timeout > 0 and now - last_seen >= timedelta(seconds=liveness.idle_timeout) + grace
+        if leader.is_leader() and (gone or timed_out):
+            idle.append(user_id)
+        elif liveness.idle_timeout > 0:
+            liveness.arm(user_id, now + (grace or timedelta(seconds=liveness.idle_timeout)))
+    if idle:
+        mark_inactive(*idle)
+        flush_presence()
+
+
+liveness_sweeper = LivenessSweeper(socketio, liveness, sweep_idle)
+
+
+def track_liveness(record):
+    if record.is_active:
+        liveness.seen(record.id, record.last_seen)
+    else:
+        liveness.forget(record.id)
+        disconnected_at.pop(record.id, None)
+
+
+def socket_closed(user_id, closed_at):
+    """
+    Someone's last socket on a worker closed at `closed_at`. Check on them
+    after DISCONNECT_GRACE (plus LIVENESS_GRACE for touches from other
+    workers to arrive); sweep_idle takes them off unless they were seen since.
+    """
+    grace = DISCONNECT_GRACE + (LIVENESS_GRACE if replicator.enabled else 0)
+    disconnected_at[user_id] = closed_at
+    liveness.arm(user_id, closed_at + timedelta(seconds=grace))
+    liveness_sweeper.wake()
+
+
+def flush_presence():
+    """Write changed presence records back to the database."""
+    with app.app_context():
+        presence.flush(db.session, User, storage.write_rows)
+
+
+def presence_changed():
+    """Called after a presence update; persists immediately in write-through mode."""
+    if presence.max_lag <= 0:
+        flush_presence()
+    broadcast_state()
+
+
+def update_presence(user_id, touch=False, **fields):
+    """Update a user's live presence here and on every other worker."""
+    record = presence.touch(user_id, **fields) if touch else presence.update(user_id, **fields)
+    if record:
+        track_liveness(record)
+        if touch:
+            fields.update(last_seen=record.last_seen, is_active=record.is_active)
+        replicator.publish('presence', user_id=user_id, fields=fields)
+    return record
+
+
+def add_presence(user):
+    """Start tracking a user row here and on every other worker."""
+    record = presence.add(user)
+    track_liveness(record)
+    replicator.publish('user_added', fields=record.fields())
+    return record
+
+
+# Changes published by other workers
+def apply_remote_presence(message):
+    record = presence.apply(message['user_id'], message['fields'])
+    if record:
+        track_liveness(record)
+        if 'latitude' in message['fields']:
+            # The worker that received the update logs it; keep it in memory here
+            location_history.record(record.id, record.latitude, record.longitude, persist=False)
+        track_cluster(record)
+        broadcast_state()
+
+
+def apply_remote_user(message):
+    record = presence.put(message['fields'])
+    track_liveness(record)
+    track_cluster(record)
+    broadcast_state()
+
+
+def apply_remote_tag_added(message):
+    pending_tags.add(PendingTag.from_dict(message['tag']))
+    expiry_sweeper.wake()
+    broadcast_state()
+
+
+def apply_remote_tags_removed(message):
+    for tag_id in message['tag_ids']:
+        pending_tags.discard(tag_id)
+        tag_cache.invalidate(tag_id)
+    broadcast_state()
+
+
+def apply_remote_state_delta(message):
+    if state_tracker.apply(message['delta']):
+        send_area_deltas(message['delta'])
+    else:
+        replicator.publish('state_resync')
+
+
+def apply_remote_state_resync(message):
+    if leader.is_leader():
+        replicator.publish('state_snapshot', snapshot=state_tracker.snapshot())
+
+
+def apply_remote_state_snapshot(message):
+    if not leader.is_leader():
+        state_tracker.load_snapshot(message['snapshot'])
+        send_area_snapshots()
+
+
+def apply_remote_socket_closed(message):
+    user_id = message['user_id']
+    if rooms.has_sockets(user_id):
+        # Still connected here: a touch tells the leader they're around
+        update_presence(user_id, touch=True)
+    else:
+        socket_closed(user_id, datetime.fromisoformat(message['closed_at']))
+
+
+def apply_remote_zones_changed(message):
+    zone_registry.load_from_db(Zone)
+
+
+replicator.on('presence', apply_remote_presence)
+replicator.on('user_added', apply_remote_user)
+replicator.on('tag_added', apply_remote_tag_added)
+replicator.on('tags_removed', apply_remote_tags_removed)
+replicator.on('state_delta', apply_remote_state_delta)
+replicator.on('state_resync', apply_remote_state_resync)
+replicator.on('state_snapshot', apply_remote_state_snapshot)
+replicator.on('zones_changed', apply_remote_zones_changed)
+replicator.on('socket_closed', apply_remote_socket_closed)
+
 
+def zones_changed(changes):
+    """Recount occupancy, move sockets to their new area rooms and re-filter area subscribers after a reload."""
+    occupancy.rebuild(presence.records(), zone_index.lookup)
+    for record in presence.records():
+        if rooms.has_sockets(record.id):
+            rooms.move(record.id, team=record.team, area=area_of(record))
+    send_area_snapshots()
+    socketio.emit('zones_changed', dict(changes, version=zone_registry.version), ignore_queue=True)
 
-def check_connection(tag):
-    """Check if tagger and tagged are close enough to connect."""
-    if not tag.tagger or not tag.tagged:
-        return False
-    if not tag.tagger.latitude or not tag.tagged.latitude:
-        return False
 
-    distance = haversine_distance(
-        tag.tagger.latitude, tag.tagger.longitude,
-        tag.tagged.latitude, tag.tagged.longitude
-    )
-    return distance <= CONNECTION_DISTANCE
+zone_registry.on_change(zones_changed)
+
+# Pushes 'zone_occupancy' to this worker's sockets when the counts changed
+occupancy_publisher = OccupancyPublisher(socketio, occupancy)
+
+
+def reload_zones(zones=None):
+    """Optionally replace the zones table, then reload it here and on every other worker."""
+    if zones is not None:
+        save_zones(db, Zone, zones)
+    changes = zone_registry.load_from_db(Zone)
+    replicator.publish('zones_changed')
+    return changes
+
+
+def load_zones_file(zones):
+    """Zones file changed: the leader writes it to the database and everyone reloads."""
+    if leader.is_leader():
+        with app.app_context():
+            changes = reload_zones(zones)
+        print(f"Zones file loaded: {len(zone_registry)} zones, {changes}")
+
+
+zones_watcher = ZoneFileWatcher(socketio, app.config['ZONES_FILE'], load_zones_file)
+
+
+def check_connections(tags):
+    """Check which tags have tagger and tagged close enough to connect."""
+    results = []
+    for tag in tags:
+        tagger = presence.get(tag.tagger_id)
+        tagged = presence.get(tag.tagged_id)
+        if not tagger or not tagged or not tagger.latitude or not tagged.latitude:
+            results.append(False)
+            continue
+        distance = haversine_distance(tagger.latitude, tagger.longitude,
+                                      tagged.latitude, tagged.longitude)
+        results.append(distance <= CONNECTION_DISTANCE)
+    return results
+
+
+def announce_drop_in(record):
+    """Tell the user's team they've checked in; everyone if they have no team."""
+    if record.team:
+        rooms.emit('user_dropped_in', presence.user_dict(record.id), 'team', [team_room(record.team)])
+    else:
+        rooms.broadcast('user_dropped_in', presence.user_dict(record.id))
+
+
+def announce_left(record):
+    """Tell the user's team and the people in the zone they were in that they left."""
+    targets = []
+    if record.team:
+        targets.append(team_room(record.team))
+    area = area_of(record)
+    if area:
+        targets.append(area_room(area))
+    if targets:
+        rooms.emit('user_left', {'user_id': record.id, 'name': record.name},
+                   'team' if record.team else 'area', targets)
+
+
+def connect_tags(tag_ids):
+    """Mark tags connected in one transaction and celebrate with both users."""
+    now = datetime.utcnow()
+    tags = TagRequest.query.filter(TagRequest.id.in_(tag_ids), TagRequest.status == 'pending').all()
+    for tag in tags:
+        tag.status = 'connected'
+        tag.connected_at = now
+    db.session.commit()
+
+    for tag_id in tag_ids:
+        pending_tags.discard(tag_id)
+    replicator.publish('tags_removed', tag_ids=list(tag_ids))
+
+    for tag in tags:
+        # Emit connection celebration to both users
+        rooms.emit_to_users('connection_made', {
+            'tag': serialize_tag(tag),
+            'tagger_id': tag.tagger_id,
+            'tagged_id': tag.tagged_id
+        }, tag.tagger_id, tag.tagged_id)
+    # Connected tags are never broadcast again
+    for tag_id in tag_ids:
+        tag_cache.invalidate(tag_id)
 
 
 # Routes
@@ -99,18 +592,10 @@ def name_from_email(email):
 
 
 def send_magic_link_email(email, token, base_url):
-    """Send magic link email to user via Brevo."""
-    brevo_api_key = os.environ.get('BREVO_API_KEY', '')
-    from_email = os.environ.get('FROM_EMAIL', '')
-    from_name = os.environ.get('FROM_NAME', 'Catch Me If You Can')
-
+    """Queue the magic link email for a user. Returns the queued message."""
     verify_url = f"{base_url}/verify/{token}"
     name = name_from_email(email).split()[0]
 
-    if not brevo_api_key or not from_email:
-        print(f"[DEV MODE] Magic link for {email}: {verify_url}")
-        return True  # Dev mode - just log the link
-
     html = f"""
     <html>
     <body style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; padding: 40px; background: #f5f5f5;">
@@ -131,27 +616,12 @@ def send_magic_link_email(email, token, base_url):
     </html>
     """
 
-    try:
-        response = requests.post(
-            "https://api.brevo.com/v3/smtp/email",
-            headers={
-                "api-key": brevo_api_key,
-                "Content-Type": "application/json"
-            },
-            json={
-                "sender": {"name": from_name, "email": from_email},
-                "to": [{"email": email, "name": name}],
-                "subject": "🔐 Your sign-in link for Catch Me If You Can",
-                "htmlContent": html
-            }
-        )
-        if response.status_code >= 400:
-            print(f"Failed to send email: {response.text}")
-            return False
-        return True
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        return False
+    return email_queue.enqueue(EmailMessage(
+        email, name,
+        "🔐 Your sign-in link for Catch Me If You Can",
+        html,
+        text=f"Magic link: {verify_url}"
+    ))
 
 
 @app.route('/checkin', methods=['GET', 'POST'])
@@ -174,12 +644,10 @@ def checkin():
         db.session.add(magic_link)
         db.session.commit()
 
-        # Send email
+        # Queue the email; the page polls its delivery status
         base_url = request.host_url.rstrip('/')
-        if send_magic_link_email(email, magic_link.token, base_url):
-            return render_template('checkin_sent.html', email=email)
-        else:
-            return render_template('checkin.html', error="Failed to send email. Please try again.")
+        message = send_magic_link_email(email, magic_link.token, base_url)
+        return render_template('checkin_sent.html', email=email, message_id=message.id)
 
     return render_template('checkin.html')
 
@@ -209,207 +677,542 @@ def verify_magic_link(token):
     existing_user = User.query.filter_by(email=email).first()
 
     if existing_user:
-        existing_user.is_active = True
-        existing_user.last_seen = datetime.utcnow()
-        if team:
-            existing_user.team = team
-        db.session.commit()
-        socketio.emit('user_dropped_in', existing_user.to_dict())
+        if existing_user.id not in presence:
+            add_presence(existing_user)
+        record = update_presence(existing_user.id, touch=True, **({'team': team} if team else {}))
+        track_cluster(record)
+        presence_changed()
+        announce_drop_in(record)
         return redirect(url_for('index', user_id=existing_user.id))
 
     name = name_from_email(email)
     user = User(email=email, name=name, avatar_emoji=get_random_emoji(), team=team, is_active=True)
     db.session.add(user)
     db.session.commit()
+    record = add_presence(user)
 
-    socketio.emit('user_dropped_in', user.to_dict())
+    announce_drop_in(record)
     return redirect(url_for('index', user_id=user.id))
 
 
 @app.route('/api/state')
 def api_state():
-    """Get current state - people and active tags."""
+    """
+    Get current state - people and active tags.
+    With ?since=<version> returns only the changes after that version, or a
+    full snapshot if the version is too old to catch up from.
+    With ?bbox=south,west,north,east and/or ?zones=name,type,... only people
+    in that area are included. ?wire=packed returns the wire.py encoding.
+    """
+    try:
+        area = request_area()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    broadcaster.flush_now()
+
+    payload = None
+    since = request.args.get('since', type=int)
+    if since is not None:
+        delta = state_tracker.since(since)
+        if delta:
+            payload = filter_delta(delta, area) if area else delta
+    if payload is None:
+        snapshot = state_tracker.snapshot()
+        payload = filter_snapshot(snapshot, area) if area else snapshot
+
+    if request.args.get('wire') == 'packed':
+        return Response(encode_state(payload), mimetype='application/octet-stream')
+    return jsonify(payload)
+
+
+@app.route('/api/clusters')
+def api_clusters():
+    """Current proximity clusters; changes are pushed as 'cluster_changes'. Takes ?bbox= and ?zones= too."""
+    try:
+        area = request_area()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    clusters = cluster_engine.clusters()
+    if area:
+        clusters = [c for c in clusters if area.contains_cluster(c)]
+    return jsonify({'clusters': clusters})
+
+
+def request_area():
+    """Area of interest from the ?bbox= and ?zones= query parameters, or None."""
+    return AreaOfInterest.parse(request.args.get('bbox'), request.args.get('zones'), zone_index)
+
+
+@app.route('/api/stats')
+def api_stats():
+    """Broadcast and throttling counters."""
     return jsonify({
-        'people': get_active_people(),
-        'tags': get_active_tags()
+        'broadcast': broadcaster.stats(),
+        'location_throttle': location_throttle.stats(),
+        'presence': presence.stats(),
+        'pending_tags': pending_tags.stats(),
+        'expiry': expiry_sweeper.stats(),
+        'liveness': liveness_sweeper.stats(),
+        'history': location_history.stats(),
+        'replication': dict(replicator.stats(), leader=leader.is_leader()),
+        'rooms': rooms.stats(),
+        'areas': area_subscriptions.stats(),
+        'email': email_queue.stats(),
+        'zones': zone_registry.stats(),
+        'occupancy': dict(occupancy.stats(), published=occupancy_publisher.published),
+        'storage': storage.stats(),
+        'serialization': {'people': presence.serialized.stats(), 'tags': tag_cache.stats()}
+    })
+
+
+@app.route('/api/email/<message_id>')
+def email_status(message_id):
+    """Delivery status of a queued email."""
+    message = email_queue.get(message_id)
+    if message is None:
+        return jsonify({'error': 'Unknown message'}), 404
+    return jsonify(message.status_dict())
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of handler, broadcast and queue metrics."""
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(instrumentation.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/profile', methods=['GET', 'POST'])
+def profile_handler():
+    """
+    Sample a handler's stacks: POST {'handler': 'location_update', 'seconds': 10,
+    'interval_ms': 5} starts, GET returns the collapsed stacks so far.
+    Needs PROFILE_TOKEN set and sent as X-Profile-Token.
+    """
+    token = app.config['PROFILE_TOKEN']
+    if not token or not hmac.compare_digest(request.headers.get('X-Profile-Token', ''), token):
+        return jsonify({'error': 'Profiling is disabled'}), 404
+
+    profiler = instrumentation.profiler
+    if request.method == 'GET':
+        return jsonify(profiler.report())
+
+    data = request.get_json(silent=True) or {}
+    handler = data.get('handler')
+    if handler not in instrumentation.names:
+        return jsonify({'error': f"Unknown handler: {handler}", 'handlers': sorted(instrumentation.names)}), 400
+    try:
+        profiler.start(handler, float(data.get('seconds', 10)), float(data.get('interval_ms', 5)) / 1000)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+    return jsonify(profiler.report()), 202
+
+
+def admin_authorized():
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+
+@app.route('/api/zones')
+def api_zones():
+    """Every zone with its colour and bounding box, and the registry version."""
+    return jsonify(zone_registry.to_dict())
+
+
+@app.route('/api/zones', methods=['PUT'])
+def replace_zones():
+    """
+    Replace every zone with {'zones': [...]} and reload all workers.
+    Needs ADMIN_TOKEN set and sent as X-Admin-Token.
+    """
+    if not admin_authorized():
+        return jsonify({'error': 'Not allowed'}), 403
+    zones = (request.get_json(silent=True) or {}).get('zones')
+    if not isinstance(zones, list):
+        return jsonify({'error': 'Expected {"zones": [...]}'}), 400
+    try:
+        changes = reload_zones(zones)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(changes, version=zone_registry.version))
+
+
+@app.route('/api/zones/occupancy')
+def api_zone_occupancy():
+    """
+    Active people in each zone (every zone listed, empty ones as 0) and per
+    zone type. ?type= limits the zones to one type. Also pushed as 'zone_occupancy'.
+    """
+    zone_type = request.args.get('type')
+    result = occupancy.to_dict()
+    result['zones'] = {zone['name']: occupancy.count(zone['name'])
+                       for zone in zone_registry if not zone_type or zone['type'] == zone_type}
+    if zone_type:
+        result['types'] = {zone_type: occupancy.by_type.get(zone_type, 0)}
+    return jsonify(result)
+
+
+@app.route('/api/zones/reload', methods=['POST'])
+def reload_zones_handler():
+    """Reload zones from the database on all workers, after editing the table directly."""
+    if not admin_authorized():
+        return jsonify({'error': 'Not allowed'}), 403
+    changes = reload_zones()
+    return jsonify(dict(changes, version=zone_registry.version))
+
+
+@app.route('/api/history/<int:user_id>')
+def api_history(user_id):
+    """
+    Where a user has been, as [[unix time, latitude, longitude], ...].
+    ?since= and ?until= take unix seconds or ISO times (default the last 24h);
+    ?tolerance= simplifies the path to within that many meters, ?bucket= keeps
+    one point per that many seconds, and ?max_points= caps the result (max 1000).
+    Only users who are currently active have their history shown.
+    """
+    record = presence.get(user_id)
+    if record is None or not record.is_active:
+        return jsonify({'error': 'No active user with that id'}), 404
+    since, until = default_range()
+    try:
+        since = parse_time(request.args.get('since'), since)
+        until = parse_time(request.args.get('until'), until)
+        tolerance = parse_amount(request.args.get('tolerance'))
+        bucket_seconds = parse_amount(request.args.get('bucket'))
+        max_points = min(int(request.args.get('max_points', MAX_POINTS)), MAX_POINTS)
+    except ValueError as e:
+        return jsonify({'error': f'Bad parameter: {e}'}), 400
+    if max_points < 1:
+        return jsonify({'error': 'max_points must be at least 1'}), 400
+
+    points = location_history.trajectory(user_id, since, until)
+    track = downsample(points, tolerance, bucket_seconds, max_points)
+    return jsonify({
+        'user_id': user_id,
+        'since': since,
+        'until': until,
+        'recorded_points': len(points),
+        'points': [[round(t, 3), round(lat, 6), round(lon, 6)] for t, lat, lon in track]
     })
 
 
 @app.route('/api/user/<int:user_id>')
 def get_user(user_id):
+    record = presence.get(user_id)
+    if record:
+        return jsonify(presence.user_dict(record.id))
     user = User.query.get_or_404(user_id)
     return jsonify(user.to_dict())
 
 
 # WebSocket events
 @socketio.on('connect')
-def handle_connect():
-    print('Client connected')
+def handle_connect(auth=None):
+    # Clients opt into the packed state format with auth {'wire': 'packed'}
+    packed = isinstance(auth, dict) and auth.get('wire') == 'packed'
+    rooms.connect(request.sid, packed=packed)
+
+
+def sender():
+    """The user the current socket registered as, or None. Handlers act as this user."""
+    return rooms.user_of(request.sid)
+
+
+def event_data(data):
+    """An event's payload, or {} when a client sent something other than an object."""
+    return data if isinstance(data, dict) else {}
+
+
+def mark_inactive(*user_ids):
+    """Take users off the map and tell their teams and zones, with one broadcast for all."""
+    changed = False
+    for user_id in user_ids:
+        record = update_presence(user_id, is_active=False)
+        if record:
+            track_cluster(record)
+            location_throttle.forget(user_id)
+            announce_left(record)
+            changed = True
+    if changed:
+        presence_changed()
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print('Client disconnected')
+    membership = rooms.disconnect(request.sid)
+    area_subscriptions.unsubscribe(request.sid)
+    # Their last socket on this worker went away; they may still have one
+    # on another worker or be reloading the page, so let the sweeper decide
+    if membership is not None and not rooms.has_sockets(membership.user_id):
+        record = presence.get(membership.user_id)
+        if record and record.is_active:
+            closed_at = datetime.utcnow()
+            socket_closed(membership.user_id, closed_at)
+            replicator.publish('socket_closed', user_id=membership.user_id, closed_at=closed_at.isoformat())
 
 
 @socketio.on('register_user')
 def handle_register_user(data):
-    user_id = data.get('user_id')
+    """Bind this socket to a user; later events from it act as that user."""
+    user_id = event_data(data).get('user_id')
     if user_id:
-        user = User.query.get(user_id)
-        if user:
-            user.is_active = True
-            user.last_seen = datetime.utcnow()
-            db.session.commit()
-            broadcast_state()
+        record = update_presence(user_id, touch=True)
+        if record:
+            rooms.register(request.sid, user_id, team=record.team, area=area_of(record))
+            track_cluster(record)
+            presence_changed()
+
+
+@socketio.on('subscribe_area')
+def handle_subscribe_area(data):
+    """
+    Only receive people and clusters in a bounding box and/or zones:
+    {'bbox': [south, west, north, east], 'zones': [name or type, ...]}.
+    An empty subscription goes back to receiving everything.
+    """
+    data = event_data(data)
+    try:
+        area = AreaOfInterest.parse(data.get('bbox'), data.get('zones'), zone_index)
+    except (TypeError, ValueError):
+        return
+
+    broadcaster.flush_now()
+    snapshot = state_tracker.snapshot()
+    if area is None:
+        area_subscriptions.unsubscribe(request.sid)
+        rooms.follow_state(request.sid, True)
+    else:
+        rooms.follow_state(request.sid, False)
+        snapshot = area_subscriptions.subscribe(request.sid, area, snapshot, cluster_engine.clusters())
+    # Direct, so it can't arrive after deltas sent straight to this socket
+    emit('state_snapshot', state_payload(request.sid, snapshot), ignore_queue=True)
 
 
 @socketio.on('location_update')
 def handle_location_update(data):
-    user_id = data.get('user_id')
-    latitude = data.get('latitude')
-    longitude = data.get('longitude')
+    user_id = sender()
+    data = event_data(data)
+    # Presence is the source of truth and is replicated, so only clean coordinates go in
+    coordinates = parse_coordinates(data.get('latitude'), data.get('longitude'))
 
-    if not user_id or latitude is None or longitude is None:
+    if not user_id or coordinates is None:
         return
 
-    user = User.query.get(user_id)
-    if not user:
+    # Inside the window the latest fix is held and applied when the window ends
+    update = (*coordinates, time.time())
+    if not location_throttle.allow(user_id, update):
         return
 
-    user.latitude = latitude
-    user.longitude = longitude
-    user.last_seen = datetime.utcnow()
-    user.is_active = True
-    db.session.commit()
+    apply_location(user_id, *update)
+    broadcast_state()
 
-    # Check if this user has any pending tags that might now be connected
-    pending_tags = TagRequest.query.filter(
-        ((TagRequest.tagger_id == user_id) | (TagRequest.tagged_id == user_id)),
-        TagRequest.status == 'pending'
-    ).all()
-
-    for tag in pending_tags:
-        if check_connection(tag):
-            tag.status = 'connected'
-            tag.connected_at = datetime.utcnow()
-            db.session.commit()
-            # Emit connection celebration to both users
-            socketio.emit('connection_made', {
-                'tag': tag.to_dict(),
-                'tagger_id': tag.tagger_id,
-                'tagged_id': tag.tagged_id
-            })
 
+def apply_location(user_id, latitude, longitude, at):
+    """Move a user to an accepted fix taken at unix time `at`."""
+    record = update_presence(user_id, touch=True, latitude=latitude, longitude=longitude)
+    if not record:
+        return
+    track_cluster(record)
+    location_history.record(user_id, latitude, longitude, at=at)
+    if presence.max_lag <= 0:
+        flush_presence()
+
+    # Check if this user has any pending tags that might now be connected
+    candidates = pending_tags.for_user(user_id)
+    if candidates:
+        connected = [tag for tag, close in zip(candidates, check_connections(candidates)) if close]
+        if connected:
+            connect_tags([tag.id for tag in connected])
+
+
+def apply_held_locations(due):
+    """Fixes the throttle held back, now that their users' windows ended."""
+    with app.app_context():
+        for user_id, update in due:
+            apply_location(user_id, *update)
     broadcast_state()
 
 
 @socketio.on('set_vibe')
 def handle_set_vibe(data):
     """Set user's vibe status."""
-    user_id = data.get('user_id')
-    vibe = data.get('vibe')
+    user_id = sender()
+    vibe = event_data(data).get('vibe')
 
-    if not user_id or not vibe:
+    if not user_id or vibe not in VIBES:
         return
 
-    user = User.query.get(user_id)
-    if user:
-        user.vibe = vibe
-        db.session.commit()
-        broadcast_state()
+    if update_presence(user_id, vibe=vibe):
+        presence_changed()
 
 
 @socketio.on('set_status')
 def handle_set_status(data):
     """Set user's custom status."""
-    user_id = data.get('user_id')
-    status = data.get('status', '')
+    user_id = sender()
+    status = event_data(data).get('status', '')
 
-    if not user_id:
+    if not user_id or (status is not None and not isinstance(status, str)):
         return
 
-    user = User.query.get(user_id)
-    if user:
-        # Limit status length
-        user.status = status[:50] if status else None
-        db.session.commit()
-        broadcast_state()
+    # Limit status length
+    if update_presence(user_id, status=status[:STATUS_MAX_LENGTH] if status else None):
+        presence_changed()
 
 
 @socketio.on('set_floor')
 def handle_set_floor(data):
     """Set user's current floor in the office."""
-    user_id = data.get('user_id')
-    floor = data.get('floor')
+    user_id = sender()
+    floor = event_data(data).get('floor')
 
     if not user_id:
         return
 
-    user = User.query.get(user_id)
-    if user:
-        # Validate floor (1-9 or None to clear)
-        if floor is None or (isinstance(floor, int) and 1 <= floor <= 9):
-            user.floor = floor
-            db.session.commit()
-            broadcast_state()
+    # Validate floor (1-9 or None to clear)
+    if floor is None or (isinstance(floor, int) and not isinstance(floor, bool) and 1 <= floor <= 9):
+        if update_presence(user_id, floor=floor):
+            presence_changed()
 
 
 @socketio.on('tag_user')
 def handle_tag_user(data):
     """Handle 'I'll join you in 5 min' tag."""
-    tagger_id = data.get('tagger_id')
-    tagged_id = data.get('tagged_id')
+    tagger_id = sender()
+    tagged_id = event_data(data).get('tagged_id')
 
     if not tagger_id or not tagged_id or tagger_id == tagged_id:
         return
 
-    tagger = User.query.get(tagger_id)
-    tagged = User.query.get(tagged_id)
-
-    if not tagger or not tagged:
+    if not presence.get(tagger_id) or not presence.get(tagged_id):
         return
 
     # Check if there's already a pending tag between these users
-    existing = TagRequest.query.filter(
-        ((TagRequest.tagger_id == tagger_id) & (TagRequest.tagged_id == tagged_id)) |
-        ((TagRequest.tagger_id == tagged_id) & (TagRequest.tagged_id == tagger_id)),
-        TagRequest.status == 'pending'
-    ).first()
-
-    if existing:
+    if pending_tags.has_pair(tagger_id, tagged_id):
         return  # Already have a pending tag
 
     # Create new tag
     tag = TagRequest(tagger_id=tagger_id, tagged_id=tagged_id)
     db.session.add(tag)
     db.session.commit()
+    pending = pending_tags.add(tag)
+    replicator.publish('tag_added', tag=pending.to_dict())
+    expiry_sweeper.wake()
 
     # Notify both users
-    socketio.emit('tagged', {
-        'tag': tag.to_dict(),
+    rooms.emit_to_users('tagged', {
+        'tag': serialize_tag(tag),
         'tagger_id': tagger_id,
         'tagged_id': tagged_id
-    })
+    }, tagger_id, tagged_id)
 
     broadcast_state()
 
 
 @socketio.on('user_inactive')
-def handle_user_inactive(data):
-    user_id = data.get('user_id')
+def handle_user_inactive(data=None):
+    user_id = sender()
     if user_id:
-        user = User.query.get(user_id)
-        if user:
-            user.is_active = False
-            db.session.commit()
-            socketio.emit('user_left', {'user_id': user_id, 'name': user.name})
-            broadcast_state()
+        mark_inactive(user_id)
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create tables and any indexes missing from an existing database."""
+    create_tables(db.engine)
+    created = upgrade_schema(db.engine)
+    print(f"Created indexes: {', '.join(created)}" if created else "Schema is up to date")
 
 
 # Initialize database
 with app.app_context():
-    db.create_all()
+    storage.install(db.engine)
+    create_tables(db.engine)
+    created_indexes = upgrade_schema(db.engine)
+    if created_indexes:
+        print(f"Created indexes: {', '.join(created_indexes)}")
+    init_zones(db, Zone)
+    zone_registry.load_from_db(Zone)
+    presence.load(User.query.all())
+    pending_tags.load(TagRequest.query.filter_by(status='pending').all())
+    for record in presence.records():
+        track_cluster(record)
+    del cluster_events[:]
+    liveness.load(presence.records())
+
+
+
+def register_metrics(metrics):
+    """Gauges read at scrape time from the components' own counters."""
+    metrics.gauge('connected_clients', 'Sockets connected to this worker.', lambda: rooms.stats()['connected'])
+    metrics.gauge('registered_clients', 'Sockets bound to a user.', lambda: rooms.stats()['registered'])
+    metrics.gauge('area_subscribers', 'Sockets filtered to an area.', lambda: len(area_subscriptions))
+    metrics.gauge('state_version', 'Version of the broadcast state.', lambda: state_tracker.version)
+    metrics.gauge('queue_depth', 'Work waiting in background queues.', lambda: {
+        ('email',): email_queue.stats()['queued'],
+        ('email_in_flight',): email_queue.stats()['in_flight'],
+        ('presence_dirty',): presence.stats()['dirty'],
+        ('broadcast_pending',): int(broadcaster.stats()['pending']),
+        ('pending_tags',): pending_tags.stats()['pending'],
+        ('liveness_tracked',): len(liveness),
+        ('history_pending',): location_history.stats()['pending']
+    }, ('queue',))
+    metrics.gauge('broadcast_flushes_total', 'State broadcasts flushed.', lambda: broadcaster.flushes, kind='counter')
+    metrics.gauge('broadcast_requests_merged_total', 'Broadcast requests merged into a pending flush.',
+                  lambda: broadcaster.merged, kind='counter')
+    metrics.gauge('location_updates_total', 'Location updates by throttle outcome.', lambda: {
+        ('accepted',): location_throttle.accepted,
+        ('dropped',): location_throttle.dropped
+    }, ('outcome',), kind='counter')
+    metrics.gauge('emails_total', 'Emails by final outcome.', lambda: {
+        ('sent',): email_queue.sent,
+        ('failed',): email_queue.failed
+    }, ('outcome',), kind='counter')
+    metrics.gauge('serialization_cache_total', 'Serialisation cache lookups.', lambda: {
+        (cache, outcome): stats[outcome]
+        for cache, stats in (('people', presence.serialized.stats()), ('tags', tag_cache.stats()))
+        for outcome in ('hits', 'misses')
+    }, ('cache', 'outcome'), kind='counter')
+    metrics.gauge('history_points_written_total', 'Location history points written to disk.',
+                  lambda: location_history.written, kind='counter')
+    metrics.gauge('idle_users_swept_total', 'Users whose idle deadline passed.',
+                  lambda: liveness_sweeper.swept, kind='counter')
+    metrics.gauge('zone_occupancy', 'Active people per zone type.',
+                  lambda: {(zone_type,): count for zone_type, count in occupancy.by_type.items()}, ('type',))
+    metrics.gauge('room_deliveries_avoided_total', 'Deliveries saved by emitting to rooms.',
+                  lambda: rooms.avoided, kind='counter')
+
+
+# Wrap every handler once they are all registered
+if app.config['METRICS_ENABLED']:
+    instrumentation.install()
+    instrumentation.instrument_flask(app)
+    instrumentation.instrument_socketio(socketio)
+    broadcaster.flush = instrumentation.wrap('task', 'flush_state', broadcaster.flush)
+    flush_presence = instrumentation.wrap('task', 'flush_presence', flush_presence)
+    register_metrics(instrumentation.metrics)
+
+leader.start(socketio)
+replicator.start(socketio, app.app_context)
+if not leader.is_leader():
+    replicator.publish('state_resync')  # Catch up on the leader's state version
+broadcaster.start()
+location_throttle.start(socketio, apply_held_locations)
+presence.start(socketio, flush_presence)
+expiry_sweeper.start()
+liveness_sweeper.start()  # Also takes people off after their last socket closes
+email_queue.start()
+location_history.start(socketio)
+occupancy_publisher.start()
+if app.config['ZONES_FILE']:
+    zones_watcher.start()
+atexit.register(flush_presence)
+atexit.register(location_history.close)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+"""
+Benchmark and consistency check for area-of-interest state filtering.
+
+Compares the JSON size of a full state delta with what a client subscribed
+to the area around the office receives, as headcount spread across town
+grows, and times filtering for many subscribers. The consistency check
+replays random moves and checks that a client applying its filtered deltas
+ends up with exactly the people inside its area.
+
+Run from the app directory:
+    python benchmarks/bench_area_filter.py
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from geo_utils import ZoneIndex  # noqa: E402
+from state_sync import StateTracker  # noqa: E402
+from viewport import AreaOfInterest, AreaSubscriptions, filter_delta, filter_snapshot  # noqa: E402
+from zones import DEFAULT_ZONES  # noqa: E402
+
+# Paddington office, centre of the synthetic datasets
+CENTER = (51.5170, -0.1780)
+
+# Roughly a zoomed-in phone map around the office, with padding
+OFFICE_VIEW = (CENTER[0] - 0.003, CENTER[1] - 0.005, CENTER[0] + 0.003, CENTER[1] + 0.005)
+
+
+def person(user_id, rng, spread, local_share=0.1):
+    # Some people around the office, the rest across town
+    s = 0.002 if rng.random() < local_share else spread
+    return {
+        'id': user_id, 'name': f'User {user_id}', 'email': f'user.{user_id}@example.com',
+        'avatar_emoji': '🦊', 'team': 'red', 'vibe': 'available', 'status': None, 'floor': None,
+        'latitude': CENTER[0] + rng.uniform(-s, s), 'longitude': CENTER[1] + rng.uniform(-s, s) * 1.6,
+        'last_seen': '2024-01-01T09:00:00', 'is_active': True
+    }
+
+
+def move(people, rng, fraction, spread, local_share=0.1):
+    for p in rng.sample(people, max(1, int(len(people) * fraction))):
+        people[p['id']] = person(p['id'], rng, spread, local_share)
+
+
+def apply(client, delta):
+    for p in delta['people']['upserted']:
+        client[p['id']] = p
+    for person_id in delta['people']['removed']:
+        client.pop(person_id, None)
+
+
+def random_area(rng, zone_index):
+    choice = rng.random()
+    if choice < 0.4:
+        lat, lon = CENTER[0] + rng.uniform(-0.01, 0.01), CENTER[1] + rng.uniform(-0.016, 0.016)
+        size = rng.uniform(0.001, 0.01)
+        return AreaOfInterest.parse([lat - size, lon - size, lat + size, lon + size], zone_index=zone_index)
+    if choice < 0.7:
+        return AreaOfInterest.parse(zones=rng.sample([z['name'] for z in DEFAULT_ZONES], 2), zone_index=zone_index)
+    return AreaOfInterest.parse(list(OFFICE_VIEW), ['pub', 'cafe'], zone_index)
+
+
+def check_consistency(trials, rng, zone_index):
+    for trial in range(trials):
+        people = [person(i, rng, 0.01, 0.5) for i in range(rng.randint(1, 80))]
+        tracker = StateTracker()
+        tracker.update(people, [])
+        subscriptions = AreaSubscriptions()
+        areas = [random_area(rng, zone_index) for _ in range(5)]
+        clients = {}
+        for sid, area in enumerate(areas):
+            clients[sid] = {p['id']: p for p in subscriptions.subscribe(sid, area, tracker.snapshot(), [])['people']}
+        # The same areas, caught up later over HTTP instead (?since=&bbox=)
+        polled = {sid: dict(client) for sid, client in clients.items()}
+        start_version = tracker.version
+
+        for _ in range(rng.randint(1, 30)):
+            move(people, rng, 0.2, 0.01, 0.5)
+            active = [p for p in people if rng.random() > 0.1]
+            delta = tracker.update(active, [])
+            if delta is None:
+                continue
+            for sid, filtered in subscriptions.deltas(delta):
+                apply(clients[sid], filtered)
+
+        for sid, area in enumerate(areas):
+            expected = {p['id']: p for p in filter_snapshot(tracker.snapshot(), area)['people']}
+            if clients[sid] != expected:
+                raise SystemExit(f'subscriber {sid} on trial {trial} differs from its area snapshot')
+
+            apply(polled[sid], filter_delta(tracker.since(start_version), area))
+            if polled[sid] != expected:
+                raise SystemExit(f'HTTP catch-up for subscriber {sid} on trial {trial} is wrong')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--spread', type=float, default=0.05, help='degrees around the office people spread over')
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--trials', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    zone_index = ZoneIndex(DEFAULT_ZONES)
+    check_consistency(args.trials, rng, zone_index)
+    print(f'consistency: {args.trials} random move sequences leave every subscriber with exactly its area')
+
+    office = AreaOfInterest.parse(list(OFFICE_VIEW), zone_index=zone_index)
+    print(f"{'people':>8} {'full KB':>9} {'area KB':>9} {'ratio':>7} {'ms/tick':>9}")
+    for size in args.sizes:
+        people = [person(i, rng, args.spread) for i in range(size)]
+        tracker = StateTracker()
+        tracker.update(people, [])
+        subscriptions = AreaSubscriptions()
+        for sid in range(args.subscribers):
+            # Most phones look at the office; some look elsewhere
+            area = office if sid % 10 else random_area(rng, zone_index)
+            subscriptions.subscribe(sid, area, tracker.snapshot(), [])
+
+        move(people, rng, 0.1, args.spread)
+        delta = tracker.update(people, [])
+        start = time.perf_counter()
+        filtered = dict(subscriptions.deltas(delta))
+        elapsed = time.perf_counter() - start
+
+        full_size = len(json.dumps(delta))
+        area_size = len(json.dumps(filtered[1]))
+        print(f"{size:>8} {full_size / 1024:>9.1f} {area_size / 1024:>9.1f} "
+              f"{full_size / area_size:>6.1f}x {elapsed * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
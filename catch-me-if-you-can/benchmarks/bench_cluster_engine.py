@@ -0,0 +1,133 @@
+"""
+Benchmark and consistency check for the incremental ClusterEngine.
+
+Measures the cost of a single location update at growing headcounts (it
+should stay flat), both at constant density and with everyone packed into
+one crowd (a party in one room: one big cluster), and checks the maintained clusters against a from-scratch
+connected-components computation after random moves.
+
+Run from the app directory:
+    python benchmarks/bench_cluster_engine.py
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cluster_engine import DEFAULT_MAX_LATITUDE, ClusterEngine  # noqa: E402
+from geo_utils import CLUSTER_DISTANCE, haversine_distance  # noqa: E402
+
+# Paddington office, centre of the synthetic datasets
+CENTER = (51.5170, -0.1780)
+
+
+def random_position(rng, spread):
+    return CENTER[0] + rng.uniform(-spread, spread), CENTER[1] + rng.uniform(-spread, spread) * 1.6
+
+
+def components(positions):
+    """Brute-force clusters: connected components of the within-distance graph."""
+    ids = list(positions)
+    seen = set()
+    result = set()
+    for start in ids:
+        if start in seen:
+            continue
+        seen.add(start)
+        group = {start}
+        frontier = [start]
+        while frontier:
+            lat, lon = positions[frontier.pop()]
+            for other in ids:
+                if other not in seen and haversine_distance(lat, lon, *positions[other]) <= CLUSTER_DISTANCE:
+                    seen.add(other)
+                    group.add(other)
+                    frontier.append(other)
+        result.add(frozenset(group))
+    return result
+
+
+def check_consistency(trials, rng):
+    for trial in range(trials):
+        engine = ClusterEngine()
+        positions = {}
+        spread = rng.choice((0.0005, 0.001, 0.003))
+        for _ in range(rng.randint(1, 200)):
+            user_id = rng.randint(1, 60)
+            if positions and rng.random() < 0.1:
+                user_id = rng.choice(list(positions))
+                engine.remove(user_id)
+                del positions[user_id]
+                continue
+            positions[user_id] = random_position(rng, spread)
+            if rng.random() < 0.02:
+                # A bad fix far outside the grid: left out of clusters, and the grid stays put
+                positions[user_id] = (rng.choice((75.0, -89.5, float('nan'))), positions[user_id][1])
+            engine.update(user_id, *positions[user_id])
+
+        positions = {u: p for u, p in positions.items() if engine.in_range(*p)}
+        expected = components(positions)
+        actual = {frozenset(c['members']) for c in engine.clusters()}
+        if expected != actual:
+            raise SystemExit(f'incremental clusters differ from recompute on trial {trial}')
+        if engine.max_latitude != DEFAULT_MAX_LATITUDE:
+            raise SystemExit(f'grid was resized on trial {trial}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--crowd-sizes', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--moves', type=int, default=5000)
+    parser.add_argument('--trials', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    check_consistency(args.trials, rng)
+    print(f'consistency: {args.trials} random move sequences match a full recompute')
+
+    print(f"{'people':>8} {'clusters':>9} {'us/update':>10}")
+    for size in args.sizes:
+        # Constant density: the area grows with headcount
+        spread = 0.004 * (size / 100) ** 0.5
+        engine = ClusterEngine()
+        for user_id in range(size):
+            engine.update(user_id, *random_position(rng, spread))
+
+        moves = [(rng.randrange(size), random_position(rng, spread)) for _ in range(args.moves)]
+        start = time.perf_counter()
+        for user_id, (lat, lon) in moves:
+            engine.update(user_id, lat, lon)
+        per_update = (time.perf_counter() - start) / len(moves)
+
+        print(f"{size:>8} {len(engine.clusters()):>9} {per_update * 1e6:>10.1f}")
+
+    print(f"{'crowd':>8} {'clusters':>9} {'us/update':>10}")
+    for size in args.crowd_sizes:
+        # Everyone within ~60 m, shuffling a few meters at a time
+        engine = ClusterEngine()
+        positions = {user_id: random_position(rng, 0.0003) for user_id in range(size)}
+        for user_id, (lat, lon) in positions.items():
+            engine.update(user_id, lat, lon)
+
+        moves = []
+        for _ in range(args.moves):
+            user_id = rng.randrange(size)
+            lat, lon = positions[user_id]
+            positions[user_id] = (lat + rng.uniform(-3e-5, 3e-5), lon + rng.uniform(-5e-5, 5e-5))
+            moves.append((user_id, positions[user_id]))
+        start = time.perf_counter()
+        for user_id, (lat, lon) in moves:
+            engine.update(user_id, lat, lon)
+        per_update = (time.perf_counter() - start) / len(moves)
+
+        print(f"{size:>8} {len(engine.clusters()):>9} {per_update * 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
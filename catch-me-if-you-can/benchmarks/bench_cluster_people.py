@@ -0,0 +1,84 @@
+"""
+Benchmark and equivalence check: grid clustering vs the greedy pairwise scan.
+
+Run from the app directory:
+    python benchmarks/bench_cluster_people.py
+    python benchmarks/bench_cluster_people.py --sizes 100 1000 --trials 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from geo_utils import cluster_people  # noqa: E402
+
+# Paddington office, centre of the synthetic datasets
+CENTER = (51.5170, -0.1780)
+
+
+def make_people(count, rng, spread=0.005):
+    """People scattered around a few hotspots, some without a location or zone."""
+    hotspots = [(CENTER[0] + rng.uniform(-spread, spread), CENTER[1] + rng.uniform(-spread, spread))
+                for _ in range(max(1, count // 20))]
+    people = []
+    for i in range(count):
+        if rng.random() < 0.05:
+            people.append({'id': i, 'latitude': None, 'longitude': None})
+            continue
+        lat, lon = rng.choice(hotspots)
+        people.append({
+            'id': i,
+            'latitude': lat + rng.gauss(0, 0.0003),
+            'longitude': lon + rng.gauss(0, 0.0005),
+            'current_zone': rng.choice((None, 'Mad Bishop & Bear', 'Paddington Office - Ground')),
+        })
+    rng.shuffle(people)
+    return people
+
+
+def check_equivalence(trials, rng):
+    """Property check: both methods give identical clusters on random inputs."""
+    for trial in range(trials):
+        people = make_people(rng.randint(0, 120), rng, spread=rng.choice((0.0005, 0.002, 0.02)))
+        greedy = cluster_people(people, method='greedy')
+        grid = cluster_people(people, method='grid')
+        if greedy != grid:
+            raise SystemExit(f'grid clustering differs from greedy on trial {trial}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--trials', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    check_equivalence(args.trials, rng)
+    print(f'equivalence: {args.trials} random inputs identical')
+
+    print(f"{'people':>8} {'clusters':>9} {'greedy ms':>10} {'grid ms':>9} {'speedup':>9}")
+    for size in args.sizes:
+        people = make_people(size, rng)
+
+        start = time.perf_counter()
+        greedy = cluster_people(people, method='greedy')
+        greedy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        grid = cluster_people(people, method='grid')
+        grid_time = time.perf_counter() - start
+
+        if greedy != grid:
+            raise SystemExit(f'grid clustering differs from greedy at {size} people')
+
+        print(f"{size:>8} {len(grid):>9} {greedy_time * 1e3:>10.1f} {grid_time * 1e3:>9.2f} "
+              f"{greedy_time / grid_time:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Micro-benchmarks for the geo_utils kernels.
+
+Times haversine_distance, detect_zone (zone list and ZoneIndex),
+cluster_people (greedy and grid) and group_by_zone. Each runs on seeded
+synthetic datasets at several scales:
+  paddington  people scattered within about 600 m of the office
+  crowd       everyone in one pub
+  city        people spread across about 15 km of London
+
+For each kernel the report gives ns per item processed (a distance, a
+point, a person or a cluster) and the peak memory traced during one call.
+Timings are the fastest of several rounds with garbage collection off,
+which is the least disturbed by other load on the machine.
+
+--save writes the results as a baseline. --check compares against one and
+exits with status 1 if any kernel got slower than --threshold allows.
+Comparisons are relative to a pure-Python reference loop timed in the same
+run, so a baseline carries over between machines of different speeds, and
+a kernel over the threshold is timed again before it counts as a
+regression, so one noisy measurement doesn't fail the check.
+
+Run from the app directory:
+    python benchmarks/bench_geo.py
+    python benchmarks/bench_geo.py --save benchmarks/geo_baseline.json
+    python benchmarks/bench_geo.py --quick --check benchmarks/geo_baseline.json
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from geo_utils import ZoneIndex, cluster_people, detect_zone, group_by_zone, haversine_distance  # noqa: E402
+from zones import DEFAULT_ZONES  # noqa: E402
+
+# Paddington office, centre of the synthetic datasets
+CENTER = (51.5170, -0.1780)
+CROWD_VENUE = next(z for z in DEFAULT_ZONES if z['type'] == 'pub')
+
+SIZES = (100, 1000, 10000)
+QUICK_SIZES = (100, 1000)
+
+# Target time per timing round, and rounds per kernel (seconds, count)
+ROUND_TIME = 0.05
+ROUNDS = 7
+
+# Extra timings of a kernel that looks regressed before it fails --check
+RETRIES = 2
+
+
+def scatter(count, rng, center, meters):
+    """`count` points uniformly within `meters` of `center`."""
+    points = []
+    for _ in range(count):
+        distance = meters * math.sqrt(rng.random())
+        bearing = rng.uniform(0, 2 * math.pi)
+        points.append((center[0] + distance * math.cos(bearing) / 111_320,
+                       center[1] + distance * math.sin(bearing) / (111_320 * math.cos(math.radians(center[0])))))
+    return points
+
+
+DATASETS = {
+    'paddington': lambda count, rng: scatter(count, rng, CENTER, 600),
+    'crowd': lambda count, rng: scatter(count, rng, (CROWD_VENUE['latitude'], CROWD_VENUE['longitude']),
+                                        CROWD_VENUE['radius']),
+    'city': lambda count, rng: scatter(count, rng, CENTER, 15_000),
+}
+
+
+def people_from(points):
+    return [{'id': i, 'latitude': lat, 'longitude': lon} for i, (lat, lon) in enumerate(points)]
+
+
+def clusters_from(points):
+    clusters = cluster_people(people_from(points), method='grid')
+    index = ZoneIndex(DEFAULT_ZONES)
+    for cluster in clusters:
+        zone = index.lookup(cluster['center']['latitude'], cluster['center']['longitude'])
+        cluster['zone'] = zone['name'] if zone else None
+    return clusters
+
+
+# name -> (prepare(points) -> (args, items), run(*args), largest size worth running)
+KERNELS = {
+    'haversine_distance': (
+        lambda points: ((points, points[1:] + points[:1]), len(points)),
+        lambda a, b: [haversine_distance(p[0], p[1], q[0], q[1]) for p, q in zip(a, b)],
+        None),
+    'detect_zone/list': (
+        lambda points: ((points, DEFAULT_ZONES), len(points)),
+        lambda points, zones: [detect_zone(lat, lon, zones) for lat, lon in points],
+        None),
+    'detect_zone/index': (
+        lambda points: ((points, ZoneIndex(DEFAULT_ZONES)), len(points)),
+        lambda points, index: [detect_zone(lat, lon, index) for lat, lon in points],
+        None),
+    'cluster_people/greedy': (
+        lambda points: ((people_from(points),), len(points)),
+        lambda people: cluster_people(people, method='greedy'),
+        1000),
+    'cluster_people/grid': (
+        lambda points: ((people_from(points),), len(points)),
+        lambda people: cluster_people(people, method='grid'),
+        None),
+    'group_by_zone': (
+        lambda points: (lambda clusters: ((clusters, DEFAULT_ZONES), max(1, len(clusters))))(clusters_from(points)),
+        lambda clusters, zones: group_by_zone(clusters, zones),
+        None),
+}
+
+
+def reference(n=10_000):
+    """Pure-Python loop used to normalise timings across machines."""
+    total = 0.0
+    for i in range(n):
+        total += math.sin(i) * 0.5
+    return total
+
+
+def time_per_call(fn, args):
+    """Fastest seconds per call over ROUNDS rounds of about ROUND_TIME each."""
+    fn(*args)  # Warm up
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn(*args)
+        if time.perf_counter() - start >= ROUND_TIME / 5 or loops >= 1 << 20:
+            break
+        loops *= 2
+    per_call = (time.perf_counter() - start) / loops
+    loops = max(1, int(ROUND_TIME / per_call)) if per_call else loops
+
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn(*args)
+            samples.append((time.perf_counter() - start) / loops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return min(samples)
+
+
+def peak_bytes(fn, args):
+    """Peak memory traced during one call."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def dataset_points(dataset, size, seed):
+    return DATASETS[dataset](size, random.Random(f'{seed}-{dataset}-{size}'))
+
+
+def measure(name, points):
+    prepare, fn, _ = KERNELS[name]
+    args, items = prepare(points)
+    return {
+        'ns_per_item': round(time_per_call(fn, args) / items * 1e9, 1),
+        'items': items,
+        'peak_kb': round(peak_bytes(fn, args) / 1024, 1)
+    }
+
+
+def run(sizes, seed, kernels):
+    """Results by 'kernel dataset size', and the reference loop's time in ns."""
+    results = {}
+    reference_ns = []
+    for dataset in DATASETS:
+        for size in sizes:
+            # Timed between groups; the fastest is the least disturbed
+            reference_ns.append(time_per_call(reference, ()) * 1e9)
+            points = dataset_points(dataset, size, seed)
+            for name in kernels:
+                max_size = KERNELS[name][2]
+                if max_size is None or size <= max_size:
+                    results[f'{name} {dataset} {size}'] = measure(name, points)
+    return results, min(reference_ns)
+
+
+def slowdown(result, reference_ns, old, baseline):
+    """Reference-relative time against the baseline's; 1.0 means unchanged."""
+    return (result['ns_per_item'] / reference_ns) / (old['ns_per_item'] / baseline['reference_ns'])
+
+
+def check(results, reference_ns, baseline, threshold, seed):
+    """Kernels still slower than `threshold` allows after being timed again."""
+    regressions = []
+    for key, result in results.items():
+        old = baseline['results'].get(key)
+        if old is None or slowdown(result, reference_ns, old, baseline) <= 1 + threshold:
+            continue
+        name, dataset, size = key.split(' ')
+        points = dataset_points(dataset, int(size), seed)
+        for _ in range(RETRIES):
+            retry = measure(name, points)
+            if retry['ns_per_item'] < result['ns_per_item']:
+                result = results[key] = retry
+        ratio = slowdown(result, reference_ns, old, baseline)
+        if ratio > 1 + threshold:
+            regressions.append((key, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+')
+    parser.add_argument('--quick', action='store_true', help=f'only sizes {QUICK_SIZES}')
+    parser.add_argument('--kernels', nargs='+', choices=sorted(KERNELS), default=list(KERNELS))
+    parser.add_argument('--seed', type=int, default=18)
+    parser.add_argument('--save', help='write the results to this baseline file')
+    parser.add_argument('--check', help='baseline file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, e.g. 0.25 for 25%%')
+    args = parser.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    results, reference_ns = run(sizes, args.seed, args.kernels)
+
+    baseline = None
+    regressions = []
+    if args.check:
+        with open(args.check) as f:
+            baseline = json.load(f)
+        if baseline.get('seed') != args.seed:
+            print("Warning: the baseline was made with a different seed")
+        regressions = check(results, reference_ns, baseline, args.threshold, args.seed)
+
+    print(f"reference loop {reference_ns / 1e3:.1f} us")
+    print(f"{'kernel':<24} {'dataset':<11} {'size':>6} {'ns/item':>10} {'peak KB':>9} {'vs base':>8}")
+    for key, result in results.items():
+        name, dataset, size = key.split(' ')
+        change = ''
+        if baseline and key in baseline['results']:
+            change = f"{(slowdown(result, reference_ns, baseline['results'][key], baseline) - 1) * 100:+.0f}%"
+        print(f"{name:<24} {dataset:<11} {size:>6} {result['ns_per_item']:>10.1f} {result['peak_kb']:>9.1f} {change:>8}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'seed': args.seed, 'reference_ns': round(reference_ns, 1), 'results': results},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.save}")
+
+    if baseline:
+        for key, ratio in regressions:
+            print(f"REGRESSION {key}: {ratio:.2f}x the baseline")
+        if regressions:
+            sys.exit(1)
+        print(f"No kernel regressed by more than {args.threshold:.0%}")
+
+
+if __name__ == '__main__':
+    main()
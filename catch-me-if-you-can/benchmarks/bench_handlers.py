@@ -0,0 +1,147 @@
+"""
+Benchmark: Socket.IO handler latency with the sender taken from the socket's
+registration, against looking the sender up in the database on every event
+as the handlers used to (User.query.get of the payload's user_id, twice for
+tag_user).
+
+Connects and registers --users sockets with the Flask-SocketIO test client
+against a scratch SQLite database, then calls the location_update, set_vibe,
+set_status and tag_user handlers directly, in the same request context
+Socket.IO gives them, and reports per-event latency.
+
+Run from the app directory:
+    python benchmarks/bench_handlers.py
+    python benchmarks/bench_handlers.py --users 500 --events 5000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+CENTER = (51.5170, -0.1780)
+VIBES = ('available', 'quick_chat', 'focused')
+
+# Share of each event type in the mix
+MIX = (('location_update', 0.85), ('set_vibe', 0.05), ('set_status', 0.05), ('tag_user', 0.05))
+
+
+def setup(users):
+    """Import the app against a scratch database and register one socket per user."""
+    db_path = os.path.join(tempfile.mkdtemp(prefix='bench-handlers-'), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ.setdefault('EMAIL_PROVIDER', 'fake')
+    os.environ['METRICS_ENABLED'] = 'false'
+    os.environ['LOCATION_MIN_INTERVAL_MS'] = '0'
+
+    import app as server
+    from models import User, db
+
+    with server.app.app_context():
+        rows = [User(email=f'bench{i}@virginmediao2.co.uk', name=f'Bench {i}', is_active=True,
+                     latitude=CENTER[0], longitude=CENTER[1]) for i in range(users)]
+        db.session.add_all(rows)
+        db.session.commit()
+        for row in rows:
+            server.add_presence(row)
+        user_ids = [row.id for row in rows]
+
+    sockets = {}
+    for user_id in user_ids:
+        client = server.socketio.test_client(server.app)
+        client.emit('register_user', {'user_id': user_id})
+        sockets[user_id] = server.socketio.server.manager.sid_from_eio_sid(client.eio_sid, '/')
+    return server, User, db, sockets
+
+
+def events(user_ids, count, rng):
+    """(event, sender, payload) tuples in the MIX proportions."""
+    names = [name for name, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    for _ in range(count):
+        name = rng.choices(names, weights)[0]
+        user_id = rng.choice(user_ids)
+        if name == 'location_update':
+            payload = {'user_id': user_id, 'latitude': CENTER[0] + rng.uniform(-0.003, 0.003),
+                       'longitude': CENTER[1] + rng.uniform(-0.005, 0.005)}
+        elif name == 'set_vibe':
+            payload = {'user_id': user_id, 'vibe': rng.choice(VIBES)}
+        elif name == 'set_status':
+            payload = {'user_id': user_id, 'status': f'status {rng.randrange(100)}'}
+        else:
+            payload = {'tagger_id': user_id, 'tagged_id': rng.choice(user_ids)}
+        yield name, user_id, payload
+
+
+def reset_tags(server, db):
+    """Expire every pending tag so each run creates the same tags."""
+    from models import TagRequest
+    with server.app.app_context():
+        for tag in TagRequest.query.filter_by(status='pending').all():
+            server.pending_tags.discard(tag.id)
+            tag.status = 'expired'
+        db.session.commit()
+
+
+def run(server, User, db, sockets, count, lookup, seed):
+    """Per-event latencies in ms, by event name."""
+    reset_tags(server, db)
+    handlers = server.socketio.server.handlers['/']
+    bound_sender = server.sender
+
+    def looked_up_sender():
+        # What every handler did before sockets were bound to users
+        data = server.request.event['args'][0]
+        ids = [data['tagger_id'], data['tagged_id']] if 'tagger_id' in data else [data['user_id']]
+        rows = [db.session.get(User, user_id) for user_id in ids]
+        return rows[0].id if rows[0] else None
+
+    server.sender = looked_up_sender if lookup else bound_sender
+    latencies = {name: [] for name, _ in MIX}
+    try:
+        for name, user_id, payload in events(list(sockets), count, random.Random(seed)):
+            started = time.perf_counter()
+            handlers[name](sockets[user_id], payload)
+            latencies[name].append((time.perf_counter() - started) * 1000)
+    finally:
+        server.sender = bound_sender
+    return latencies
+
+
+def p95(values):
+    return values[int(len(values) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--events', type=int, default=3000)
+    parser.add_argument('--seed', type=int, default=21)
+    args = parser.parse_args()
+
+    server, User, db, sockets = setup(args.users)
+    run(server, User, db, sockets, 200, False, args.seed)  # Warm up
+
+    results = {}
+    for label, lookup in (('lookup', True), ('bound', False)):
+        results[label] = run(server, User, db, sockets, args.events, lookup, args.seed)
+
+    print(f"{'event':<16} {'n':>6} {'lookup p50':>11} {'bound p50':>10} {'lookup p95':>11} {'bound p95':>10}")
+    for name, _ in MIX:
+        before, after = sorted(results['lookup'][name]), sorted(results['bound'][name])
+        if not before:
+            continue
+        print(f"{name:<16} {len(before):>6} {statistics.median(before):>11.3f} {statistics.median(after):>10.3f} "
+              f"{p95(before):>11.3f} {p95(after):>10.3f}")
+    total_before = sum(sum(v) for v in results['lookup'].values())
+    total_after = sum(sum(v) for v in results['bound'].values())
+    print(f"total ms: lookup {total_before:.0f}, bound {total_after:.0f} ({total_before / total_after:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
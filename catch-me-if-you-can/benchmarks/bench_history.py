@@ -0,0 +1,101 @@
+"""
+Benchmark: location history under the full location_update rate.
+
+Records a synthetic day of walking for --users people into a LocationHistory
+on a scratch directory and reports:
+  record     cost of the call the location_update handler makes per point
+  flush      the background write of one second of points
+  query      /api/history's work for one user over the whole day, reading
+             the log through mmap with NumPy and with struct, and the
+             Douglas-Peucker / bucketed downsampling of the result
+
+Run from the app directory:
+    python benchmarks/bench_history.py
+    python benchmarks/bench_history.py --users 500 --points 2000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import history  # noqa: E402
+from history import LocationHistory, bucket, simplify  # noqa: E402
+
+CENTER = (51.5170, -0.1780)
+
+# Location updates per second across everyone
+UPDATE_RATE = 2000
+
+
+def fill(store, users, points, rng):
+    """Write `points` updates spread over the last 24h, a second's worth at a time."""
+    positions = {u: [CENTER[0], CENTER[1]] for u in range(1, users + 1)}
+    start = time.time() - 86400
+    step = 86400 / points
+    record_ns, flush_ms = [], []
+    for n in range(points):
+        user_id = rng.randint(1, users)
+        position = positions[user_id]
+        position[0] += rng.uniform(-2e-5, 2e-5)
+        position[1] += rng.uniform(-3e-5, 3e-5)
+        started = time.perf_counter_ns()
+        store.record(user_id, position[0], position[1], at=start + n * step)
+        record_ns.append(time.perf_counter_ns() - started)
+        if (n + 1) % UPDATE_RATE == 0:
+            started = time.perf_counter()
+            store.flush()
+            flush_ms.append((time.perf_counter() - started) * 1000)
+    store.flush()
+    return record_ns, flush_ms
+
+
+def timed(function, *args, repeat=5):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        times.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--points', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=24)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-history-')
+    store = LocationHistory(directory, 'bench')
+    record_ns, flush_ms = fill(store, args.users, args.points, random.Random(args.seed))
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    record_ns.sort()
+    print(f"{args.points} points from {args.users} users, {size / 1e6:.1f} MB on disk "
+          f"({size / args.points:.0f} bytes/point)")
+    print(f"record: p50 {record_ns[len(record_ns) // 2] / 1000:.2f} us, "
+          f"p99 {record_ns[int(len(record_ns) * 0.99)] / 1000:.2f} us")
+    print(f"flush of {UPDATE_RATE} points: p50 {statistics.median(flush_ms):.2f} ms, max {max(flush_ms):.2f} ms")
+
+    now = time.time()
+    scans = [('numpy', history.np), ('struct', None)] if history.np is not None else [('struct', None)]
+    numpy_module = history.np
+    for label, module in scans:
+        history.np = module
+        points, elapsed = timed(store.trajectory, 1, now - 86400, now, repeat=3)
+        print(f"query one user's day ({label} scan): {elapsed:.1f} ms, {len(points)} points")
+    history.np = numpy_module
+
+    for label, function, value in (('douglas-peucker 5 m', simplify, 5.0), ('douglas-peucker 20 m', simplify, 20.0),
+                                   ('bucket 60 s', bucket, 60), ('bucket 600 s', bucket, 600)):
+        track, elapsed = timed(function, points, value)
+        print(f"{label:<22} {elapsed:>7.1f} ms  {len(points)} -> {len(track)} points")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark: pending-tag connection checks per location update.
+
+Compares the old path (OR-filtered TagRequest query, lazy tagger/tagged loads,
+scalar haversine per tag) with the in-memory PendingTagIndex and presence
+store, at 10k pending tags by default.
+
+Run from the app directory:
+    python benchmarks/bench_pending_tags.py
+    python benchmarks/bench_pending_tags.py --tags 10000 --users 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask  # noqa: E402
+
+from geo_utils import haversine_distance  # noqa: E402
+from models import db, User, TagRequest  # noqa: E402
+from presence import PresenceStore  # noqa: E402
+from tag_index import PendingTagIndex  # noqa: E402
+
+CONNECTION_DISTANCE = 30
+
+# Paddington office, centre of the synthetic datasets
+CENTER = (51.5170, -0.1780)
+
+
+def seed_database(users, tags, rng):
+    people = [User(email=f'user.{i}@example.com', name=f'User {i}', is_active=True,
+                   latitude=CENTER[0] + rng.uniform(-0.01, 0.01),
+                   longitude=CENTER[1] + rng.uniform(-0.015, 0.015))
+              for i in range(users)]
+    db.session.add_all(people)
+    db.session.commit()
+
+    ids = [u.id for u in people]
+    pairs = set()
+    while len(pairs) < tags:
+        a, b = rng.sample(ids, 2)
+        pairs.add((a, b))
+    db.session.add_all(TagRequest(tagger_id=a, tagged_id=b) for a, b in pairs)
+    db.session.commit()
+    return ids
+
+
+def old_path(user_id):
+    pending = TagRequest.query.filter(
+        ((TagRequest.tagger_id == user_id) | (TagRequest.tagged_id == user_id)),
+        TagRequest.status == 'pending'
+    ).all()
+    connected = []
+    for tag in pending:
+        if not tag.tagger or not tag.tagged or not tag.tagger.latitude or not tag.tagged.latitude:
+            continue
+        distance = haversine_distance(tag.tagger.latitude, tag.tagger.longitude,
+                                      tag.tagged.latitude, tag.tagged.longitude)
+        if distance <= CONNECTION_DISTANCE:
+            connected.append(tag.id)
+    db.session.expunge_all()
+    return connected
+
+
+def new_path(user_id, index, presence):
+    candidates = index.for_user(user_id)
+    if not candidates:
+        return []
+    connected = []
+    for tag in candidates:
+        tagger, tagged = presence.get(tag.tagger_id), presence.get(tag.tagged_id)
+        distance = haversine_distance(tagger.latitude, tagger.longitude,
+                                      tagged.latitude, tagged.longitude)
+        if distance <= CONNECTION_DISTANCE:
+            connected.append(tag.id)
+    return connected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tags', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+
+        with app.app_context():
+            db.create_all()
+            ids = seed_database(args.users, args.tags, rng)
+
+            presence = PresenceStore()
+            presence.load(User.query.all())
+            index = PendingTagIndex()
+            index.load(TagRequest.query.filter_by(status='pending').all())
+            db.session.expunge_all()
+
+            updates = [rng.choice(ids) for _ in range(args.updates)]
+
+            start = time.perf_counter()
+            old_results = [sorted(old_path(u)) for u in updates]
+            old_time = (time.perf_counter() - start) / len(updates)
+
+            start = time.perf_counter()
+            new_results = [sorted(new_path(u, index, presence)) for u in updates]
+            new_time = (time.perf_counter() - start) / len(updates)
+
+    if old_results != new_results:
+        raise SystemExit('index path found different connections from the query path')
+
+    print(f'{args.tags} pending tags, {args.users} users, {args.updates} location updates')
+    print(f'query path: {old_time * 1e6:10.1f} us/update')
+    print(f'index path: {new_time * 1e6:10.1f} us/update  ({old_time / new_time:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: the broadcast tick's serialise-and-diff step with and without
+the serialisation cache.
+
+Each tick moves a share of the people, then serialises everyone active and
+diffs against the last state, as flush_state does. Uncached, every record
+is turned into a fresh dict and compared field by field; cached, only the
+moved ones are rebuilt and the rest are skipped by identity. Also checks
+that both paths produce the same deltas.
+
+Run from the app directory:
+    python benchmarks/bench_serialization.py
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from presence import PresenceStore  # noqa: E402
+from state_sync import StateTracker  # noqa: E402
+
+CENTER = (51.5170, -0.1780)
+NOW = datetime(2024, 5, 1, 9, 0, 0)
+
+
+def populate(store, size, rng):
+    for user_id in range(1, size + 1):
+        store.put({
+            'id': user_id, 'email': f'user{user_id}@example.com', 'name': f'User {user_id}',
+            'avatar_emoji': '🦊', 'team': rng.choice(('Platform', 'Payments', None)),
+            'latitude': CENTER[0] + rng.uniform(-0.01, 0.01),
+            'longitude': CENTER[1] + rng.uniform(-0.016, 0.016),
+            'floor': None, 'vibe': 'available', 'status': None, 'last_seen': NOW, 'is_active': True
+        })
+
+
+def run(size, ticks, moved, cached, seed):
+    rng = random.Random(seed)
+    store = PresenceStore()
+    populate(store, size, rng)
+    tracker = StateTracker()
+
+    def serialise():
+        if cached:
+            return store.active_people()
+        return [r.to_dict() for r in store._records.values() if r.is_active and r.latitude is not None]
+
+    tracker.update(serialise(), [])
+    deltas = []
+    elapsed = 0.0
+    for tick in range(ticks):
+        for user_id in rng.sample(range(1, size + 1), int(size * moved)):
+            record = store.get(user_id)
+            store.update(user_id, latitude=record.latitude + 0.0001,
+                         last_seen=NOW + timedelta(seconds=tick + 1))
+        start = time.perf_counter()
+        delta = tracker.update(serialise(), [])
+        elapsed += time.perf_counter() - start
+        deltas.append(sorted(p['id'] for p in delta['people']['upserted']))
+    return elapsed / ticks, deltas, store.serialized.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--ticks', type=int, default=20)
+    parser.add_argument('--moved', type=float, default=0.05, help='share of people moving per tick')
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'people':>7} {'uncached ms':>12} {'cached ms':>10} {'speedup':>8} {'hit rate':>9}")
+    for size in args.sizes:
+        plain, plain_deltas, _ = run(size, args.ticks, args.moved, False, args.seed)
+        fast, fast_deltas, stats = run(size, args.ticks, args.moved, True, args.seed)
+        if plain_deltas != fast_deltas:
+            raise SystemExit(f'cached deltas differ from uncached ones for {size} people')
+        print(f"{size:>7} {plain * 1000:>12.2f} {fast * 1000:>10.2f} {plain / fast:>7.1f}x {stats['hit_rate']:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Benchmark: the database under a location storm with each storage profile.
+
+Replays the same synthetic event stream against:
+  sqlite-default  SQLite as it was configured before storage.py: rollback
+                  journal, no pragmas, one executemany UPDATE per flush and
+                  reads on the writer's engine
+  sqlite-wal      storage.SQLiteProfile: WAL, tuned pragmas, a compiled-once
+                  UPDATE and a read-only pool
+  postgresql      storage.PostgresProfile, with --postgres-url (a scratch
+                  database: its users and tag_requests tables are emptied)
+
+The writer moves people in a PresenceStore and flushes it on the app's
+write-behind interval, creates tags and expires old ones in batches. A
+reader thread meanwhile runs the broadcast tick's active-tags query and a
+user lookup (the /api/user fallback) in a loop.
+The report gives flush latency, reader throughput and latency, and how
+often either side hit a lock error.
+
+Run from the app directory:
+    python benchmarks/bench_storage.py
+    python benchmarks/bench_storage.py --users 5000 --seconds 20
+    python benchmarks/bench_storage.py --postgres-url postgresql://localhost/catchme_bench
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from models import TagRequest, User, db  # noqa: E402
+from presence import PresenceStore  # noqa: E402
+from storage import StorageProfile, storage_profile  # noqa: E402
+
+CENTER = (51.5170, -0.1780)
+
+# Writer: location updates per second, flush interval (s), tags created per flush
+UPDATE_RATE = 2000
+FLUSH_INTERVAL = 0.25
+TAGS_PER_FLUSH = 5
+
+
+class DefaultSQLite(StorageProfile):
+    """SQLite with SQLAlchemy's defaults, as before storage profiles."""
+
+    name = 'sqlite-default'
+
+
+def open_profile(name, workdir, postgres_url):
+    if name == 'sqlite-default':
+        profile = DefaultSQLite(f"sqlite:///{os.path.join(workdir, 'default.db')}")
+    elif name == 'sqlite-wal':
+        profile = storage_profile(f"sqlite:///{os.path.join(workdir, 'wal.db')}")
+    else:
+        profile = storage_profile(postgres_url)
+    engine = create_engine(profile.url, **profile.engine_options())
+    profile.install(engine)
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.query(TagRequest).delete()
+        session.query(User).delete()
+        session.commit()
+    return profile
+
+
+def seed(profile, users, rng):
+    """Users in the database and a presence store tracking them."""
+    with Session(profile.engine) as session:
+        session.add_all(User(id=i, email=f'bench{i}@virginmediao2.co.uk', name=f'Bench {i}', is_active=True,
+                             latitude=CENTER[0], longitude=CENTER[1]) for i in range(1, users + 1))
+        session.commit()
+        store = PresenceStore()
+        store.load(session.query(User).all())
+    return store
+
+
+def writer(profile, store, users, seconds, rng, result):
+    """Moves people at UPDATE_RATE and flushes, tags and expires every FLUSH_INTERVAL."""
+    per_flush = int(UPDATE_RATE * FLUSH_INTERVAL)
+    deadline = time.perf_counter() + seconds
+    with Session(profile.engine) as session:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            now = datetime.utcnow()
+            for user_id in rng.sample(range(1, users + 1), min(per_flush, users)):
+                record = store.get(user_id)
+                store.update(user_id, latitude=record.latitude + rng.uniform(-1e-4, 1e-4),
+                             longitude=record.longitude + rng.uniform(-1e-4, 1e-4), last_seen=now)
+            try:
+                store.flush(session, User, profile.write_rows)
+                session.add_all(TagRequest(tagger_id=rng.randint(1, users), tagged_id=rng.randint(1, users),
+                                           expires_at=now + timedelta(seconds=rng.uniform(1, 5)))
+                                for _ in range(TAGS_PER_FLUSH))
+                session.query(TagRequest).filter(TagRequest.status == 'pending', TagRequest.expires_at <= now) \
+                    .update({'status': 'expired'}, synchronize_session=False)
+                session.commit()
+            except OperationalError:
+                session.rollback()
+                result['write_errors'] += 1
+            elapsed = time.perf_counter() - started
+            result['flush_ms'].append(elapsed * 1000)
+            time.sleep(max(0.0, FLUSH_INTERVAL - elapsed))
+
+
+def reader(profile, users, stop, result):
+    """The read path's queries in a loop until `stop` is set."""
+    rng = random.Random(users)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with profile.read_session() as session:
+                TagRequest.active_query(session=session).all()
+                session.get(User, rng.randint(1, users))
+        except OperationalError:
+            result['read_errors'] += 1
+        result['read_ms'].append((time.perf_counter() - started) * 1000)
+
+
+def run(name, workdir, postgres_url, users, seconds, seed_value):
+    rng = random.Random(seed_value)
+    profile = open_profile(name, workdir, postgres_url)
+    store = seed(profile, users, rng)
+    result = {'flush_ms': [], 'read_ms': [], 'write_errors': 0, 'read_errors': 0}
+    stop = threading.Event()
+    thread = threading.Thread(target=reader, args=(profile, users, stop, result))
+    thread.start()
+    try:
+        writer(profile, store, users, seconds, rng, result)
+    finally:
+        stop.set()
+        thread.join()
+    profile.engine.dispose()
+    if profile.read_engine is not profile.engine:
+        profile.read_engine.dispose()
+    result['rows'] = store.rows_flushed
+    return result
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=22)
+    parser.add_argument('--postgres-url', help='scratch Postgres database to include')
+    args = parser.parse_args()
+
+    profiles = ['sqlite-default', 'sqlite-wal'] + (['postgresql'] if args.postgres_url else [])
+    workdir = tempfile.mkdtemp(prefix='bench-storage-')
+    print(f"{args.users} users, {UPDATE_RATE} location updates/s flushed every {FLUSH_INTERVAL * 1000:.0f} ms, "
+          f"{args.seconds:.0f}s per profile")
+    print(f"{'profile':<15} {'flushes':>8} {'rows/s':>8} {'flush p50':>10} {'flush p95':>10} {'flush max':>10} "
+          f"{'reads/s':>8} {'read p95':>9} {'errors':>7}")
+    for name in profiles:
+        result = run(name, workdir, args.postgres_url, args.users, args.seconds, args.seed)
+        flushes = result['flush_ms']
+        print(f"{name:<15} {len(flushes):>8} {result['rows'] / args.seconds:>8.0f} "
+              f"{statistics.median(flushes):>10.2f} {percentile(flushes, 0.95):>10.2f} {max(flushes):>10.2f} "
+              f"{len(result['read_ms']) / args.seconds:>8.0f} {percentile(result['read_ms'], 0.95):>9.2f} "
+              f"{result['write_errors'] + result['read_errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark: JSON vs packed (wire.py) state payloads.
+
+For snapshots and typical deltas at 100, 1k and 10k people, reports payload
+size (raw and deflated, as with websocket compression) and encode time, and
+checks that every packed payload decodes back to the JSON one up to the
+format's precision (whole-second timestamps, 1e-7 degree coordinates).
+
+Run from the app directory:
+    python benchmarks/bench_wire.py
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from state_sync import StateTracker  # noqa: E402
+from wire import decode_state, encode_state  # noqa: E402
+
+# Paddington office, centre of the synthetic datasets
+CENTER = (51.5170, -0.1780)
+
+TEAMS = ('', 'Platform', 'Payments', 'Mobile', 'Data', 'Design')
+VIBES = ('available', 'busy', 'lunch', 'coffee', 'focus')
+EMOJIS = ('🦊', '🐼', '🐨', '🦁', '🐸', '🐙', '🦄', '🐝')
+NOW = datetime(2024, 5, 1, 9, 0, 0)
+
+
+def person(user_id, rng):
+    return {
+        'id': user_id, 'email': f'first.last{user_id}@example.com', 'name': f'First Last{user_id}',
+        'avatar_emoji': rng.choice(EMOJIS), 'team': rng.choice(TEAMS),
+        'latitude': CENTER[0] + rng.uniform(-0.01, 0.01), 'longitude': CENTER[1] + rng.uniform(-0.016, 0.016),
+        'floor': rng.choice((None, None, 1, 2, 3)), 'vibe': rng.choice(VIBES),
+        'status': rng.choice(('', '', 'In a meeting', 'Heads down')),
+        'last_seen': (NOW + timedelta(seconds=rng.uniform(0, 3600))).isoformat(), 'is_active': True
+    }
+
+
+def tag(tag_id, people, rng):
+    tagger, tagged = rng.sample(people, 2)
+    created = NOW + timedelta(seconds=rng.randint(0, 3600))
+    return {'id': tag_id, 'tagger': tagger, 'tagged': tagged, 'created_at': created.isoformat(),
+            'expires_at': (created + timedelta(minutes=5)).isoformat(), 'status': 'pending'}
+
+
+def normalise(value):
+    """What the packed format keeps: whole seconds and 1e-7 degrees."""
+    if isinstance(value, dict):
+        return {k: normalise(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalise(v) for v in value]
+    if isinstance(value, float):
+        return round(value, 7)
+    if isinstance(value, str) and len(value) > 19 and value[10:11] == 'T':
+        return value[:19]
+    return value
+
+
+def timed(fn, payload, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(payload)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def report(label, size, payload, repeat):
+    encoded_json, json_time = timed(lambda p: json.dumps(p).encode(), payload, repeat)
+    packed, packed_time = timed(encode_state, payload, repeat)
+    if normalise(decode_state(packed)) != normalise(payload):
+        raise SystemExit(f'packed {label} for {size} people does not decode to the JSON payload')
+
+    print(f"{size:>7} {label:>9} {len(encoded_json) / 1024:>9.1f} {len(packed) / 1024:>9.1f} "
+          f"{len(zlib.compress(encoded_json)) / 1024:>9.1f} {len(zlib.compress(packed)) / 1024:>9.1f} "
+          f"{json_time * 1000:>8.2f} {packed_time * 1000:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--moved', type=float, default=0.2, help='share of people in a delta')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'people':>7} {'payload':>9} {'JSON KB':>9} {'packed KB':>9} {'JSON z':>9} {'packed z':>9} "
+          f"{'JSON ms':>8} {'pack ms':>8}")
+    for size in args.sizes:
+        people = [person(i, rng) for i in range(size)]
+        tags = [tag(i, people, rng) for i in range(max(1, size // 50))]
+        tracker = StateTracker()
+        tracker.update(people, tags)
+        for i in rng.sample(range(size), int(size * args.moved)):
+            people[i] = dict(people[i], latitude=people[i]['latitude'] + 0.0001,
+                             last_seen=(NOW + timedelta(hours=1, seconds=i)).isoformat())
+        delta = tracker.update(people, tags)
+
+        repeat = max(1, 2000 // size)
+        report('snapshot', size, tracker.snapshot(), repeat)
+        report('delta', size, delta, repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark: ZoneIndex grid lookup vs the linear detect_zone scan.
+Also checks the two agree on every point, including points on zone edges;
+exits non-zero if they differ anywhere but within EDGE_TOLERANCE of an edge.
+
+Run from the app directory:
+    python benchmarks/bench_zone_index.py
+    python benchmarks/bench_zone_index.py --sizes 50 5000 --lookups 2000
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from geo_utils import METERS_PER_DEGREE, ZoneIndex, detect_zone, haversine_distance  # noqa: E402
+from zones import DEFAULT_ZONES  # noqa: E402
+
+# Paddington office, centre of the synthetic datasets
+CENTER = (51.5170, -0.1780)
+
+ZONE_TYPES = ('office', 'pub', 'restaurant', 'cafe', 'gym')
+
+# Meters from a zone's edge within which the two lookups may round differently
+EDGE_TOLERANCE = 1e-6
+
+
+def make_zones(count, rng):
+    """`count` zones spread over an area that grows with count (about constant density)."""
+    if count <= len(DEFAULT_ZONES):
+        return DEFAULT_ZONES[:count]
+
+    spread = 0.01 * (count / 50) ** 0.5
+    return [{
+        'name': f'zone_{i}',
+        'type': rng.choice(ZONE_TYPES),
+        'latitude': CENTER[0] + rng.uniform(-spread, spread),
+        'longitude': CENTER[1] + rng.uniform(-spread, spread) * 1.6,
+        'radius': rng.choice((15, 20, 25, 30, 40)),
+    } for i in range(count)]
+
+
+def make_points(zones, count, rng):
+    """Lookup points: a third near a zone centre, a third on a zone's edge, a third across the area."""
+    lats = [z['latitude'] for z in zones]
+    lons = [z['longitude'] for z in zones]
+    points = []
+    for i in range(count):
+        zone = rng.choice(zones)
+        if i % 3 == 1:
+            points.append((zone['latitude'] + rng.uniform(-3e-4, 3e-4),
+                           zone['longitude'] + rng.uniform(-4e-4, 4e-4)))
+        elif i % 3 == 2:
+            # Just inside, on or just outside the circle
+            reach = zone['radius'] * rng.choice((1 - 1e-9, 1.0, 1 + 1e-9)) / METERS_PER_DEGREE
+            angle = rng.uniform(0, 2 * math.pi)
+            points.append((zone['latitude'] + reach * math.sin(angle),
+                           zone['longitude'] + reach * math.cos(angle) / math.cos(math.radians(zone['latitude']))))
+        else:
+            points.append((rng.uniform(min(lats), max(lats)), rng.uniform(min(lons), max(lons))))
+    return points
+
+
+def on_edge(point, zone) -> bool:
+    return zone is not None and abs(haversine_distance(*point, zone['latitude'], zone['longitude'])
+                                    - zone['radius']) <= EDGE_TOLERANCE
+
+
+def mismatches(points, expected, found):
+    """Points where the lookups differ other than by rounding on an edge of either answer."""
+    return [point for point, a, b in zip(points, expected, found)
+            if a is not b and not (on_edge(point, a) or on_edge(point, b))]
+
+
+def time_lookups(fn, points):
+    start = time.perf_counter()
+    results = [fn(lat, lon) for lat, lon in points]
+    return (time.perf_counter() - start) / len(points), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 5000, 500000])
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--linear-budget', type=float, default=5.0,
+                        help='approximate seconds to spend on the linear scan per size')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'zones':>8} {'build ms':>10} {'linear us':>11} {'index us':>10} {'speedup':>9} {'checked':>8}")
+
+    for size in args.sizes:
+        zones = make_zones(size, rng)
+        points = make_points(zones, args.lookups, rng)
+
+        start = time.perf_counter()
+        index = ZoneIndex(zones)
+        build = time.perf_counter() - start
+
+        index_per, index_results = time_lookups(index.lookup, points)
+
+        # Keep the O(Z) scan bounded at large sizes by sampling points
+        per_zone_cost = 1e-6
+        linear_count = max(10, min(len(points), int(args.linear_budget / (size * per_zone_cost))))
+        linear_per, linear_results = time_lookups(lambda lat, lon: detect_zone(lat, lon, zones),
+                                                  points[:linear_count])
+
+        differ = mismatches(points, linear_results, index_results)
+        if differ:
+            raise SystemExit(f'{len(differ)} lookups differ between linear scan and index at {size} zones, '
+                             f'e.g. at {differ[0]}')
+
+        print(f"{size:>8} {build * 1e3:>10.1f} {linear_per * 1e6:>11.1f} {index_per * 1e6:>10.2f} "
+              f"{linear_per / index_per:>8.0f}x {linear_count:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Randomised consistency check of the incremental zone occupancy counters.
+
+Imports the app against a scratch database and drives a random mix of
+location updates (through the location_update handler), updates replicated
+from another worker, people going inactive and coming back, and zone
+reloads that drop, move and resize zones. Every --check-every events and
+after every reload, the counters are compared with a full recompute:
+detect_zone over every active person against the plain list of zones.
+Exits non-zero on the first mismatch. Also times reading the counts
+against the recompute.
+
+Run from the app directory:
+    python benchmarks/check_occupancy.py
+    python benchmarks/check_occupancy.py --users 500 --events 50000 --seed 7
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+_tmp = tempfile.mkdtemp(prefix='check-occupancy-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'occupancy.db')}"
+os.environ['HISTORY_DIR'] = ''
+os.environ['METRICS_ENABLED'] = 'false'
+os.environ['LOCATION_MIN_INTERVAL_MS'] = '0'
+os.environ.setdefault('EMAIL_PROVIDER', 'fake')
+
+import app as server  # noqa: E402
+from geo_utils import METERS_PER_DEGREE, detect_zone  # noqa: E402
+from models import User, db  # noqa: E402
+from occupancy import recount  # noqa: E402
+from zones import DEFAULT_ZONES  # noqa: E402
+
+# Share of each event type in the mix
+MIX = (('move', 0.80), ('remote_move', 0.10), ('leave', 0.04), ('return', 0.05), ('reload', 0.01))
+
+
+def setup(users):
+    with server.app.app_context():
+        rows = [User(email=f'occ{i}@virginmediao2.co.uk', name=f'Occ {i}', is_active=True) for i in range(users)]
+        db.session.add_all(rows)
+        db.session.commit()
+        for row in rows:
+            server.add_presence(row)
+        user_ids = [row.id for row in rows]
+
+    sockets = {}
+    for user_id in user_ids:
+        client = server.socketio.test_client(server.app)
+        client.emit('register_user', {'user_id': user_id})
+        sockets[user_id] = server.socketio.server.manager.sid_from_eio_sid(client.eio_sid, '/')
+    return sockets
+
+
+def position(rng):
+    """Somewhere in or just around a random zone, so people land in zones, on edges and outside."""
+    zone = rng.choice(DEFAULT_ZONES)
+    reach = zone['radius'] * 1.5 / METERS_PER_DEGREE
+    return zone['latitude'] + rng.uniform(-reach, reach), zone['longitude'] + rng.uniform(-reach, reach)
+
+
+def reshuffled_zones(rng):
+    """The default zones with some dropped, moved and resized."""
+    zones = []
+    for zone in copy.deepcopy(DEFAULT_ZONES):
+        if rng.random() < 0.1:
+            continue
+        if rng.random() < 0.3:
+            zone['radius'] = max(5, zone['radius'] * rng.uniform(0.5, 2.0))
+            zone['latitude'] += rng.uniform(-20, 20) / METERS_PER_DEGREE
+        zones.append(zone)
+    return zones
+
+
+def compare():
+    """Differences between the counters and a full recompute, or an empty list."""
+    zones = server.zone_registry.zones
+    by_zone, by_type = recount(server.presence.records(), lambda lat, lon: detect_zone(lat, lon, zones))
+    problems = []
+    if dict(by_zone) != dict(server.occupancy.by_zone):
+        problems.append(f'zones: counted {dict(server.occupancy.by_zone)}, recomputed {dict(by_zone)}')
+    if dict(by_type) != dict(server.occupancy.by_type):
+        problems.append(f'types: counted {dict(server.occupancy.by_type)}, recomputed {dict(by_type)}')
+    return problems
+
+
+def run(sockets, events, check_every, rng):
+    handler = server.socketio.server.handlers['/']['location_update']
+    names = [name for name, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    user_ids = list(sockets)
+    checks = 0
+    for n in range(1, events + 1):
+        name = rng.choices(names, weights)[0]
+        user_id = rng.choice(user_ids)
+        with server.app.app_context():
+            if name == 'move':
+                latitude, longitude = position(rng)
+                handler(sockets[user_id], {'latitude': latitude, 'longitude': longitude})
+            elif name == 'remote_move':
+                latitude, longitude = position(rng)
+                server.apply_remote_presence({'user_id': user_id,
+                                              'fields': {'latitude': latitude, 'longitude': longitude}})
+            elif name == 'leave':
+                server.mark_inactive(user_id)
+            elif name == 'return':
+                server.apply_remote_presence({'user_id': user_id, 'fields': {'is_active': True}})
+            else:
+                server.reload_zones(reshuffled_zones(rng))
+
+        if name == 'reload' or n % check_every == 0 or n == events:
+            checks += 1
+            problems = compare()
+            if problems:
+                print(f'MISMATCH after event {n} ({name}):')
+                for problem in problems:
+                    print(f'  {problem}')
+                return False, checks
+    return True, checks
+
+
+def timing(repeat=200):
+    zones = server.zone_registry.zones
+    started = time.perf_counter()
+    for _ in range(repeat):
+        server.occupancy.to_dict()
+    counters = (time.perf_counter() - started) / repeat * 1000
+    started = time.perf_counter()
+    for _ in range(max(1, repeat // 20)):
+        recount(server.presence.records(), lambda lat, lon: detect_zone(lat, lon, zones))
+    full = (time.perf_counter() - started) / max(1, repeat // 20) * 1000
+    return counters, full
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--check-every', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=25)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sockets = setup(args.users)
+    ok, checks = run(sockets, args.events, args.check_every, rng)
+    stats = server.occupancy.stats()
+    print(f"{args.events} events, {args.users} users, {checks} checks, {stats['rebuilds']} zone reloads, "
+          f"{stats['moves']} zone changes counted: {'consistent' if ok else 'INCONSISTENT'}")
+    counters, full = timing()
+    print(f"read counts: {counters:.3f} ms, full recompute: {full:.2f} ms "
+          f"({server.occupancy.stats()['counted']} people in zones)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
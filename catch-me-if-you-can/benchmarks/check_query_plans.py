@@ -0,0 +1,112 @@
+"""
+Query-count and EXPLAIN harness for the realtime read path.
+
+Builds a database the way an old deployment would have (tables without the
+newer indexes), runs the schema upgrade, then checks that:
+  * get_active_people() and the pending-tag lookup in location_update run no SQL,
+  * get_active_tags() runs exactly one query, counted on the read engine too,
+  * none of the hot filters falls back to a table scan.
+Exits non-zero on any failure.
+
+Run from the app directory:
+    python benchmarks/check_query_plans.py
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+_tmp = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'plans.db')}"
+
+from sqlalchemy import event  # noqa: E402
+
+import app as app_module  # noqa: E402
+from migrations import check_query_plans, upgrade_schema  # noqa: E402
+from models import db, User, TagRequest  # noqa: E402
+
+# Expected statement counts per read
+QUERY_BUDGET = {
+    'get_active_people': 0,
+    'pending_tags.for_user': 0,
+    'get_active_tags': 1,
+}
+
+
+class QueryCounter:
+    """Statements run on any of `engines` (the same engine given twice counts once)."""
+
+    def __init__(self, *engines):
+        self.engines = list(dict.fromkeys(engines))
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._on_execute)
+
+
+def seed(users=200, tags=400):
+    people = [User(email=f'user.{i}@example.com', name=f'User {i}', is_active=i % 3 != 0,
+                   latitude=51.517 + i * 1e-5 if i % 4 else None, longitude=-0.178)
+              for i in range(users)]
+    db.session.add_all(people)
+    db.session.commit()
+    db.session.add_all(TagRequest(tagger_id=people[i % users].id, tagged_id=people[(i * 7 + 1) % users].id)
+                       for i in range(tags))
+    db.session.commit()
+
+
+def main():
+    failures = []
+    with app_module.app.app_context():
+        # Simulate a pre-index deployment, then upgrade it
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(bind=db.engine)
+        created = upgrade_schema(db.engine)
+        print(f'upgrade created: {", ".join(sorted(created))}')
+
+        seed()
+        db.session.execute(db.text('ANALYZE'))
+        app_module.presence.load(User.query.all())
+        app_module.pending_tags.load(TagRequest.query.filter_by(status='pending').all())
+
+        reads = {
+            'get_active_people': app_module.get_active_people,
+            'pending_tags.for_user': lambda: app_module.pending_tags.for_user(1),
+            'get_active_tags': app_module.get_active_tags,
+        }
+        for name, read in reads.items():
+            db.session.expire_all()
+            with QueryCounter(db.engine, app_module.storage.read_engine) as counter:
+                read()
+            status = 'ok' if counter.count == QUERY_BUDGET[name] else 'FAIL'
+            print(f'{name:24} {counter.count} queries (expected {QUERY_BUDGET[name]}) {status}')
+            if status != 'ok':
+                failures.append(name)
+
+        try:
+            plans = check_query_plans(db.session)
+        except AssertionError as e:
+            print(e)
+            failures.append('query plans')
+        else:
+            for name, plan in plans.items():
+                print(f'{name:24} {" | ".join(plan)}')
+
+    if failures:
+        raise SystemExit(f'failed: {", ".join(failures)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,445 @@
+"""
+Load generator for the realtime path.
+
+Starts `python app.py` on a fresh SQLite database and connects simulated
+users over websocket Socket.IO. Each one registers, then walks between
+DEFAULT_ZONES venues at walking pace, sending location_update on an
+interval and now and then set_vibe or tag_user. Clients run as gevent
+greenlets spread over a few driver processes, so thousands fit on one
+machine.
+
+Reports:
+  - events sent per second, by type
+  - ack latency: handler round trip
+  - broadcast latency: from sending a location_update to the state_delta
+    that carries the new position reaching that client
+  - server CPU and resident memory, read from /proc (Linux)
+  - the server's /api/stats at the end
+
+A JSON report is written for regression tracking. --compare prints the
+changes against an earlier one. Everything runs locally and offline;
+email goes to the fake provider.
+
+Run from the app directory:
+    python benchmarks/loadgen.py --clients 1000 --seconds 30 --output report.json
+    python benchmarks/loadgen.py --clients 1000 --compare report.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask  # noqa: E402
+
+from models import db, User  # noqa: E402
+from zones import DEFAULT_ZONES  # noqa: E402
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+WALKING_SPEED = 1.4  # m/s
+METERS_PER_DEGREE = 111_320
+VIBES = ('available', 'quick_chat', 'focused')
+TEAMS = ('Data Science', 'Data Products', 'Data Platforms', 'Other')
+
+# Broadcast samples not matched within this long count as lost (seconds)
+LOST_AFTER = 10.0
+
+
+class Walker:
+    """A simulated user walking from venue to venue, pausing at each."""
+
+    def __init__(self, user_id, rng):
+        self.user_id = user_id
+        self.rng = rng
+        venue = rng.choice(DEFAULT_ZONES)
+        self.latitude, self.longitude = self._near(venue)
+        self.target = self._near(rng.choice(DEFAULT_ZONES))
+        self.dwell = 0.0
+
+    def _near(self, venue):
+        """A point inside the venue's radius."""
+        spread = venue['radius'] / METERS_PER_DEGREE * 0.7
+        return (venue['latitude'] + self.rng.uniform(-spread, spread),
+                venue['longitude'] + self.rng.uniform(-spread, spread) / math.cos(math.radians(venue['latitude'])))
+
+    def step(self, seconds):
+        if self.dwell > 0:
+            self.dwell -= seconds
+            return
+
+        d_lat = (self.target[0] - self.latitude) * METERS_PER_DEGREE
+        d_lon = (self.target[1] - self.longitude) * METERS_PER_DEGREE * math.cos(math.radians(self.latitude))
+        distance = math.hypot(d_lat, d_lon)
+        stride = WALKING_SPEED * seconds
+        if distance <= stride:
+            self.latitude, self.longitude = self.target
+            self.target = self._near(self.rng.choice(DEFAULT_ZONES))
+            self.dwell = self.rng.uniform(30, 300)
+            return
+        self.latitude += (self.target[0] - self.latitude) * stride / distance
+        self.longitude += (self.target[1] - self.longitude) * stride / distance
+
+
+def seed_database(path, users):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(email=f'user.{i}@example.com', name=f'User {i}', team=TEAMS[i % len(TEAMS)],
+                                 is_active=True) for i in range(users)])
+        db.session.commit()
+        return [user.id for user in User.query.all()]
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+    return {'count': len(values), 'p50': at(0.5), 'p90': at(0.9), 'p99': at(0.99), 'max': round(values[-1], 2)}
+
+
+def drive(conn, url, user_ids, options, seed):
+    """
+    Driver process: one greenlet per simulated client. The Socket.IO client
+    is only imported here, after patching, so its websockets are cooperative.
+    """
+    from gevent import monkey
+    monkey.patch_all(ssl=False)  # Plain ws:// only
+
+    import engineio
+    import gevent
+    import gevent.queue
+    import socketio
+    from gevent.pool import Pool
+    from gevent.socket import wait_read
+
+    from wire import decode_state
+
+    class EngineClient(engineio.Client):
+        def create_queue(self, *args, **kwargs):
+            # engineio sets .Empty on its queues, which gevent's patched Queue doesn't allow
+            queue = type('ClientQueue', (gevent.queue.Queue,), {'Empty': gevent.queue.Empty})
+            return queue(*args, **kwargs)
+
+        def _trigger_event(self, event, *args, **kwargs):
+            # Handle messages in order, like the browser: a binary event's header
+            # and attachment arrive as two messages and must not be reordered
+            if event == 'message':
+                kwargs['run_async'] = False
+            return super()._trigger_event(event, *args, **kwargs)
+
+    class Client(socketio.Client):
+        def _engineio_client_class(self):
+            return EngineClient
+
+    rng = random.Random(seed)
+    sent = {'register_user': 0, 'location_update': 0, 'set_vibe': 0, 'tag_user': 0}
+    ack_ms, broadcast_ms = [], []
+    totals = {'deltas': 0, 'delta_bytes': 0, 'coalesced': 0, 'lost': 0, 'errors': 0, 'connect_failed': 0}
+    clients = {}
+
+    def connect(user_id):
+        walker = Walker(user_id, random.Random(rng.random()))
+        pending = {}  # rounded position -> send time
+        client = Client(reconnection=False)
+
+        @client.on('state_delta')
+        def on_delta(data):
+            totals['deltas'] += 1
+            if isinstance(data, bytes):
+                totals['delta_bytes'] += len(data)
+                data = decode_state(data)
+            if not pending:
+                return
+            now = time.perf_counter()
+            for person in data['people']['upserted']:
+                if person['id'] != user_id:
+                    continue
+                sent_at = pending.pop((round(person['latitude'], 6), round(person['longitude'], 6)), None)
+                if sent_at is not None:
+                    broadcast_ms.append((now - sent_at) * 1000)
+                    # Earlier positions merged into this broadcast won't come
+                    for key in [k for k, t in pending.items() if t < sent_at]:
+                        del pending[key]
+                        totals['coalesced'] += 1
+
+        auth = {'wire': 'packed'} if options['wire'] == 'packed' else None
+        try:
+            client.connect(url, transports=['websocket'], auth=auth, wait_timeout=30)
+        except Exception:
+            totals['connect_failed'] += 1
+            return
+        clients[user_id] = (client, walker, pending)
+
+    def emit(client, event, data):
+        started = time.perf_counter()
+        sent[event] += 1
+        try:
+            client.emit(event, data, callback=lambda *args: ack_ms.append((time.perf_counter() - started) * 1000))
+        except Exception:
+            totals['errors'] += 1
+        return started
+
+    def simulate(user_id, deadline):
+        client, walker, pending = clients[user_id]
+        interval = options['interval']
+        gevent.sleep(rng.uniform(0, interval))  # Spread clients over the interval
+        while time.time() < deadline:
+            walker.step(interval)
+            position = (round(walker.latitude, 6), round(walker.longitude, 6))
+            pending[position] = emit(client, 'location_update', {
+                'user_id': user_id, 'latitude': position[0], 'longitude': position[1]})
+            if rng.random() < options['vibe_rate']:
+                emit(client, 'set_vibe', {'user_id': user_id, 'vibe': rng.choice(VIBES)})
+            if rng.random() < options['tag_rate']:
+                emit(client, 'tag_user', {'tagger_id': user_id, 'tagged_id': rng.choice(user_ids)})
+            now = time.perf_counter()
+            for key in [k for k, t in pending.items() if now - t > LOST_AFTER]:
+                del pending[key]
+                totals['lost'] += 1
+            gevent.sleep(interval)
+
+    # Connect a bounded number at a time so the server isn't hit by a connection storm
+    Pool(options['connect_concurrency']).map(connect, user_ids)
+    for user_id, (client, _, _) in clients.items():
+        emit(client, 'register_user', {'user_id': user_id})
+    conn.send(('ready', len(clients)))
+
+    wait_read(conn.fileno())
+    deadline = conn.recv()
+    gevent.joinall([gevent.spawn(simulate, user_id, deadline) for user_id in clients])
+    gevent.sleep(2)  # Let the last broadcasts arrive
+
+    for client, _, pending in clients.values():
+        totals['lost'] += len(pending)
+    gevent.joinall([gevent.spawn(client.disconnect) for client, _, _ in clients.values()], timeout=30)
+    conn.send({'sent': sent, 'ack_ms': ack_ms, 'broadcast_ms': broadcast_ms, 'totals': totals})
+
+
+def start_server(port, workdir, options):
+    env = dict(os.environ,
+               PORT=str(port),
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'load.db')}",
+               EMAIL_PROVIDER='fake',
+               FLASK_DEBUG='false')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    if options['throttle_ms'] is not None:
+        env['LOCATION_MIN_INTERVAL_MS'] = str(options['throttle_ms'])
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=APP_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/stats', timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise SystemExit('Server did not start')
+
+
+def stop_server(process):
+    process.terminate()
+    process.wait(timeout=10)
+
+
+class ProcessSampler:
+    """Samples a process's CPU time and resident memory from /proc."""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.rss_mb = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def cpu_seconds(self):
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self._ticks  # utime + stime
+        except (OSError, IndexError):
+            return None
+
+    def rss(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self.rss()
+            if rss is not None:
+                self.rss_mb.append(rss)
+
+
+def run(args):
+    options = {
+        'interval': args.interval, 'vibe_rate': args.vibe_rate, 'tag_rate': args.tag_rate,
+        'wire': args.wire, 'connect_concurrency': args.connect_concurrency, 'throttle_ms': args.throttle_ms
+    }
+    workdir = tempfile.mkdtemp(prefix='loadgen-')
+    try:
+        user_ids = seed_database(os.path.join(workdir, 'load.db'), args.clients)
+        server = start_server(args.port, workdir, options)
+        sampler = ProcessSampler(server.pid)
+        sampler.start()
+        try:
+            url = f'http://127.0.0.1:{args.port}'
+            drivers = []
+            for i in range(args.processes):
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=drive, args=(child, url, user_ids[i::args.processes],
+                                                                      options, args.seed + i))
+                process.start()
+                drivers.append((process, parent))
+
+            connected = sum(parent.recv()[1] for _, parent in drivers)
+            print(f"{connected}/{args.clients} clients connected; running for {args.seconds:.0f}s")
+            cpu_before, started = sampler.cpu_seconds(), time.time()
+            deadline = started + args.seconds
+            for _, parent in drivers:
+                parent.send(deadline)
+            time.sleep(max(0.0, deadline - time.time()))
+            elapsed = time.time() - started
+            cpu_after = sampler.cpu_seconds()
+            # Before the drivers disconnect, so the counters reflect the run
+            server_stats = requests.get(f'{url}/api/stats', timeout=60).json()
+            results = [parent.recv() for _, parent in drivers]
+            for process, _ in drivers:
+                process.join()
+        finally:
+            sampler.stop()
+            stop_server(server)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    sent = {event: sum(r['sent'][event] for r in results) for event in results[0]['sent']}
+    totals = {key: sum(r['totals'][key] for r in results) for key in results[0]['totals']}
+    seconds = args.seconds
+    return {
+        'config': dict(options, clients=args.clients, seconds=args.seconds, processes=args.processes, seed=args.seed),
+        'environment': {
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'started_at': datetime.utcnow().isoformat(timespec='seconds')
+        },
+        'clients_connected': connected,
+        'events_sent': sent,
+        'events_per_sec': round(sum(sent.values()) / seconds, 1),
+        'location_updates_per_sec': round(sent['location_update'] / seconds, 1),
+        'ack_ms': percentiles([ms for r in results for ms in r['ack_ms']]),
+        'broadcast_ms': percentiles([ms for r in results for ms in r['broadcast_ms']]),
+        'deltas_received': totals.pop('deltas'),
+        'delta_kb_received': round(totals.pop('delta_bytes') / 1024, 1),
+        'broadcasts': totals,
+        'server': {
+            'cpu_percent': round((cpu_after - cpu_before) / elapsed * 100, 1) if cpu_before is not None else None,
+            'rss_mb_peak': round(max(sampler.rss_mb), 1) if sampler.rss_mb else None,
+            'rss_mb_end': round(sampler.rss_mb[-1], 1) if sampler.rss_mb else None
+        },
+        'server_stats': server_stats
+    }
+
+
+# Report fields compared by --compare, and whether higher is better
+COMPARED = [
+    ('events_per_sec', True), ('ack_ms.p50', False), ('ack_ms.p99', False),
+    ('broadcast_ms.p50', False), ('broadcast_ms.p99', False), ('broadcasts.lost', False),
+    ('server.cpu_percent', False), ('server.rss_mb_peak', False),
+]
+
+
+def lookup(report, path):
+    value = report
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(report, baseline):
+    if baseline['config'] != report['config']:
+        print("Warning: the baseline was run with a different configuration")
+    print(f"{'metric':<22} {'baseline':>10} {'now':>10} {'change':>8}")
+    for path, higher_is_better in COMPARED:
+        old, new = lookup(baseline, path), lookup(report, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        flag = ' !' if worse and abs(change) >= 10 else ''
+        print(f"{path:<22} {old:>10} {new:>10} {change:>+7.1f}%{flag}")
+
+
+def summarise(report):
+    print(f"events/s {report['events_per_sec']}  (location updates/s {report['location_updates_per_sec']})")
+    for name in ('ack_ms', 'broadcast_ms'):
+        stats = report[name]
+        if stats:
+            print(f"{name:<13} p50 {stats['p50']:>8}  p90 {stats['p90']:>8}  p99 {stats['p99']:>8}  "
+                  f"max {stats['max']:>8}  (n={stats['count']})")
+    server = report['server']
+    print(f"server CPU {server['cpu_percent']}%  RSS peak {server['rss_mb_peak']} MB  "
+          f"deltas received {report['deltas_received']}  lost {report['broadcasts']['lost']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between location updates')
+    parser.add_argument('--vibe-rate', type=float, default=0.01, help='chance of set_vibe per update')
+    parser.add_argument('--tag-rate', type=float, default=0.002, help='chance of tag_user per update')
+    parser.add_argument('--wire', choices=('json', 'packed'), default='json')
+    parser.add_argument('--throttle-ms', type=int, help="override the server's LOCATION_MIN_INTERVAL_MS")
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1), help='driver processes')
+    parser.add_argument('--connect-concurrency', type=int, default=50)
+    parser.add_argument('--port', type=int, default=5700)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='earlier JSON report to compare against')
+    args = parser.parse_args()
+
+    report = run(args)
+    summarise(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
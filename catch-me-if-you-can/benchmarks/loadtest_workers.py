@@ -0,0 +1,194 @@
+"""
+Load test: location-update throughput with 1..N app workers.
+
+Starts N `python app.py` processes on consecutive ports sharing a local://
+message bus and one SQLite database, then drives them with websocket
+Socket.IO clients spread round-robin across the workers, each in its own
+process with one registered socket per user it drives, keeping one
+acknowledged update in flight. Throughput is the sum of
+presence updates the workers handled per second. After each run the
+script checks that every worker agrees on a sample of users' positions,
+giving replication up to --settle seconds to catch up.
+
+Run from the app directory:
+    python benchmarks/loadtest_workers.py
+    python benchmarks/loadtest_workers.py --workers 4 --clients 32 --seconds 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+import socketio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask  # noqa: E402
+
+from models import db, User  # noqa: E402
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Paddington office, centre of the synthetic positions
+CENTER = (51.5170, -0.1780)
+
+
+def seed_database(path, users):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(email=f'user.{i}@example.com', name=f'User {i}', is_active=True)
+                            for i in range(users)])
+        db.session.commit()
+        return [user.id for user in User.query.all()]
+
+
+def start_workers(count, base_port, workdir):
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'load.db')}",
+               SOCKETIO_MESSAGE_QUEUE=f"local://{os.path.join(workdir, 'bus')}",
+               LOCATION_MIN_INTERVAL_MS='0',
+               FLASK_DEBUG='false')
+    processes = []
+    for i in range(count):
+        processes.append(subprocess.Popen(
+            [sys.executable, 'app.py'], cwd=APP_DIR,
+            env=dict(env, PORT=str(base_port + i)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    for i in range(count):
+        url = f'http://127.0.0.1:{base_port + i}/api/stats'
+        for _ in range(100):
+            try:
+                requests.get(url, timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        else:
+            stop_workers(processes)
+            raise SystemExit(f'Worker on port {base_port + i} did not start')
+    return processes
+
+
+def stop_workers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait(timeout=10)
+
+
+def total_updates(ports):
+    return sum(requests.get(f'http://127.0.0.1:{port}/api/stats', timeout=5).json()['presence']['updates']
+               for port in ports)
+
+
+def drive(url, user_ids, deadline, seed, results):
+    rng = random.Random(seed)
+    last_sent = {}
+    # Events act as the user a socket registered as, so one socket per user
+    sockets = {}
+    try:
+        for user_id in user_ids:
+            client = sockets[user_id] = socketio.Client()
+            client.connect(url, transports=['websocket'])
+            client.call('register_user', {'user_id': user_id}, timeout=30)
+        while time.time() < deadline:
+            for user_id in user_ids:
+                lat = CENTER[0] + rng.uniform(-0.002, 0.002)
+                lon = CENTER[1] + rng.uniform(-0.003, 0.003)
+                # Wait for the ack so each process keeps one update in flight
+                sockets[user_id].call('location_update', {'latitude': lat, 'longitude': lon}, timeout=30)
+                last_sent[user_id] = (lat, lon)
+    finally:
+        for client in sockets.values():
+            client.disconnect()
+        results.put(last_sent)
+
+
+def check_consistency(ports, last_sent, sample, settle):
+    """
+    Every worker should report the last position sent for each sampled user
+    once replication caught up. Returns the seconds that took.
+    """
+    started = time.time()
+    for user_id in sample:
+        expected = last_sent[user_id]
+        for port in ports:
+            while True:
+                data = requests.get(f'http://127.0.0.1:{port}/api/user/{user_id}', timeout=5).json()
+                actual = (data['latitude'], data['longitude'])
+                if actual == expected:
+                    break
+                if time.time() - started > settle:
+                    raise SystemExit(f'Worker {port} has user {user_id} at {actual}, expected {expected}')
+                time.sleep(0.1)
+    return time.time() - started
+
+
+def run(workers, clients, seconds, settle, user_ids, base_port, workdir, rng):
+    processes = start_workers(workers, base_port, workdir)
+    ports = [base_port + i for i in range(workers)]
+    try:
+        before = total_updates(ports)
+        deadline = time.time() + seconds
+        results = multiprocessing.Queue()
+        drivers = []
+        for i in range(clients):
+            # Each client owns a slice of users so positions have one writer
+            owned = user_ids[i::clients]
+            url = f'http://127.0.0.1:{ports[i % workers]}'
+            driver = multiprocessing.Process(target=drive, args=(url, owned, deadline, rng.random(), results))
+            driver.start()
+            drivers.append(driver)
+        last_sent = {}
+        for _ in drivers:
+            last_sent.update(results.get())
+        for driver in drivers:
+            driver.join()
+
+        handled = total_updates(ports) - before
+        lag = check_consistency(ports, last_sent, rng.sample(sorted(last_sent), min(20, len(last_sent))), settle)
+        return handled / seconds, lag
+    finally:
+        stop_workers(processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='largest worker count to test')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--settle', type=float, default=10,
+                        help='seconds the workers get to agree after the clients stop')
+    parser.add_argument('--port', type=int, default=5600, help='port of the first worker')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{args.clients} websocket clients, {args.users} users, {args.seconds:.0f}s per run")
+    print(f"{'workers':>8} {'updates/s':>12} {'speedup':>8} {'settled in':>11}")
+
+    baseline = None
+    for workers in range(1, args.workers + 1):
+        workdir = tempfile.mkdtemp(prefix='loadtest-')
+        try:
+            user_ids = seed_database(os.path.join(workdir, 'load.db'), args.users)
+            rate, lag = run(workers, args.clients, args.seconds, args.settle, user_ids, args.port, workdir, rng)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        baseline = baseline or rate
+        print(f"{workers:>8} {rate:>12.0f} {rate / baseline:>7.2f}x {lag:>10.1f}s")
+
+
+if __name__ == '__main__':
+    main()
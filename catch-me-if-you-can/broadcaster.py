@@ -0,0 +1,159 @@
+"""
+Coalescing broadcast loop and inbound location throttling.
+Handlers mark state dirty; a background task flushes at most once per tick,
+so a burst of events turns into a single emission. Location updates inside
+a user's throttle window are held rather than lost: the latest one is
+applied when the window ends, so a user who stops moving is still shown
+where they stopped.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Default flush tick for the broadcast loop (seconds)
+BROADCAST_INTERVAL = 0.25
+
+# Default minimum gap between accepted location updates from one user (seconds)
+LOCATION_MIN_INTERVAL = 1.0
+
+
+class BroadcastScheduler:
+    """Merges broadcast requests and flushes them from a background task."""
+
+    def __init__(self, socketio, flush: Callable[[], None], interval: float = BROADCAST_INTERVAL):
+        self.socketio = socketio
+        self.flush = flush
+        self.interval = interval
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._task = None
+
+        self.requested = 0
+        self.merged = 0
+        self.flushes = 0
+
+    def mark_dirty(self):
+        """Request a broadcast on the next tick."""
+        self.requested += 1
+        if self._dirty:
+            self.merged += 1
+        self._dirty = True
+
+    def flush_now(self):
+        """Flush immediately, merging any pending request."""
+        with self._lock:
+            self._dirty = False
+            self.flushes += 1
+            self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            if not self._dirty:
+                continue
+            try:
+                self.flush_now()
+            except Exception as e:
+                print(f"Broadcast failed: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            'interval_ms': int(self.interval * 1000),
+            'requested': self.requested,
+            'merged': self.merged,
+            'flushes': self.flushes,
+            'pending': self._dirty
+        }
+
+
+class LocationThrottle:
+    """Per-user rate limit for inbound location updates, keeping the latest one held back."""
+
+    def __init__(self, min_interval: float = LOCATION_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._last_accepted = {}
+        self._held = {}  # user id -> latest update dropped inside their window
+        self._wake = threading.Event()
+        self._task = None
+
+        self.accepted = 0
+        self.dropped = 0
+        self.released = 0
+
+    def allow(self, user_id, update=None, now: float = None) -> bool:
+        """
+        Return True if this user's update should be processed now. Otherwise
+        `update` (if given) replaces any update already held for the user,
+        to be handed back by pop_due() when the window ends.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        last = self._last_accepted.get(user_id)
+        if last is not None and now - last < self.min_interval:
+            self.dropped += 1
+            if update is not None:
+                if user_id not in self._held:
+                    self._wake.set()
+                self._held[user_id] = update
+            return False
+
+        self._last_accepted[user_id] = now
+        self._held.pop(user_id, None)
+        self.accepted += 1
+        return True
+
+    def pop_due(self, now: float = None) -> List[Tuple]:
+        """(user id, update) for each held update whose window has ended; each counts as accepted now."""
+        if now is None:
+            now = time.monotonic()
+        due = [(user_id, update) for user_id, update in self._held.items()
+               if now - self._last_accepted[user_id] >= self.min_interval]
+        for user_id, _ in due:
+            del self._held[user_id]
+            self._last_accepted[user_id] = now
+        self.accepted += len(due)
+        self.released += len(due)
+        return due
+
+    def next_release(self) -> Optional[float]:
+        """Monotonic time the first held update is due, or None."""
+        if not self._held:
+            return None
+        return min(self._last_accepted[user_id] for user_id in self._held) + self.min_interval
+
+    def forget(self, user_id):
+        self._last_accepted.pop(user_id, None)
+        self._held.pop(user_id, None)
+
+    def start(self, socketio, apply: Callable[[List[Tuple]], None]):
+        """Hand held updates to `apply` as their windows end, from a background task."""
+        if self._task is None and self.min_interval > 0:
+            self._task = socketio.start_background_task(self._run, apply)
+
+    def _run(self, apply):
+        while True:
+            try:
+                due = self.pop_due()
+                if due:
+                    apply(due)
+            except Exception as e:
+                print(f"Held location updates failed: {e}")
+            release = self.next_release()
+            self._wake.wait(self.min_interval if release is None else max(release - time.monotonic(), 0.01))
+            self._wake.clear()
+
+    def stats(self) -> Dict:
+        return {
+            'min_interval_ms': int(self.min_interval * 1000),
+            'accepted': self.accepted,
+            'dropped': self.dropped,
+            'held': len(self._held),
+            'released': self.released,
+            'tracked_users': len(self._last_accepted)
+        }
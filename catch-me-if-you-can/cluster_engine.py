@@ -0,0 +1,340 @@
+"""
+Incremental clustering of people by proximity.
+Clusters are groups of people linked by chains of neighbours within
+CLUSTER_DISTANCE meters. A location change only re-examines the grid cells
+around the person's old and new positions, and reports what changed as
+cluster events. When someone leaves a cluster, a search grows from their
+former neighbours at once and stops as soon as they have all met, so a
+cluster is only walked in full when it really splits.
+"""
+
+import math
+from collections import deque
+from itertools import count
+from typing import Dict, List, Optional
+
+from geo_utils import CLUSTER_DISTANCE, EARTH_RADIUS, METERS_PER_DEGREE, ZoneIndex
+
+# Grid cells are sized for this latitude; people further from the equator aren't clustered
+DEFAULT_MAX_LATITUDE = 60.0
+
+# Seeds of each of two neighbouring sub-cells compared when checking whether a cluster split
+LINK_PROBES = 4
+
+# Cluster event types
+EVENT_JOINED = 'joined'
+EVENT_LEFT = 'left'
+EVENT_MOVED = 'moved'
+EVENT_MERGED = 'merged'
+EVENT_SPLIT = 'split'
+
+
+class Cluster:
+    """Members and running coordinate sums of one cluster."""
+
+    __slots__ = ('id', 'members', 'sum_lat', 'sum_lon')
+
+    def __init__(self, cluster_id: str):
+        self.id = cluster_id
+        self.members = set()
+        self.sum_lat = 0.0
+        self.sum_lon = 0.0
+
+    @property
+    def count(self) -> int:
+        return len(self.members)
+
+    @property
+    def center(self) -> Optional[Dict]:
+        if not self.members:
+            return None
+        return {'latitude': self.sum_lat / len(self.members), 'longitude': self.sum_lon / len(self.members)}
+
+
+class ClusterEngine:
+    """Maintains proximity clusters under single-person updates."""
+
+    def __init__(self, distance: float = CLUSTER_DISTANCE, max_latitude: float = DEFAULT_MAX_LATITUDE,
+                 zone_index: Optional[ZoneIndex] = None):
+        self.distance = distance
+        self.zone_index = zone_index
+        self._ids = count(1)
+        self._positions = {}
+        self._trig = {}  # user id -> (lat, lon in radians, cos(lat)), for distance checks
+        self._cell_of = {}
+        self._cells = {}
+        self._cluster_of = {}
+        self._clusters = {}
+
+        # Linked when the haversine term is at most this (see geo_utils._haversine_term)
+        self._limit = math.sin(distance / EARTH_RADIUS / 2) ** 2
+
+        # Fixed grid: cells are `distance` tall and at least `distance` wide up to max_latitude
+        self.max_latitude = min(max_latitude, 89.0)
+        self._lat_step = self.distance / METERS_PER_DEGREE
+        edge_lat = min(self.max_latitude + 1.0, 89.9)
+        self._lon_step = self.distance / (METERS_PER_DEGREE * math.cos(math.radians(edge_lat)))
+        # Cells are split this many times each way into sub-cells no wider than `distance`
+        # corner to corner (cells are widest in meters at the equator), so everyone in one
+        # sub-cell is linked
+        self._fine = math.ceil(math.hypot(1.0, 1.0 / math.cos(math.radians(edge_lat))))
+
+    # ---- grid -------------------------------------------------------------
+
+    def in_range(self, latitude: float, longitude: float) -> bool:
+        """Whether a position fits the grid; others (outliers, bad fixes) are left out of clusters."""
+        return abs(latitude) <= self.max_latitude and abs(longitude) <= 180.0
+
+    def _key(self, lat: float, lon: float):
+        return (math.floor(lat / self._lat_step), math.floor(lon / self._lon_step))
+
+    def _fine_key(self, lat: float, lon: float):
+        return (math.floor(lat * self._fine / self._lat_step), math.floor(lon * self._fine / self._lon_step))
+
+    def _index(self, user_id, lat: float, lon: float):
+        lat_rad = math.radians(lat)
+        self._trig[user_id] = (lat_rad, math.radians(lon), math.cos(lat_rad))
+        key = self._key(lat, lon)
+        self._cell_of[user_id] = key
+        self._cells.setdefault(key, set()).add(user_id)
+
+    def _unindex(self, user_id):
+        key = self._cell_of.pop(user_id)
+        del self._trig[user_id]
+        cell = self._cells[key]
+        cell.discard(user_id)
+        if not cell:
+            del self._cells[key]
+
+    def _neighbours(self, lat: float, lon: float, exclude=None, within=None):
+        """Ids within `distance` of a point, optionally restricted to the set `within`."""
+        row, col = self._key(lat, lon)
+        lat1 = math.radians(lat)
+        lon1 = math.radians(lon)
+        cos1 = math.cos(lat1)
+        limit = self._limit
+        trig = self._trig
+        sin = math.sin
+        found = []
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                for other in self._cells.get((row + d_row, col + d_col), ()):
+                    if other == exclude or (within is not None and other not in within):
+                        continue
+                    lat2, lon2, cos2 = trig[other]
+                    # geo_utils._haversine_term, inlined: this loop is the engine's hot path
+                    if sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * sin((lon2 - lon1) / 2) ** 2 <= limit:
+                        found.append(other)
+        return found
+
+    # ---- updates ----------------------------------------------------------
+
+    def update(self, user_id, latitude: float, longitude: float) -> List[Dict]:
+        """Move (or add) a person. Returns the cluster events caused by the move."""
+        if self._positions.get(user_id) == (latitude, longitude):
+            return []
+        if not self.in_range(latitude, longitude):
+            return self.remove(user_id)
+
+        old_cluster = self._cluster_of.get(user_id)
+        events = self._detach(user_id) if user_id in self._positions else []
+
+        self._positions[user_id] = (latitude, longitude)
+        self._index(user_id, latitude, longitude)
+        # A person moving alone keeps their cluster id
+        reuse_id = old_cluster if old_cluster is not None and old_cluster not in self._clusters else None
+        events.extend(self._attach(user_id, latitude, longitude, reuse_id))
+
+        # Staying in the same, unsplit cluster is just a move
+        if (old_cluster is not None and len(events) == 2
+                and events[0]['type'] == EVENT_LEFT and events[1]['type'] == EVENT_JOINED
+                and events[1]['cluster_id'] == old_cluster):
+            return [self._event(EVENT_MOVED, self._clusters[old_cluster], user_id=user_id)]
+        return events
+
+    def remove(self, user_id) -> List[Dict]:
+        """Drop a person (e.g. gone inactive). Returns the resulting cluster events."""
+        if user_id not in self._positions:
+            return []
+        events = self._detach(user_id)
+        del self._positions[user_id]
+        return events
+
+    def _detach(self, user_id) -> List[Dict]:
+        lat, lon = self._positions[user_id]
+        cluster = self._clusters[self._cluster_of.pop(user_id)]
+        neighbours = self._neighbours(lat, lon, exclude=user_id, within=cluster.members)
+
+        self._unindex(user_id)
+        cluster.members.discard(user_id)
+        cluster.sum_lat -= lat
+        cluster.sum_lon -= lon
+
+        events = [self._event(EVENT_LEFT, cluster, user_id=user_id)]
+        if not cluster.members:
+            del self._clusters[cluster.id]
+        elif len(neighbours) > 1:
+            # Only a person linking two or more neighbours can split a cluster
+            components = self._disconnected(neighbours, cluster.members)
+            if components:
+                events.extend(self._split(cluster, components))
+        return events
+
+    def _attach(self, user_id, lat: float, lon: float, reuse_id: Optional[str] = None) -> List[Dict]:
+        touching = {self._cluster_of[other] for other in self._neighbours(lat, lon, exclude=user_id)}
+        events = []
+
+        if not touching:
+            cluster = Cluster(reuse_id or f"cluster_{next(self._ids)}")
+            self._clusters[cluster.id] = cluster
+        else:
+            # Merge everything into the largest touching cluster, keeping its id
+            ordered = sorted((self._clusters[c] for c in touching), key=lambda c: (-c.count, c.id))
+            cluster = ordered[0]
+            absorbed = ordered[1:]
+            for other in absorbed:
+                self._absorb(cluster, other)
+            if absorbed:
+                events.append(self._event(EVENT_MERGED, cluster, merged_ids=[c.id for c in absorbed]))
+
+        cluster.members.add(user_id)
+        cluster.sum_lat += lat
+        cluster.sum_lon += lon
+        self._cluster_of[user_id] = cluster.id
+        events.append(self._event(EVENT_JOINED, cluster, user_id=user_id))
+        return events
+
+    def _absorb(self, cluster: Cluster, other: Cluster):
+        for member in other.members:
+            self._cluster_of[member] = cluster.id
+        cluster.members |= other.members
+        cluster.sum_lat += other.sum_lat
+        cluster.sum_lon += other.sum_lon
+        del self._clusters[other.id]
+
+    def _disconnected(self, seeds: List, members) -> Optional[List[set]]:
+        """
+        Whether the former neighbours of someone who left are still linked.
+        Grows a search from every seed at once, merging searches that meet,
+        and returns None as soon as one search holds them all (usually
+        within a few cells). Otherwise the searches have covered the whole
+        cluster, since everyone in it was linked through a seed, and their
+        member sets are the parts it splits into.
+        """
+        owner = {seed: i for i, seed in enumerate(seeds)}
+        parent = list(range(len(seeds)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # Seeds sharing a sub-cell are linked already, and in a crowd a few probes
+        # between neighbouring sub-cells link the rest without scanning anyone else
+        groups = len(seeds)
+        cells = {}
+        for i, seed in enumerate(seeds):
+            cells.setdefault(self._fine_key(*self._positions[seed]), []).append(i)
+        for indices in cells.values():
+            for i in indices[1:]:
+                parent[i] = indices[0]
+                groups -= 1
+        for (row, col), indices in cells.items():
+            for key in ((row, col + 1), (row + 1, col - 1), (row + 1, col), (row + 1, col + 1)):
+                others = cells.get(key)
+                if groups == 1:
+                    return None
+                if others is None:
+                    continue
+                a, b = find(indices[0]), find(others[0])
+                if a != b and any(self._linked(seeds[i], seeds[j])
+                                  for i in indices[:LINK_PROBES] for j in others[:LINK_PROBES]):
+                    parent[b] = a
+                    groups -= 1
+        if groups == 1:
+            return None
+
+        # One seed per group first, so the groups reach each other in the fewest scans
+        frontier = deque(sorted(seeds, key=lambda seed: parent[owner[seed]] != owner[seed]))
+        while frontier:
+            node = frontier.popleft()
+            lat, lon = self._positions[node]
+            for other in self._neighbours(lat, lon, exclude=node, within=members):
+                seen = owner.get(other)
+                if seen is None:
+                    owner[other] = owner[node]
+                    frontier.append(other)
+                    continue
+                a, b = find(owner[node]), find(seen)
+                if a != b:
+                    parent[b] = a
+                    groups -= 1
+                    if groups == 1:
+                        return None
+
+        components = {}
+        for member, seed in owner.items():
+            components.setdefault(find(seed), set()).add(member)
+        return list(components.values())
+
+    def _linked(self, a, b) -> bool:
+        lat1, lon1, cos1 = self._trig[a]
+        lat2, lon2, cos2 = self._trig[b]
+        return math.sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * math.sin((lon2 - lon1) / 2) ** 2 <= self._limit
+
+    def _split(self, cluster: Cluster, components: List[set]) -> List[Dict]:
+        """Split a cluster into its disconnected parts."""
+        # The largest part keeps the original id
+        components.sort(key=len, reverse=True)
+        cluster.members = components[0]
+        cluster.sum_lat, cluster.sum_lon = self._sums(cluster.members)
+
+        new_ids = []
+        for component in components[1:]:
+            part = Cluster(f"cluster_{next(self._ids)}")
+            part.members = component
+            part.sum_lat, part.sum_lon = self._sums(component)
+            self._clusters[part.id] = part
+            for member in component:
+                self._cluster_of[member] = part.id
+            new_ids.append(part.id)
+
+        return [self._event(EVENT_SPLIT, cluster, split_ids=new_ids)]
+
+    def _sums(self, members):
+        return (sum(self._positions[m][0] for m in members),
+                sum(self._positions[m][1] for m in members))
+
+    # ---- output -----------------------------------------------------------
+
+    def _zone_name(self, center: Optional[Dict]) -> Optional[str]:
+        if not self.zone_index or not center:
+            return None
+        zone = self.zone_index.lookup(center['latitude'], center['longitude'])
+        return zone['name'] if zone else None
+
+    def _event(self, event_type: str, cluster: Cluster, **extra) -> Dict:
+        event = {'type': event_type, 'cluster_id': cluster.id, 'count': cluster.count, 'center': cluster.center}
+        event.update(extra)
+        return event
+
+    def cluster_of(self, user_id) -> Optional[str]:
+        return self._cluster_of.get(user_id)
+
+    def clusters(self) -> List[Dict]:
+        """All clusters, in the same shape as geo_utils.cluster_people (members as ids)."""
+        result = []
+        for cluster in self._clusters.values():
+            center = cluster.center
+            result.append({
+                'id': cluster.id,
+                'members': sorted(cluster.members),
+                'center': center,
+                'zone': self._zone_name(center),
+                'count': cluster.count
+            })
+        return result
+
+    def __len__(self) -> int:
+        return len(self._positions)
@@ -0,0 +1,87 @@
+"""
+Background expiry of pending tags and stale magic links.
+Sleeps until the next tag deadline (or until woken by a new tag) so tags
+expire when due, instead of being cleaned up on the read path.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from tag_index import PendingTag, PendingTagIndex
+
+# Longest the sweeper sleeps with nothing due (seconds)
+MAX_SLEEP = 60.0
+
+# How often expired magic links are deleted (seconds)
+MAGIC_LINK_SWEEP_INTERVAL = 600.0
+
+
+class ExpirySweeper:
+    """Expires tags at their deadline and periodically purges magic links."""
+
+    def __init__(self, socketio, tags: PendingTagIndex,
+                 expire_tags: Callable[[List[PendingTag]], None],
+                 sweep_magic_links: Callable[[], int],
+                 link_interval: float = MAGIC_LINK_SWEEP_INTERVAL,
+                 max_sleep: float = MAX_SLEEP):
+        self.socketio = socketio
+        self.tags = tags
+        self.expire_tags = expire_tags
+        self.sweep_magic_links = sweep_magic_links
+        self.link_interval = link_interval
+        self.max_sleep = max_sleep
+        self._wake = threading.Event()
+        self._task = None
+        self._next_link_sweep = time.monotonic()
+
+        self.tags_expired = 0
+        self.links_deleted = 0
+        self.runs = 0
+
+    def wake(self):
+        """Re-check deadlines now, e.g. after a tag was added."""
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def run_once(self):
+        """Expire everything that's due. Returns seconds until the next piece of work."""
+        self.runs += 1
+        due = self.tags.pop_expired(datetime.utcnow())
+        if due:
+            self.expire_tags(due)
+            self.tags_expired += len(due)
+
+        now = time.monotonic()
+        if now >= self._next_link_sweep:
+            self.links_deleted += self.sweep_magic_links()
+            self._next_link_sweep = now + self.link_interval
+
+        timeout = min(self.max_sleep, self._next_link_sweep - now)
+        deadline = self.tags.next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, (deadline - datetime.utcnow()).total_seconds())
+        return max(timeout, 0.05)
+
+    def _run(self):
+        while True:
+            try:
+                timeout = self.run_once()
+            except Exception as e:
+                print(f"Expiry sweep failed: {e}")
+                timeout = self.max_sleep
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def stats(self) -> Dict:
+        deadline = self.tags.next_deadline()
+        return {
+            'tags_expired': self.tags_expired,
+            'links_deleted': self.links_deleted,
+            'runs': self.runs,
+            'next_deadline': deadline.isoformat() if deadline else None
+        }
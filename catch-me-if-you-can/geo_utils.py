@@ -1,12 +1,35 @@
+import bisect
 import math
 from typing import List, Dict, Optional, Tuple
 
 # Earth's radius in meters
 EARTH_RADIUS = 6371000
 
+# Meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
 # Clustering distance in meters
 CLUSTER_DISTANCE = 50
 
+# Zone types, in the order group_by_zone lists them
+ZONE_TYPES = ('office', 'pub', 'restaurant', 'cafe', 'gym')
+
+
+def parse_coordinates(latitude, longitude) -> Optional[Tuple[float, float]]:
+    """
+    Latitude and longitude from client input as finite floats within
+    +-90 / +-180, or None if either is missing, not a number or out of range.
+    """
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        return None
+    if abs(latitude) > 90 or abs(longitude) > 180:
+        return None
+    return latitude, longitude
+
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
@@ -28,12 +51,16 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     return EARTH_RADIUS * c
 
 
-def detect_zone(latitude: float, longitude: float, zones: List[Dict]) -> Optional[Dict]:
+def detect_zone(latitude: float, longitude: float, zones) -> Optional[Dict]:
     """
     Detect which zone a user is in based on their coordinates.
     Returns the most specific (smallest radius) matching zone.
+    `zones` may be a list of zone dicts or a prebuilt ZoneIndex.
     """
-    matching_zones = []
+    if isinstance(zones, ZoneIndex):
+        return zones.lookup(latitude, longitude)
+
+    best = None
 
     for zone in zones:
         distance = haversine_distance(
@@ -41,26 +68,162 @@ def detect_zone(latitude: float, longitude: float, zones: List[Dict]) -> Optiona
             zone['latitude'], zone['longitude']
         )
 
-        if distance <= zone['radius']:
-            matching_zones.append({
-                'zone': zone,
-                'distance': distance,
-                'radius': zone['radius']
-            })
+        # Keep the zone with the smallest radius (most specific); first wins on ties
+        if distance <= zone['radius'] and (best is None or zone['radius'] < best['radius']):
+            best = zone
+
+    return best
+
+
+class ZoneIndex:
+    """
+    Fixed-size lat/lon grid over zones for fast point lookups.
+    Each zone is stored in every cell its bounding box overlaps, sorted by
+    radius, so a lookup tests only the zones in the point's own cell and the
+    first hit is the most specific match.
+    """
 
-    if not matching_zones:
+    def __init__(self, zones: List[Dict] = (), cell_size: Optional[float] = None):
+        self.rebuild(zones, cell_size)
+
+    def rebuild(self, zones: List[Dict], cell_size: Optional[float] = None):
+        """Rebuild the grid from scratch. Cell size defaults to the largest zone radius."""
+        zones = list(zones)
+        if cell_size is None:
+            cell_size = max((z['radius'] for z in zones), default=0) or CLUSTER_DISTANCE
+        max_abs_lat = max((abs(z['latitude']) for z in zones), default=0.0)
+
+        self.cell_size = cell_size
+        self._lat_step = cell_size / METERS_PER_DEGREE
+        self._lon_step = cell_size / (METERS_PER_DEGREE * max(math.cos(math.radians(max_abs_lat)), 0.01))
+        self._cells = {}
+        self._zones = {}
+        self._order = 0
+
+        # Bulk load: append everything, then sort each bucket once
+        for zone in zones:
+            self._zones.pop(zone['name'], None)
+            self._order += 1
+            self._zones[zone['name']] = _index_entry(zone, self._order)
+        for entry in self._zones.values():
+            for key in self._covered_cells(entry[2]):
+                self._cells.setdefault(key, []).append(entry)
+        for bucket in self._cells.values():
+            bucket.sort(key=_entry_key)
+
+    def __len__(self) -> int:
+        return len(self._zones)
+
+    def get(self, name: str) -> Optional[Dict]:
+        entry = self._zones.get(name)
+        return entry[2] if entry else None
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return (math.floor(latitude / self._lat_step), math.floor(longitude / self._lon_step))
+
+    def _covered_cells(self, zone: Dict):
+        lat_min, lat_max, lon_min, lon_max = zone_bounds(zone)
+        row_min, col_min = self._cell(lat_min, lon_min)
+        row_max, col_max = self._cell(lat_max, lon_max)
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                yield (row, col)
+
+    def add(self, zone: Dict):
+        """Insert a zone, replacing any existing zone with the same name."""
+        if zone['name'] in self._zones:
+            self.remove(zone['name'])
+
+        self._order += 1
+        entry = _index_entry(zone, self._order)
+        self._zones[zone['name']] = entry
+        for key in self._covered_cells(zone):
+            bisect.insort(self._cells.setdefault(key, []), entry, key=_entry_key)
+
+    def remove(self, name: str) -> bool:
+        """Remove a zone by name. Returns False if it wasn't indexed."""
+        entry = self._zones.pop(name, None)
+        if entry is None:
+            return False
+
+        for key in self._covered_cells(entry[2]):
+            bucket = self._cells.get(key)
+            if bucket is None:
+                continue
+            bucket.remove(entry)
+            if not bucket:
+                del self._cells[key]
+        return True
+
+    def lookup(self, latitude: float, longitude: float) -> Optional[Dict]:
+        """Most specific zone containing the point, or None."""
+        bucket = self._cells.get(self._cell(latitude, longitude))
+        if not bucket:
+            return None
+
+        lat = math.radians(latitude)
+        lon = math.radians(longitude)
+        cos_lat = math.cos(lat)
+        for _, _, zone, zone_lat, zone_lon, zone_cos, limit in bucket:
+            if _haversine_term(lat, lon, cos_lat, zone_lat, zone_lon, zone_cos) <= limit:
+                return zone
         return None
 
-    # Return the zone with the smallest radius (most specific)
-    matching_zones.sort(key=lambda x: x['radius'])
-    return matching_zones[0]['zone']
+    def contains(self, name: str, latitude: float, longitude: float) -> bool:
+        """Whether the point is inside the named zone."""
+        entry = self._zones.get(name)
+        if entry is None:
+            return False
+        lat = math.radians(latitude)
+        return _haversine_term(lat, math.radians(longitude), math.cos(lat), *entry[3:6]) <= entry[6]
 
 
-def cluster_people(people: List[Dict]) -> List[Dict]:
+def _index_entry(zone: Dict, order: int) -> Tuple:
+    """
+    (radius, insertion order, zone, lat and lon in radians, cos(lat), limit):
+    the trigonometry a lookup needs from the zone, done once. A point is inside
+    when its haversine term is at most `limit`, sin^2 of half the radius's
+    angle, so lookups skip the square root and arctangent too.
+    """
+    lat = math.radians(zone['latitude'])
+    limit = math.sin(min(zone['radius'] / EARTH_RADIUS, math.pi) / 2) ** 2
+    return (zone['radius'], order, zone, lat, math.radians(zone['longitude']), math.cos(lat), limit)
+
+
+def _haversine_term(lat1, lon1, cos_lat1, lat2, lon2, cos_lat2) -> float:
+    """The `a` of the haversine formula for points already in radians."""
+    return math.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * math.sin((lon2 - lon1) / 2) ** 2
+
+
+def _entry_key(entry):
+    return entry[0], entry[1]
+
+
+def zone_bounds(zone: Dict) -> Tuple[float, float, float, float]:
+    """
+    Lat/lon bounding box (lat_min, lat_max, lon_min, lon_max) around a zone's circle,
+    padded slightly so it always contains every point within the radius.
+    """
+    radius = zone['radius'] * 1.01
+    dlat = radius / METERS_PER_DEGREE
+    edge_lat = min(abs(zone['latitude']) + dlat, 89.9)
+    dlon = radius / (METERS_PER_DEGREE * math.cos(math.radians(edge_lat)))
+    return (zone['latitude'] - dlat, zone['latitude'] + dlat,
+            zone['longitude'] - dlon, zone['longitude'] + dlon)
+
+
+def cluster_people(people: List[Dict], method: str = 'greedy') -> List[Dict]:
     """
     Cluster people who are within CLUSTER_DISTANCE meters of each other.
     Returns list of clusters with people and center coordinates.
+
+    method='greedy' compares every pair; method='grid' buckets people into
+    CLUSTER_DISTANCE-sized cells and only compares neighbouring cells, giving
+    the same clusters in roughly linear time.
     """
+    if method not in CLUSTER_METHODS:
+        raise ValueError(f"Unknown clustering method: {method}")
+
     if not people:
         return []
 
@@ -73,6 +236,10 @@ def cluster_people(people: List[Dict]) -> List[Dict]:
     if not people_with_location:
         return []
 
+    return CLUSTER_METHODS[method](people_with_location)
+
+
+def _cluster_greedy(people_with_location: List[Dict]) -> List[Dict]:
     # Track which people have been assigned to clusters
     assigned = set()
     clusters = []
@@ -99,50 +266,111 @@ def cluster_people(people: List[Dict]) -> List[Dict]:
                 cluster_members.append(other)
                 assigned.add(other['id'])
 
-        # Calculate cluster center
-        avg_lat = sum(m['latitude'] for m in cluster_members) / len(cluster_members)
-        avg_lon = sum(m['longitude'] for m in cluster_members) / len(cluster_members)
-
-        # Determine cluster zone (use the zone of the first person who has one)
-        cluster_zone = None
-        for member in cluster_members:
-            if member.get('current_zone'):
-                cluster_zone = member['current_zone']
-                break
-
-        clusters.append({
-            'id': f"cluster_{len(clusters)}",
-            'members': cluster_members,
-            'center': {'latitude': avg_lat, 'longitude': avg_lon},
-            'zone': cluster_zone,
-            'count': len(cluster_members)
-        })
+        clusters.append(_make_cluster(cluster_members, len(clusters)))
+
+    return clusters
+
+
+def _cluster_grid(people_with_location: List[Dict]) -> List[Dict]:
+    # Cells at least CLUSTER_DISTANCE wide in both directions, so everyone within
+    # range of a person sits in the 3x3 block of cells around them
+    max_abs_lat = max(abs(p['latitude']) for p in people_with_location)
+    lat_step = CLUSTER_DISTANCE / METERS_PER_DEGREE
+    edge_lat = min(max_abs_lat + lat_step, 89.9)
+    lon_step = CLUSTER_DISTANCE / (METERS_PER_DEGREE * math.cos(math.radians(edge_lat)))
+
+    cells = {}
+    cell_of = []
+    for index, person in enumerate(people_with_location):
+        key = (math.floor(person['latitude'] / lat_step), math.floor(person['longitude'] / lon_step))
+        cells.setdefault(key, []).append(index)
+        cell_of.append(key)
+
+    assigned = set()
+    clusters = []
+
+    for index, person in enumerate(people_with_location):
+        if person['id'] in assigned:
+            continue
+
+        cluster_members = [person]
+        assigned.add(person['id'])
+
+        # Visit candidates in input order so membership matches the greedy scan
+        row, col = cell_of[index]
+        candidates = []
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                candidates.extend(cells.get((row + d_row, col + d_col), ()))
+        candidates.sort()
+
+        for other_index in candidates:
+            other = people_with_location[other_index]
+            if other['id'] in assigned:
+                continue
+
+            distance = haversine_distance(
+                person['latitude'], person['longitude'],
+                other['latitude'], other['longitude']
+            )
+
+            if distance <= CLUSTER_DISTANCE:
+                cluster_members.append(other)
+                assigned.add(other['id'])
+
+        clusters.append(_make_cluster(cluster_members, len(clusters)))
 
     return clusters
 
 
-def group_by_zone(clusters: List[Dict], zones: List[Dict]) -> Dict:
+def _make_cluster(cluster_members: List[Dict], number: int) -> Dict:
+    # Calculate cluster center
+    avg_lat = sum(m['latitude'] for m in cluster_members) / len(cluster_members)
+    avg_lon = sum(m['longitude'] for m in cluster_members) / len(cluster_members)
+
+    # Determine cluster zone (use the zone of the first person who has one)
+    cluster_zone = None
+    for member in cluster_members:
+        if member.get('current_zone'):
+            cluster_zone = member['current_zone']
+            break
+
+    return {
+        'id': f"cluster_{number}",
+        'members': cluster_members,
+        'center': {'latitude': avg_lat, 'longitude': avg_lon},
+        'zone': cluster_zone,
+        'count': len(cluster_members)
+    }
+
+
+CLUSTER_METHODS = {
+    'greedy': _cluster_greedy,
+    'grid': _cluster_grid,
+}
+
+
+def group_by_zone(clusters: List[Dict], zones) -> Dict:
     """
     Group clusters by their detected zone for display.
     Returns a dictionary with zone names as keys.
+    `zones` may be a list of zone dicts or a prebuilt ZoneIndex, which
+    saves building a name lookup on every call.
     """
-    grouped = {
-        'office': [],
-        'pub': [],
-        'restaurant': [],
-        'cafe': [],
-        'gym': [],
-        'unknown': []
-    }
+    grouped = {zone_type: [] for zone_type in ZONE_TYPES}
+    grouped['unknown'] = []
 
-    zone_lookup = {z['name']: z for z in zones}
+    if isinstance(zones, ZoneIndex):
+        zone_lookup = zones
+    else:
+        zone_lookup = {z['name']: z for z in zones}
 
     for cluster in clusters:
         zone_name = cluster.get('zone')
+        zone = zone_lookup.get(zone_name) if zone_name else None
 
-        if zone_name and zone_name in zone_lookup:
-            zone_type = zone_lookup[zone_name]['type']
-            grouped[zone_type].append(cluster)
+        if zone is not None:
+            grouped[zone['type']].append(cluster)
         else:
             grouped['unknown'].append(cluster)
 
@@ -0,0 +1,345 @@
+"""
+Append-only location history.
+Each accepted location update is appended to the user's ring buffer in
+memory and to a pending list; a background task writes the pending points
+to disk once a second as fixed-width 20-byte records (user id, time,
+latitude, longitude). Files are one per UTC day and writer process, so
+workers sharing a directory never interleave writes, and are read back
+through mmap. Trajectories are downsampled before they're returned.
+"""
+
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from geo_utils import METERS_PER_DEGREE
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; log scans fall back to struct
+    np = None
+
+# One point on disk: user id (uint32), unix time (float64), latitude, longitude (float32, ~1 m)
+RECORD = struct.Struct('<Idff')
+RECORD_DTYPE = np.dtype([('user', '<u4'), ('t', '<f8'), ('lat', '<f4'), ('lon', '<f4')]) if np else None
+
+# Latest points kept in memory per user
+RING_SIZE = 256
+
+# How often pending points are written to disk (seconds)
+FLUSH_INTERVAL = 1.0
+
+# Days of log files kept
+RETENTION_DAYS = 7
+
+# Most points a trajectory query returns
+MAX_POINTS = 1000
+
+SEGMENT_SUFFIX = '.loc'
+
+Point = Tuple[float, float, float]  # (unix time, latitude, longitude)
+
+
+class Ring:
+    """The latest points of one user, oldest first, in compact arrays."""
+
+    __slots__ = ('t', 'lat', 'lon', 'start', 'size')
+
+    def __init__(self, size: int = RING_SIZE):
+        self.t = array('d', bytes(8 * size))
+        self.lat = array('f', bytes(4 * size))
+        self.lon = array('f', bytes(4 * size))
+        self.start = 0
+        self.size = 0
+
+    def append(self, t: float, lat: float, lon: float):
+        capacity = len(self.t)
+        i = (self.start + self.size) % capacity
+        self.t[i] = t
+        self.lat[i] = lat
+        self.lon[i] = lon
+        if self.size < capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % capacity
+
+    @property
+    def oldest(self) -> Optional[float]:
+        return self.t[self.start] if self.size else None
+
+    def points(self, since: float, until: float) -> List[Point]:
+        capacity = len(self.t)
+        result = []
+        for n in range(self.size):
+            i = (self.start + n) % capacity
+            if since <= self.t[i] <= until:
+                result.append((self.t[i], self.lat[i], self.lon[i]))
+        return result
+
+
+class LocationHistory:
+    """Recent points per user in memory, every point in daily log files."""
+
+    def __init__(self, directory: Optional[str], writer_id: str, ring_size: int = RING_SIZE,
+                 retention_days: int = RETENTION_DAYS):
+        self.directory = directory
+        self.writer_id = writer_id
+        self.ring_size = ring_size
+        self.retention_days = retention_days
+        self._rings = {}    # user id -> Ring
+        self._pending = []  # (user id, time, lat, lon) not yet on disk
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_day = None
+        self._task = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.recorded = 0
+        self.written = 0
+        self.flushes = 0
+
+    def record(self, user_id, latitude: float, longitude: float, at: Optional[float] = None,
+               persist: bool = True):
+        """
+        Add a point. Only the worker that received an update persists it;
+        replicated ones go to the ring alone.
+        """
+        t = at if at is not None else time.time()
+        ring = self._rings.get(user_id)
+        if ring is None:
+            ring = self._rings[user_id] = Ring(self.ring_size)
+        ring.append(t, latitude, longitude)
+        if persist and self.directory:
+            self._pending.append((user_id, t, latitude, longitude))
+        self.recorded += 1
+
+    # ---- writing ------------------------------------------------------------
+
+    def start(self, socketio):
+        if self._task is None and self.directory:
+            self._task = socketio.start_background_task(self._run, socketio)
+
+    def _run(self, socketio):
+        while True:
+            socketio.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"History flush failed: {e}")
+
+    def flush(self) -> int:
+        """Write pending points to today's file in one call. Returns points written."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            pack = RECORD.pack
+            times = [point[1] for point in pending]
+            day = _day(min(times))
+            if day == _day(max(times)):
+                self._open(day).write(b''.join([pack(*point) for point in pending]))
+            else:  # Around midnight
+                by_day = {}
+                for point in pending:
+                    by_day.setdefault(_day(point[1]), []).append(point)
+                for day, points in sorted(by_day.items()):
+                    self._open(day).write(b''.join([pack(*point) for point in points]))
+            self._file.flush()
+            self.flushes += 1
+            self.written += len(pending)
+            return len(pending)
+
+    def _open(self, day: str):
+        if self._file_day != day:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(os.path.join(self.directory, f'{day}-{self.writer_id}{SEGMENT_SUFFIX}'), 'ab')
+            self._file_day = day
+            self._expire_files()
+        return self._file
+
+    def _expire_files(self):
+        cutoff = _day(time.time() - self.retention_days * 86400)
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX) and name[:8] < cutoff:
+                os.remove(os.path.join(self.directory, name))
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_day = None
+
+    # ---- reading ------------------------------------------------------------
+
+    def trajectory(self, user_id, since: float, until: float) -> List[Point]:
+        """Every recorded point of a user between two unix times, oldest first."""
+        ring = self._rings.get(user_id)
+        if ring is not None and ring.size and ring.oldest <= since:
+            return ring.points(since, until)
+
+        # Older than the ring holds: the log files, then the ring for what isn't on disk yet
+        boundary = ring.oldest if ring is not None and ring.size else until + 1
+        points = self._scan(user_id, since, min(until, boundary - 1e-6))
+        if ring is not None:
+            points.extend(ring.points(max(since, boundary), until))
+        return points
+
+    def _scan(self, user_id, since: float, until: float) -> List[Point]:
+        if not self.directory or since > until:
+            return []
+        self.flush()
+        # Segment names start with their UTC day, so the range picks them by name
+        horizon = time.time() + 86400  # Nothing is logged after today
+        first = _day(min(max(since, 0.0), horizon))
+        last = _day(min(max(until, 0.0), horizon))
+        points = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(SEGMENT_SUFFIX) and first <= name[:8] <= last:
+                points.extend(_scan_file(os.path.join(self.directory, name), user_id, since, until))
+        points.sort()
+        return points
+
+    def stats(self) -> Dict:
+        return {
+            'users': len(self._rings),
+            'recorded': self.recorded,
+            'pending': len(self._pending),
+            'written': self.written,
+            'flushes': self.flushes,
+            'directory': self.directory
+        }
+
+
+def _day(t: float) -> str:
+    return datetime.utcfromtimestamp(t).strftime('%Y%m%d')
+
+
+def _scan_file(path: str, user_id, since: float, until: float) -> List[Point]:
+    """One user's points in a log file, read through mmap."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        # Ignore a record another process is half way through appending
+        size -= size % RECORD.size
+        if size == 0:
+            return []
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+            if np is not None:
+                records = np.frombuffer(data, dtype=RECORD_DTYPE, count=size // RECORD.size)
+                selected = records[(records['user'] == user_id) & (records['t'] >= since) & (records['t'] <= until)]
+                points = list(zip(selected['t'].tolist(), selected['lat'].tolist(), selected['lon'].tolist()))
+                del records, selected  # Release the buffer before the map closes
+                return points
+            return [(t, lat, lon) for uid, t, lat, lon in RECORD.iter_unpack(data)
+                    if uid == user_id and since <= t <= until]
+
+
+# ---- downsampling -----------------------------------------------------------
+
+def simplify(points: List[Point], tolerance: float) -> List[Point]:
+    """
+    Douglas-Peucker: the fewest points keeping the path within `tolerance`
+    meters of the original. Distances use a flat projection around the
+    first point, which is accurate at walking scale.
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+
+    lat0 = points[0][1]
+    x_scale = METERS_PER_DEGREE * math.cos(math.radians(lat0))
+    xy = [(p[2] * x_scale, p[1] * METERS_PER_DEGREE) for p in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        worst, worst_i = 0.0, None
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length_sq == 0:
+                d_sq = (px - x1) ** 2 + (py - y1) ** 2
+            else:
+                u = max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length_sq))
+                d_sq = (px - x1 - u * dx) ** 2 + (py - y1 - u * dy) ** 2
+            if d_sq > worst:
+                worst, worst_i = d_sq, i
+        if worst_i is not None and worst > tolerance * tolerance:
+            keep[worst_i] = True
+            stack.append((first, worst_i))
+            stack.append((worst_i, last))
+    return [p for p, kept in zip(points, keep) if kept]
+
+
+def bucket(points: List[Point], seconds: float) -> List[Point]:
+    """The last point in each `seconds`-wide time bucket."""
+    if seconds <= 0:
+        return list(points)
+    result = []
+    current = None
+    for point in points:
+        key = int(point[0] // seconds)
+        if key == current:
+            result[-1] = point
+        else:
+            result.append(point)
+            current = key
+    return result
+
+
+def downsample(points: List[Point], tolerance: float = 0.0, bucket_seconds: float = 0.0,
+               max_points: int = MAX_POINTS) -> List[Point]:
+    """Bucket and/or simplify, then bucket more coarsely until at most max_points remain."""
+    points = bucket(points, bucket_seconds)
+    points = simplify(points, tolerance)
+    while len(points) > max_points > 0:
+        span = points[-1][0] - points[0][0]
+        points = bucket(points, max(span / max_points, bucket_seconds * 2, 1e-3))
+        bucket_seconds = span / max_points
+    return points
+
+
+def parse_time(value: Optional[str], default: float) -> float:
+    """
+    Unix seconds from a number or an ISO 8601 string; ISO times without an
+    offset are taken as UTC. Raises ValueError.
+    """
+    if value in (None, ''):
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        seconds = parsed.timestamp()
+    if not math.isfinite(seconds):
+        raise ValueError(f'{value!r} is not a time')
+    return seconds
+
+
+def parse_amount(value: Optional[str]) -> float:
+    """A positive, finite number, or 0 (off) if `value` is missing. Raises ValueError."""
+    if value in (None, ''):
+        return 0.0
+    amount = float(value)
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError(f"{value!r} is not a positive number")
+    return amount
+
+
+def default_range(now: Optional[float] = None) -> Tuple[float, float]:
+    """The last 24 hours."""
+    now = now if now is not None else time.time()
+    return now - timedelta(days=1).total_seconds(), now
@@ -0,0 +1,166 @@
+"""
+Server-side liveness of active users.
+Every touch of a user (location update, register, check-in) pushes their
+idle deadline to last_seen + the idle window. Deadlines sit in one-second
+buckets, like a timing wheel, so a touch moves a user between two sets
+instead of growing a heap, and memory stays proportional to active users
+however often they send updates. A sweeper sleeps until the earliest
+bucket is due and hands everyone in it to a callback in one batch.
+"""
+
+import heapq
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+# Default time without a touch before a user is considered gone (seconds)
+IDLE_TIMEOUT = 600.0
+
+# Width of a deadline bucket (seconds)
+BUCKET_SECONDS = 1.0
+
+# Longest the sweeper sleeps with nothing due (seconds)
+MAX_SLEEP = 60.0
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class LivenessIndex:
+    """
+    Idle deadlines of active users, bucketed by second. With idle_timeout
+    <= 0 touches arm nothing; only explicit arm() deadlines are kept.
+    """
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, bucket_seconds: float = BUCKET_SECONDS):
+        self.idle_timeout = idle_timeout
+        self.bucket_seconds = bucket_seconds
+        self._bucket_of = {}  # user id -> bucket key
+        self._buckets = {}    # bucket key -> set of user ids
+        self._keys = []       # heap of bucket keys; keys of emptied buckets are skipped lazily
+
+    def load(self, records):
+        """Track every active record from its last_seen."""
+        self._bucket_of = {}
+        self._buckets = {}
+        self._keys = []
+        for record in records:
+            if record.is_active:
+                self.seen(record.id, record.last_seen)
+
+    def seen(self, user_id, last_seen: Optional[datetime] = None):
+        """The user was active at `last_seen` (default now)."""
+        if self.idle_timeout <= 0:
+            return
+        self.arm(user_id, (last_seen or datetime.utcnow()) + timedelta(seconds=self.idle_timeout))
+
+    def arm(self, user_id, deadline: datetime):
+        """Check the user again at `deadline`."""
+        key = math.ceil((deadline - EPOCH).total_seconds() / self.bucket_seconds)
+        current = self._bucket_of.get(user_id)
+        if current == key:
+            return
+        if current is not None:
+            self._remove(user_id, current)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = set()
+            heapq.heappush(self._keys, key)
+        bucket.add(user_id)
+        self._bucket_of[user_id] = key
+
+    def forget(self, user_id):
+        key = self._bucket_of.pop(user_id, None)
+        if key is not None:
+            self._remove(user_id, key)
+
+    def _remove(self, user_id, key):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.discard(user_id)
+            if not bucket:
+                del self._buckets[key]
+
+    def pop_due(self, now: Optional[datetime] = None) -> List:
+        """Remove and return every user whose deadline has passed."""
+        limit = ((now or datetime.utcnow()) - EPOCH).total_seconds() / self.bucket_seconds
+        due = []
+        while self._keys and self._keys[0] <= limit:
+            bucket = self._buckets.pop(heapq.heappop(self._keys), None)
+            if bucket:
+                for user_id in bucket:
+                    del self._bucket_of[user_id]
+                due.extend(bucket)
+        return due
+
+    def next_deadline(self) -> Optional[datetime]:
+        while self._keys and self._keys[0] not in self._buckets:
+            heapq.heappop(self._keys)
+        if not self._keys:
+            return None
+        return EPOCH + timedelta(seconds=self._keys[0] * self.bucket_seconds)
+
+    def __len__(self) -> int:
+        return len(self._bucket_of)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._bucket_of
+
+    def stats(self) -> Dict:
+        deadline = self.next_deadline()
+        return {
+            'idle_timeout_s': self.idle_timeout,
+            'tracked': len(self._bucket_of),
+            'buckets': len(self._buckets),
+            'next_deadline': deadline.isoformat() if deadline else None
+        }
+
+
+class LivenessSweeper:
+    """Hands users whose idle deadline passed to `sweep(user_ids)`, in one call per wake-up."""
+
+    def __init__(self, socketio, index: LivenessIndex, sweep: Callable[[List], None],
+                 max_sleep: float = MAX_SLEEP):
+        self.socketio = socketio
+        self.index = index
+        self.sweep = sweep
+        self.max_sleep = min(max_sleep, index.idle_timeout) if index.idle_timeout > 0 else max_sleep
+        self._wake = threading.Event()
+        self._task = None
+
+        self.runs = 0
+        self.swept = 0
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def run_once(self) -> float:
+        """Sweep everything that's due. Returns seconds until the next deadline."""
+        self.runs += 1
+        due = self.index.pop_due()
+        if due:
+            self.swept += len(due)
+            self.sweep(due)
+
+        timeout = self.max_sleep
+        deadline = self.index.next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, (deadline - datetime.utcnow()).total_seconds())
+        return max(timeout, 0.05)
+
+    def _run(self):
+        while True:
+            try:
+                timeout = self.run_once()
+            except Exception as e:
+                print(f"Liveness sweep failed: {e}")
+                timeout = self.max_sleep
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def stats(self) -> Dict:
+        return dict(self.index.stats(), runs=self.runs, swept=self.swept)
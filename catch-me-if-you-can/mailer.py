@@ -0,0 +1,286 @@
+"""
+Outbound email queue.
+Handlers enqueue messages and return straight away; a few background workers
+send them in batches through a provider with one pooled HTTP session,
+timeouts, and retries with exponential backoff. Recent messages keep their
+delivery status so clients can poll it.
+"""
+
+import heapq
+import itertools
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BREVO_URL = 'https://api.brevo.com/v3/smtp/email'
+
+# (connect, read) timeouts for provider calls (seconds)
+HTTP_TIMEOUT = (3.05, 10.0)
+
+# Messages sent per provider call
+BATCH_SIZE = 50
+
+# Attempts before a message is marked failed, and the backoff between them (seconds)
+MAX_ATTEMPTS = 5
+BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# Messages whose status is kept for the status API
+STATUS_HISTORY = 1000
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class DeliveryError(Exception):
+    """A provider call failed. Retryable errors are tried again after a backoff."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class EmailMessage:
+    """An email and its delivery status."""
+
+    __slots__ = ('id', 'to_email', 'to_name', 'subject', 'html', 'text',
+                 'status', 'attempts', 'error', 'created_at', 'sent_at')
+
+    def __init__(self, to_email, to_name, subject, html, text=None):
+        self.id = secrets.token_urlsafe(12)
+        self.to_email = to_email
+        self.to_name = to_name
+        self.subject = subject
+        self.html = html
+        self.text = text
+        self.status = QUEUED
+        self.attempts = 0
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.sent_at = None
+
+    def status_dict(self) -> Dict:
+        """Delivery status, without the recipient or content."""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
+        }
+
+
+class BrevoProvider:
+    """Brevo transactional email; a batch goes out as one call with a message version each."""
+
+    name = 'brevo'
+
+    def __init__(self, api_key, from_email, from_name, timeout=HTTP_TIMEOUT, pool_size=4):
+        self.sender = {'name': from_name, 'email': from_email}
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'api-key': api_key, 'Content-Type': 'application/json'})
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def send(self, messages: List[EmailMessage]):
+        first = messages[0]
+        body = {'sender': self.sender, 'subject': first.subject, 'htmlContent': first.html}
+        if len(messages) == 1:
+            body['to'] = [{'email': first.to_email, 'name': first.to_name}]
+        else:
+            body['messageVersions'] = [{
+                'to': [{'email': m.to_email, 'name': m.to_name}],
+                'subject': m.subject,
+                'htmlContent': m.html
+            } for m in messages]
+
+        try:
+            response = self.session.post(BREVO_URL, json=body, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise DeliveryError(str(e))
+        if response.status_code == 429 or response.status_code >= 500:
+            raise DeliveryError(f"{response.status_code}: {response.text[:200]}")
+        if response.status_code >= 400:
+            raise DeliveryError(f"{response.status_code}: {response.text[:200]}", retryable=False)
+
+
+class LogProvider:
+    """Development provider: prints each message's text instead of sending it."""
+
+    name = 'log'
+
+    def send(self, messages: List[EmailMessage]):
+        for message in messages:
+            print(f"[DEV MODE] Email to {message.to_email}: {message.text or message.subject}")
+
+
+class FakeProvider:
+    """In-memory provider for tests and benchmarks, with optional latency and failures."""
+
+    name = 'fake'
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = []     # Delivered messages, in order
+        self.calls = 0
+        self.rejected = set()  # Addresses that make a call fail, as a malformed one would
+        self._failures = []
+
+    def fail_next(self, count: int = 1, retryable: bool = True):
+        """Make the next `count` calls fail."""
+        self._failures.extend([retryable] * count)
+
+    def send(self, messages: List[EmailMessage]):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self._failures:
+            raise DeliveryError('Simulated failure', retryable=self._failures.pop(0))
+        if any(m.to_email in self.rejected for m in messages):
+            raise DeliveryError('400: invalid email address', retryable=False)
+        self.sent.extend(messages)
+
+
+class EmailQueue:
+    """Messages waiting to be sent, and the workers sending them."""
+
+    def __init__(self, socketio, provider, workers: int = 2, batch_size: int = BATCH_SIZE,
+                 max_attempts: int = MAX_ATTEMPTS, backoff: float = BACKOFF,
+                 max_backoff: float = MAX_BACKOFF):
+        self.socketio = socketio
+        self.provider = provider
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._due = []  # heap of (due time, sequence, message)
+        self._sequence = itertools.count()
+        self._messages = OrderedDict()  # id -> message, most recent last
+        self._ready = threading.Condition()
+        self._in_flight = 0
+        self._tasks = []
+
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+        self.split_batches = 0
+
+    def enqueue(self, message: EmailMessage) -> EmailMessage:
+        with self._ready:
+            self._messages[message.id] = message
+            while len(self._messages) > STATUS_HISTORY:
+                self._messages.popitem(last=False)
+            self._schedule(message, time.monotonic())
+            self.enqueued += 1
+        return message
+
+    def get(self, message_id) -> Optional[EmailMessage]:
+        return self._messages.get(message_id)
+
+    def start(self):
+        while len(self._tasks) < self.workers:
+            self._tasks.append(self.socketio.start_background_task(self._run))
+
+    def join(self, timeout: float) -> bool:
+        """Wait until nothing is queued or in flight. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._ready:
+            while self._due or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._ready.wait(min(remaining, 0.05))
+        return True
+
+    def _schedule(self, message: EmailMessage, due: float):
+        heapq.heappush(self._due, (due, next(self._sequence), message))
+        self._ready.notify_all()
+
+    def _take_batch(self) -> List[EmailMessage]:
+        """Wait for due messages and take up to a batch of them."""
+        with self._ready:
+            while True:
+                now = time.monotonic()
+                if self._due and self._due[0][0] <= now:
+                    break
+                self._ready.wait(self._due[0][0] - now if self._due else None)
+
+            batch = []
+            while self._due and self._due[0][0] <= now and len(batch) < self.batch_size:
+                message = heapq.heappop(self._due)[2]
+                message.status = SENDING
+                message.attempts += 1
+                batch.append(message)
+            self._in_flight += len(batch)
+            return batch
+
+    def _deliver(self, batch: List[EmailMessage]):
+        self.batches += 1
+        try:
+            self.provider.send(batch)
+        except Exception as e:
+            retryable = getattr(e, 'retryable', False)
+            print(f"Failed to send {len(batch)} email(s): {e}")
+            if not retryable and len(batch) > 1:
+                # One bad message rejects the whole call; send them singly so only it fails
+                self.split_batches += 1
+                for message in batch:
+                    self._deliver([message])
+                return
+            with self._ready:
+                for message in batch:
+                    message.error = str(e)
+                    if retryable and message.attempts < self.max_attempts:
+                        # Exponential backoff with jitter so retries from a batch spread out
+                        delay = min(self.max_backoff, self.backoff * 2 ** (message.attempts - 1))
+                        message.status = QUEUED
+                        self.retries += 1
+                        self._schedule(message, time.monotonic() + delay * random.uniform(0.5, 1.0))
+                    else:
+                        message.status = FAILED
+                        self.failed += 1
+            return
+
+        now = datetime.utcnow()
+        for message in batch:
+            message.status = SENT
+            message.sent_at = now
+            message.error = None
+        self.sent += len(batch)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._deliver(batch)
+            finally:
+                with self._ready:
+                    self._in_flight -= len(batch)
+                    self._ready.notify_all()
+
+    def stats(self) -> Dict:
+        return {
+            'provider': self.provider.name,
+            'workers': self.workers,
+            'queued': len(self._due),
+            'in_flight': self._in_flight,
+            'enqueued': self.enqueued,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'batches': self.batches,
+            'split_batches': self.split_batches
+        }
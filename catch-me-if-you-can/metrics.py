@@ -0,0 +1,313 @@
+"""
+In-process metrics in the Prometheus text format, and an on-demand
+sampling profiler.
+Socket.IO handlers, HTTP views and background tasks are wrapped to record
+latency histograms and the database queries they run. Gauges such as
+connected clients and queue depths are read only when /metrics is
+scraped, so between scrapes the cost is a few counter updates per call.
+"""
+
+import atexit
+import bisect
+import signal
+import threading
+import time
+from collections import Counter as Tally
+from functools import wraps
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram buckets: handler latency (seconds), query counts, payload sizes (bytes)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Default sampling interval and longest run of the profiler (seconds)
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 60.0
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f'{self.name}{_labels(self.label_names, labels)} {_number(value)}'
+
+
+class Histogram:
+    """Bucketed observations per label set, with their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, labels: Tuple = ()):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{bound}"'
+                yield f'{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {_number(series[-1])}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}'
+
+
+class Gauge:
+    """
+    A value read from a callback at scrape time: a number, or a dict of label
+    tuple -> number. kind='counter' exposes a running total kept elsewhere.
+    """
+
+    def __init__(self, name: str, help: str, collect: Callable, label_names: Sequence[str] = (),
+                 kind: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.label_names = tuple(label_names)
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        value = self.collect()
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, number in values.items():
+            if number is not None:
+                yield f'{self.name}{_labels(self.label_names, labels)} {_number(number)}'
+
+
+class Metrics:
+    """Registry of metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        metric.name = self.prefix + metric.name
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label_names=()) -> Counter:
+        return self._add(Counter(name, help, label_names))
+
+    def histogram(self, name, help, buckets, label_names=()) -> Histogram:
+        return self._add(Histogram(name, help, buckets, label_names))
+
+    def gauge(self, name, help, collect, label_names=(), kind='gauge') -> Gauge:
+        return self._add(Gauge(name, help, collect, label_names, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"Metric {metric.name} failed: {e}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+class QueryTracker:
+    """Counts SQL statements and their time, overall and for the handler running them."""
+
+    def __init__(self, scope: threading.local):
+        self._scope = scope  # .queries holds [count, seconds] while a handler runs
+        self.count = 0
+        self.seconds = 0.0
+
+    def install(self):
+        event.listen(Engine, 'before_cursor_execute', self._before)
+        event.listen(Engine, 'after_cursor_execute', self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop('query_started', time.perf_counter())
+        self.count += 1
+        self.seconds += elapsed
+        queries = getattr(self._scope, 'queries', None)
+        if queries is not None:
+            queries[0] += 1
+            queries[1] += elapsed
+
+
+class SamplingProfiler:
+    """
+    Samples the stack every `interval` seconds of CPU time (SIGPROF), keeping
+    only samples taken while the chosen handler runs. Results are collapsed
+    stacks, one 'outer;...;inner count' line each, as flame graph tools read.
+    Unix only, and handlers must run on the main OS thread, as they do under
+    gevent.
+    """
+
+    def __init__(self, scope: threading.local):
+        self._scope = scope  # .handler holds the running handler's name
+        self.target = None
+        self.interval = PROFILE_INTERVAL
+        self.started = None
+        self.until = None
+        self.samples = Tally()
+        self.taken = 0
+        # Shutdown restores SIGPROF's default action, which would kill the process
+        atexit.register(self.stop)
+
+    @property
+    def available(self) -> bool:
+        return hasattr(signal, 'setitimer')
+
+    @property
+    def running(self) -> bool:
+        return self.target is not None and time.monotonic() < self.until
+
+    def start(self, handler: str, seconds: float, interval: float = PROFILE_INTERVAL):
+        if not self.available:
+            raise RuntimeError('Sampling needs SIGPROF, which this platform lacks')
+        self.stop()
+        try:
+            signal.signal(signal.SIGPROF, self._sample)
+        except ValueError:
+            raise RuntimeError('Sampling only works on the main thread')
+        self.samples = Tally()
+        self.taken = 0
+        self.target = handler
+        self.interval = interval
+        self.started = time.time()
+        self.until = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+    def stop(self):
+        if self.target is not None and self.available:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            # Not SIG_DFL: a signal still in flight would terminate the process
+            signal.signal(signal.SIGPROF, signal.SIG_IGN)
+
+    def _sample(self, signum, frame):
+        if time.monotonic() >= self.until:
+            self.stop()
+            return
+        if getattr(self._scope, 'handler', None) != self.target:
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+        self.taken += 1
+
+    def report(self, top: int = 50) -> Dict:
+        return {
+            'handler': self.target,
+            'running': self.running,
+            'started_at': self.started,
+            'interval_ms': self.interval * 1000,
+            'samples': self.taken,
+            'stacks': [f'{stack} {count}' for stack, count in self.samples.most_common(top)]
+        }
+
+
+class Instrumentation:
+    """Latency, errors and queries for wrapped handlers, plus the shared registry."""
+
+    def __init__(self, metrics: Optional[Metrics] = None):
+        self.metrics = metrics or Metrics()
+        self._scope = threading.local()  # Greenlet-local once gevent has patched threading
+        self.queries = QueryTracker(self._scope)
+        self.profiler = SamplingProfiler(self._scope)
+
+        labels = ('kind', 'handler')
+        self.latency = self.metrics.histogram(
+            'handler_duration_seconds', 'Time spent in Socket.IO handlers, HTTP views and background tasks.',
+            LATENCY_BUCKETS, labels)
+        self.errors = self.metrics.counter('handler_errors_total', 'Handler calls that raised.', labels)
+        self.handler_queries = self.metrics.histogram(
+            'handler_db_queries', 'SQL statements run per handler call.', COUNT_BUCKETS, labels)
+        self.handler_query_seconds = self.metrics.counter(
+            'handler_db_seconds_total', 'Time spent in SQL statements, by handler.', labels)
+        self.metrics.gauge('db_queries_total', 'SQL statements run.', lambda: self.queries.count, kind='counter')
+        self.metrics.gauge('db_seconds_total', 'Time spent in SQL statements.', lambda: self.queries.seconds,
+                           kind='counter')
+        self.names = set()  # Handlers wrapped so far
+
+    def install(self):
+        self.queries.install()
+
+    def wrap(self, kind: str, name: str, fn: Callable) -> Callable:
+        labels = (kind, name)
+        self.names.add(name)
+
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            scope = self._scope
+            outer = getattr(scope, 'queries', None), getattr(scope, 'handler', None)
+            queries = scope.queries = [0, 0.0]
+            scope.handler = name
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                self.errors.inc(labels)
+                raise
+            finally:
+                self.latency.observe(time.perf_counter() - started, labels)
+                self.handler_queries.observe(queries[0], labels)
+                if queries[0]:
+                    self.handler_query_seconds.inc(labels, queries[1])
+                scope.queries, scope.handler = outer
+        return timed
+
+    def instrument_socketio(self, socketio):
+        """Wrap every registered Socket.IO event handler."""
+        for handlers in socketio.server.handlers.values():
+            for name, handler in list(handlers.items()):
+                handlers[name] = self.wrap('socketio', name, handler)
+
+    def instrument_flask(self, app, skip: Iterable[str] = ('static',)):
+        """Wrap every HTTP view, by endpoint name."""
+        for endpoint, view in list(app.view_functions.items()):
+            if endpoint not in skip:
+                app.view_functions[endpoint] = self.wrap('http', endpoint, view)
@@ -0,0 +1,101 @@
+"""
+Schema upgrades for existing databases and query-plan checks.
+db.create_all() only creates missing tables, so indexes added to the models
+later never reach an existing office.db; upgrade_schema() creates them.
+Every worker runs both at startup, possibly at the same moment against the
+same database, so both treat "another worker just created it" as success.
+"""
+
+from typing import Dict, List, Set
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+from models import db, User, TagRequest
+
+
+def create_tables(engine):
+    """db.create_all() for workers starting together: losing a race for a table is retried once."""
+    try:
+        db.metadata.create_all(engine)
+    except DBAPIError:
+        # Another worker created a table between our check and our CREATE; the next pass sees it
+        db.metadata.create_all(engine)
+
+
+def upgrade_schema(engine) -> List[str]:
+    """
+    Create any model indexes missing from the database. Returns the names
+    created. Each index is created IF NOT EXISTS in its own transaction, and
+    failing because another worker created it first is ignored.
+    """
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = _index_names(engine, table.name)
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                with engine.begin() as conn:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            except DBAPIError:
+                if index.name not in _index_names(engine, table.name):
+                    raise
+                continue
+            created.append(index.name)
+    return created
+
+
+def _index_names(engine, table_name: str) -> Set[str]:
+    with engine.connect() as conn:
+        return {ix['name'] for ix in db.inspect(conn).get_indexes(table_name)}
+
+
+def hot_queries(user_id: int = 1) -> Dict:
+    """The filters the realtime path runs against the database, by name."""
+    return {
+        'active_people': User.active_located_query(),
+        'active_tags': TagRequest.active_query(),
+        'pending_tags_for_user': TagRequest.pending_for_user_query(user_id),
+    }
+
+
+def explain(session, query) -> List[str]:
+    """Query plan lines for a Flask-SQLAlchemy query on SQLite or Postgres."""
+    bind = session.get_bind()
+    dialect = bind.dialect.name
+    statement = query.statement.compile(dialect=bind.dialect, compile_kwargs={'literal_binds': True})
+
+    if dialect == 'sqlite':
+        rows = session.execute(text(f'EXPLAIN QUERY PLAN {statement}')).fetchall()
+        return [row[-1] for row in rows]
+    if dialect == 'postgresql':
+        # Tiny tables make seq scans cheapest; ask whether an index plan exists at all
+        session.execute(text('SET LOCAL enable_seqscan = off'))
+        rows = session.execute(text(f'EXPLAIN {statement}')).fetchall()
+        return [row[0] for row in rows]
+    raise ValueError(f"EXPLAIN not supported for {dialect}")
+
+
+def is_table_scan(plan: List[str]) -> bool:
+    """True if any step of the plan reads a whole table rather than an index."""
+    for line in plan:
+        if line.startswith('SCAN ') and ' USING ' not in line:
+            return True
+        if 'Seq Scan' in line:
+            return True
+    return False
+
+
+def check_query_plans(session, user_id: int = 1) -> Dict[str, List[str]]:
+    """
+    EXPLAIN every hot query. Raises AssertionError naming the queries that
+    fall back to a table scan; returns the plans otherwise.
+    """
+    plans = {name: explain(session, query) for name, query in hot_queries(user_id).items()}
+    scans = [name for name, plan in plans.items() if is_table_scan(plan)]
+    if scans:
+        raise AssertionError(f"Table scan in: {', '.join(scans)}\n" +
+                             '\n'.join(f"{n}: {plans[n]}" for n in scans))
+    return plans
@@ -8,6 +8,10 @@ db = SQLAlchemy()
 VIBE_AVAILABLE = 'available'      # Green glow - open for anything
 VIBE_QUICK_CHAT = 'quick_chat'    # Yellow glow - just a quick coffee
 VIBE_FOCUSED = 'focused'          # Gray glow - busy but visible
+VIBES = (VIBE_AVAILABLE, VIBE_QUICK_CHAT, VIBE_FOCUSED)
+
+# Longest custom status kept
+STATUS_MAX_LENGTH = 50
 
 
 class User(db.Model):
@@ -24,10 +28,22 @@ class User(db.Model):
     longitude = db.Column(db.Float, nullable=True)
     floor = db.Column(db.Integer, nullable=True)
     vibe = db.Column(db.String(20), default=VIBE_AVAILABLE)
-    status = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(STATUS_MAX_LENGTH), nullable=True)
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
 
+    __table_args__ = (
+        # Active people on the map: partial so inactive/unlocated rows don't bloat it
+        db.Index('ix_users_active_located', 'is_active',
+                 sqlite_where=db.text('latitude IS NOT NULL'),
+                 postgresql_where=db.text('latitude IS NOT NULL')),
+    )
+
+    @classmethod
+    def active_located_query(cls):
+        """Active users with a known location."""
+        return cls.query.filter(cls.is_active.is_(True), cls.latitude.isnot(None))
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -61,20 +77,44 @@ class TagRequest(db.Model):
     tagger = db.relationship('User', foreign_keys=[tagger_id], backref='tags_sent')
     tagged = db.relationship('User', foreign_keys=[tagged_id], backref='tags_received')
 
+    __table_args__ = (
+        db.Index('ix_tag_requests_status_expires_at', 'status', 'expires_at'),
+        db.Index('ix_tag_requests_tagger_status', 'tagger_id', 'status'),
+        db.Index('ix_tag_requests_tagged_status', 'tagged_id', 'status'),
+    )
+
+    @classmethod
+    def active_query(cls, now=None, session=None):
+        """Pending tags that haven't reached their deadline, optionally on another session."""
+        query = session.query(cls) if session is not None else cls.query
+        return query.filter(cls.status == 'pending', cls.expires_at > (now or datetime.utcnow()))
+
+    @classmethod
+    def pending_for_user_query(cls, user_id):
+        """Pending tags the user sent or received."""
+        return cls.query.filter(
+            ((cls.tagger_id == user_id) | (cls.tagged_id == user_id)),
+            cls.status == 'pending'
+        )
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         if not self.expires_at:
             self.expires_at = datetime.utcnow() + timedelta(minutes=5)
 
-    def to_dict(self):
+    def to_dict(self, tagger=None, tagged=None):
+        """Pass already-serialised tagger/tagged dicts to skip the relationship loads."""
+        if tagger is None and self.tagger:
+            tagger = self.tagger.to_dict()
+        if tagged is None and self.tagged:
+            tagged = self.tagged.to_dict()
         return {
             'id': self.id,
-            'tagger': self.tagger.to_dict() if self.tagger else None,
-            'tagged': self.tagged.to_dict() if self.tagged else None,
+            'tagger': tagger,
+            'tagged': tagged,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'expires_at': self.expires_at.isoformat() if self.expires_at else None,
-            'status': self.status,
-            'seconds_remaining': max(0, int((self.expires_at - datetime.utcnow()).total_seconds())) if self.expires_at else 0
+            'status': self.status
         }
 
     @property
@@ -95,6 +135,10 @@ class MagicLink(db.Model):
     expires_at = db.Column(db.DateTime)
     used = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_magic_links_expires_at', 'expires_at'),
+    )
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         if not self.token:
@@ -109,3 +153,31 @@ class MagicLink(db.Model):
     @property
     def is_valid(self):
         return not self.used and not self.is_expired
+
+
+class Zone(db.Model):
+    """A named place on the map; people within its radius are in it."""
+
+    __tablename__ = 'zones'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    type = db.Column(db.String(20), nullable=False)  # office, pub, restaurant, cafe, gym
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    radius = db.Column(db.Float, nullable=False)  # meters
+    floor = db.Column(db.Integer, nullable=True)
+    icon = db.Column(db.String(10), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """Same shape as the DEFAULT_ZONES entries."""
+        return {
+            'name': self.name,
+            'type': self.type,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'radius': self.radius,
+            'floor': self.floor,
+            'icon': self.icon
+        }
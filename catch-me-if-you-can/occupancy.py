@@ -0,0 +1,147 @@
+"""
+People per zone and per zone type.
+Each active user is counted in the zone they are in; when they move, only
+their old zone is decremented and their new one incremented, so reading
+the counts never has to run detect_zone over everyone. A zone reload
+recounts from scratch. A publisher pushes the counts as a small periodic
+'zone_occupancy' event whenever they changed.
+"""
+
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# How often changed counts are pushed to clients (seconds)
+PUBLISH_INTERVAL = 5.0
+
+
+class ZoneOccupancy:
+    """Counts of active users by zone name and by zone type."""
+
+    def __init__(self):
+        self._zone_of = {}  # user id -> (zone name, zone type)
+        self.by_zone = Counter()
+        self.by_type = Counter()
+        self.version = 0
+        self.updated_at = None
+
+        self.moves = 0
+        self.rebuilds = 0
+
+    def update(self, user_id, zone: Optional[Dict]) -> bool:
+        """The user is now in `zone` (None: outside every zone, or not active). Returns True on a change."""
+        new = (zone['name'], zone['type']) if zone else None
+        old = self._zone_of.get(user_id)
+        if old == new:
+            return False
+        if old is not None:
+            self._add(old, -1)
+        if new is not None:
+            self._zone_of[user_id] = new
+            self._add(new, 1)
+        else:
+            del self._zone_of[user_id]
+        self.moves += 1
+        self._changed()
+        return True
+
+    def remove(self, user_id) -> bool:
+        return self.update(user_id, None)
+
+    def _add(self, key: Tuple[str, str], delta: int):
+        name, zone_type = key
+        self.by_zone[name] += delta
+        if not self.by_zone[name]:
+            del self.by_zone[name]
+        self.by_type[zone_type] += delta
+        if not self.by_type[zone_type]:
+            del self.by_type[zone_type]
+
+    def _changed(self):
+        self.version += 1
+        self.updated_at = datetime.utcnow()
+
+    def rebuild(self, records: Iterable, lookup: Callable[[float, float], Optional[Dict]]):
+        """Recount everyone, e.g. after the zones changed."""
+        self._zone_of = {}
+        self.by_zone = Counter()
+        self.by_type = Counter()
+        for record in records:
+            zone = zone_of(record, lookup)
+            if zone:
+                self._zone_of[record.id] = (zone['name'], zone['type'])
+                self._add((zone['name'], zone['type']), 1)
+        self.rebuilds += 1
+        self._changed()
+
+    def count(self, name: str) -> int:
+        return self.by_zone.get(name, 0)
+
+    def __len__(self) -> int:
+        return len(self._zone_of)
+
+    def to_dict(self) -> Dict:
+        """Occupied zones and types only; the periodic event's payload."""
+        return {
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'total': len(self._zone_of),
+            'zones': dict(self.by_zone),
+            'types': dict(self.by_type)
+        }
+
+    def stats(self) -> Dict:
+        return {'version': self.version, 'counted': len(self._zone_of), 'occupied_zones': len(self.by_zone),
+                'moves': self.moves, 'rebuilds': self.rebuilds}
+
+
+def zone_of(record, lookup: Callable[[float, float], Optional[Dict]]) -> Optional[Dict]:
+    """The zone an active user is counted in, or None."""
+    if not record.is_active or record.latitude is None or record.longitude is None:
+        return None
+    return lookup(record.latitude, record.longitude)
+
+
+def recount(records: Iterable, lookup: Callable[[float, float], Optional[Dict]]) -> Tuple[Counter, Counter]:
+    """Counts by zone and by type computed from scratch, to check the incremental ones against."""
+    by_zone, by_type = Counter(), Counter()
+    for record in records:
+        zone = zone_of(record, lookup)
+        if zone:
+            by_zone[zone['name']] += 1
+            by_type[zone['type']] += 1
+    return by_zone, by_type
+
+
+class OccupancyPublisher:
+    """Emits 'zone_occupancy' to this worker's sockets every interval in which the counts changed."""
+
+    def __init__(self, socketio, occupancy: ZoneOccupancy, interval: float = PUBLISH_INTERVAL):
+        self.socketio = socketio
+        self.occupancy = occupancy
+        self.interval = interval
+        self._sent_version = None
+        self._task = None
+
+        self.published = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def publish(self) -> bool:
+        if self.occupancy.version == self._sent_version:
+            return False
+        self._sent_version = self.occupancy.version
+        # Every worker counts everyone, so each one tells only its own sockets
+        self.socketio.emit('zone_occupancy', self.occupancy.to_dict(), ignore_queue=True)
+        self.published += 1
+        return True
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"Occupancy publish failed: {e}")
@@ -0,0 +1,231 @@
+"""
+In-memory live presence store.
+Location, vibe, status and floor updates land here instead of hitting the
+database on every event; dirty records are written back in one batch by a
+periodic flusher.
+"""
+
+import threading
+from datetime import datetime
+from itertools import count
+from typing import Callable, Dict, List, Optional
+
+from models import VIBE_AVAILABLE
+from serialization import SerializationCache
+
+# Default maximum time a presence change may stay unflushed (seconds)
+PRESENCE_MAX_LAG = 2.0
+
+# Columns owned by the presence store and written back by flush()
+PERSISTED_FIELDS = ('team', 'latitude', 'longitude', 'floor', 'vibe', 'status', 'last_seen', 'is_active')
+
+# Attributes of a PresenceRecord that describe the user
+RECORD_FIELDS = ('id', 'email', 'name', 'avatar_emoji', 'team', 'latitude', 'longitude',
+                 'floor', 'vibe', 'status', 'last_seen', 'is_active')
+
+
+class PresenceRecord:
+    """Live view of a user, mirroring User.to_dict()."""
+
+    # version is stamped by the store on every change, for the serialisation cache
+    __slots__ = RECORD_FIELDS + ('version',)
+
+    def __init__(self, id, email, name, avatar_emoji=None, team=None, latitude=None, longitude=None,
+                 floor=None, vibe=VIBE_AVAILABLE, status=None, last_seen=None, is_active=True):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.avatar_emoji = avatar_emoji
+        self.team = team
+        self.latitude = latitude
+        self.longitude = longitude
+        self.floor = floor
+        self.vibe = vibe
+        self.status = status
+        self.last_seen = last_seen
+        self.is_active = is_active
+        self.version = 0
+
+    @classmethod
+    def from_user(cls, user) -> 'PresenceRecord':
+        return cls(
+            id=user.id, email=user.email, name=user.name, avatar_emoji=user.avatar_emoji,
+            team=user.team, latitude=user.latitude, longitude=user.longitude, floor=user.floor,
+            vibe=user.vibe, status=user.status, last_seen=user.last_seen, is_active=user.is_active
+        )
+
+    def fields(self) -> Dict:
+        """All attributes, e.g. for recreating the record in another worker."""
+        return {name: getattr(self, name) for name in RECORD_FIELDS}
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'email': self.email,
+            'name': self.name,
+            'avatar_emoji': self.avatar_emoji,
+            'team': self.team or '',
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'floor': self.floor,
+            'vibe': self.vibe or VIBE_AVAILABLE,
+            'status': self.status or '',
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'is_active': self.is_active
+        }
+
+
+class PresenceStore:
+    """Users keyed by id, with write-behind of changed records."""
+
+    def __init__(self, max_lag: float = PRESENCE_MAX_LAG):
+        self.max_lag = max_lag
+        self._records = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._task = None
+        self._versions = count(1)
+        self.serialized = SerializationCache()
+
+        self.updates = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    def load(self, users):
+        """Replace the store contents with the given User rows."""
+        self._records = {}
+        for user in users:
+            self._track(PresenceRecord.from_user(user))
+        self._dirty.clear()
+
+    def _track(self, record: PresenceRecord) -> PresenceRecord:
+        record.version = next(self._versions)
+        self._records[record.id] = record
+        return record
+
+    def add(self, user) -> PresenceRecord:
+        """Track a user row that was just written to the database."""
+        record = self._track(PresenceRecord.from_user(user))
+        self._dirty.discard(user.id)
+        return record
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._records
+
+    def put(self, fields: Dict) -> PresenceRecord:
+        """Track a user created by another worker, from PresenceRecord.fields()."""
+        return self._track(PresenceRecord(**fields))
+
+    def get(self, user_id) -> Optional[PresenceRecord]:
+        return self._records.get(user_id)
+
+    def records(self) -> List[PresenceRecord]:
+        return list(self._records.values())
+
+    def user_dict(self, user_id) -> Optional[Dict]:
+        """A user's dict, reused until the record changes. Don't mutate it."""
+        record = self._records.get(user_id)
+        return self._serialize(record) if record else None
+
+    def _serialize(self, record: PresenceRecord) -> Dict:
+        return self.serialized.get(record.id, record.version, record.to_dict)
+
+    def update(self, user_id, **fields) -> Optional[PresenceRecord]:
+        """Apply field changes to a user and queue them for the next flush."""
+        record = self._records.get(user_id)
+        if record is None:
+            return None
+
+        for name, value in fields.items():
+            setattr(record, name, value)
+        record.version = next(self._versions)
+        self._dirty.add(user_id)
+        self.updates += 1
+        return record
+
+    def apply(self, user_id, fields: Dict) -> Optional[PresenceRecord]:
+        """Apply changes made by another worker, which persists them itself."""
+        record = self._records.get(user_id)
+        if record is None:
+            return None
+
+        for name, value in fields.items():
+            setattr(record, name, value)
+        record.version = next(self._versions)
+        return record
+
+    def touch(self, user_id, **fields) -> Optional[PresenceRecord]:
+        """Like update(), also marking the user active and seen now."""
+        return self.update(user_id, last_seen=datetime.utcnow(), is_active=True, **fields)
+
+    def active_people(self) -> List[Dict]:
+        """Active users with a known location, as dicts."""
+        return [self._serialize(r) for r in self._records.values()
+                if r.is_active and r.latitude is not None]
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def flush(self, session, model, write: Optional[Callable] = None) -> int:
+        """
+        Write all dirty records back in a single transaction. Returns rows written.
+        Only the columns presence owns are written, and only to rows that
+        exist: a user deleted or edited meanwhile is left as it is.
+        `write(session, model, rows)` does the writing, e.g. a storage profile's
+        batched UPDATE; by default one executemany UPDATE.
+        """
+        with self._lock:
+            if not self._dirty:
+                return 0
+
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            for user_id in dirty:
+                record = self._records.get(user_id)
+                if record is None:
+                    continue
+                row = {'id': user_id}
+                for name in PERSISTED_FIELDS:
+                    row[name] = getattr(record, name)
+                rows.append(row)
+
+            try:
+                if write is not None:
+                    write(session, model, rows)
+                else:
+                    session.bulk_update_mappings(model, rows)
+                session.commit()
+            except Exception:
+                session.rollback()
+                self._dirty |= dirty
+                raise
+
+            self.flushes += 1
+            self.rows_flushed += len(rows)
+            return len(rows)
+
+    def start(self, socketio, flush):
+        """Run `flush` every max_lag seconds in a background task."""
+        if self._task is None and self.max_lag > 0:
+            self._task = socketio.start_background_task(self._run, socketio, flush)
+
+    def _run(self, socketio, flush):
+        while True:
+            socketio.sleep(self.max_lag)
+            if not self._dirty:
+                continue
+            try:
+                flush()
+            except Exception as e:
+                print(f"Presence flush failed: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            'max_lag_ms': int(self.max_lag * 1000),
+            'users': len(self._records),
+            'dirty': len(self._dirty),
+            'updates': self.updates,
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed
+        }
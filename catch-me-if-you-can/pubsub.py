@@ -0,0 +1,342 @@
+"""
+Pluggable pub/sub backends for running more than one worker.
+
+SOCKETIO_MESSAGE_QUEUE selects the backend:
+  (unset)                 single process, nothing shared
+  local:///tmp/some-dir   Unix datagram bus between processes on one host
+  redis://host:6379/0     Redis pub/sub (needs the `redis` package)
+Any other URL is handed to Flask-SocketIO as its message_queue (kombu/kafka),
+in which case only Socket.IO emits are shared, not presence.
+
+Messages on the local and Redis buses are JSON, with datetimes and bytes
+tagged explicitly (encode_message / decode_message), never pickles: anyone
+able to publish on the bus can at most send bad data, not run code.
+Flask-SocketIO's own kombu/kafka managers still exchange pickles, so those
+queues must only be reachable by the app's workers.
+
+Sticky sessions: Socket.IO's long-polling transport needs every request of a
+session to reach the same worker. The client connects with the websocket
+transport only, which needs no affinity, so several gunicorn workers or nodes
+behind a plain load balancer work. If polling is ever re-enabled, put the
+nodes behind a load balancer with cookie or IP-hash affinity and run one
+worker per node.
+"""
+
+import base64
+import fcntl
+import json
+import os
+import queue
+import socket
+import threading
+import uuid
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import socketio
+
+try:
+    import redis
+except ImportError:  # Only needed for redis:// queues
+    redis = None
+
+# Largest datagram the local bus sends; bigger payloads are compressed first
+LOCAL_BUS_MAX_DATAGRAM = 200 * 1024
+
+# Leader lease length for the Redis lock (seconds)
+LEADER_TTL = 10
+
+# Messages waiting to be sent by the local bus's sender thread before new ones are dropped
+LOCAL_BUS_QUEUE_SIZE = 10000
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'__bytes__': base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f'{type(value).__name__} is not allowed on the bus')
+
+
+def _decode_value(obj: Dict):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__bytes__' in obj:
+            return base64.b64decode(obj['__bytes__'])
+    return obj
+
+
+def encode_message(message: Any) -> bytes:
+    """JSON for the bus; datetimes and bytes are tagged so they come back as such."""
+    return json.dumps(message, default=_encode_value, separators=(',', ':')).encode('utf-8')
+
+
+def decode_message(raw) -> Any:
+    """Inverse of encode_message. Raises ValueError on anything that isn't such a message."""
+    return json.loads(raw, object_hook=_decode_value)
+
+
+class LocalBus:
+    """
+    Fan-out bus over Unix datagram sockets in a shared directory.
+    Every subscriber binds a socket file in the channel directory; publishing
+    queues the payload for a sender thread, which sends it to every other
+    socket file there, so a slow peer never holds up the publisher.
+    """
+
+    def __init__(self, directory: str, channel: str):
+        self.path = os.path.join(directory, channel)
+        os.makedirs(self.path, exist_ok=True)
+        self.address = os.path.join(self.path, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.address)
+        self.dropped = 0
+        self._outbox = queue.Queue(LOCAL_BUS_QUEUE_SIZE)
+        self._sender = None
+
+    def publish(self, payload: bytes):
+        if len(payload) > LOCAL_BUS_MAX_DATAGRAM:
+            payload = b'z' + zlib.compress(payload)
+        else:
+            payload = b'r' + payload
+        if len(payload) > LOCAL_BUS_MAX_DATAGRAM:
+            self.dropped += 1
+            print(f"Local bus message too large ({len(payload)} bytes), dropped")
+            return
+
+        if self._sender is None:
+            self._sender = threading.Thread(target=self._send_loop, daemon=True)
+            self._sender.start()
+        try:
+            self._outbox.put_nowait(payload)
+        except queue.Full:
+            self.dropped += 1
+
+    def _send_loop(self):
+        # One thread sends, in publish order; a full peer queue only makes this thread wait
+        while True:
+            payload = self._outbox.get()
+            for name in os.listdir(self.path):
+                peer = os.path.join(self.path, name)
+                if peer == self.address or not name.endswith('.sock'):
+                    continue
+                try:
+                    self.sock.sendto(payload, peer)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Socket file left behind by a dead process
+                    try:
+                        os.unlink(peer)
+                    except OSError:
+                        pass
+                except BlockingIOError:
+                    self.dropped += 1
+
+    def listen(self) -> Iterator[bytes]:
+        while True:
+            data = self.sock.recv(LOCAL_BUS_MAX_DATAGRAM + 1)
+            yield zlib.decompress(data[1:]) if data[:1] == b'z' else data[1:]
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.address)
+        except OSError:
+            pass
+
+
+class RedisBus:
+    """Redis pub/sub channel with the same interface as LocalBus."""
+
+    def __init__(self, url: str, channel: str):
+        if redis is None:
+            raise RuntimeError('redis:// message queues need the redis package (pip install redis)')
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.dropped = 0
+
+    def publish(self, payload: bytes):
+        self.client.publish(self.channel, payload)
+
+    def listen(self) -> Iterator[bytes]:
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            yield message['data']
+
+    def close(self):
+        self.client.close()
+
+
+def open_bus(url: Optional[str], channel: str):
+    """Bus for `channel` on the configured queue, or None if nothing is shared."""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'local':
+        return LocalBus(parsed.path, channel)
+    if parsed.scheme in ('redis', 'rediss'):
+        return RedisBus(url, channel)
+    return None
+
+
+class LocalBusManager(socketio.PubSubManager):
+    """Socket.IO client manager that shares emits over a LocalBus."""
+
+    name = 'local'
+
+    def __init__(self, url: str, channel: str = 'socketio', write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = LocalBus(urlparse(url).path, channel)
+
+    def _publish(self, data):
+        self.bus.publish(encode_message(data))
+
+    def _listen(self):
+        # Decoded here: PubSubManager would try unpickling raw bytes
+        yield from _decoded(self.bus.listen())
+
+
+class JsonRedisManager(socketio.RedisManager):
+    """Flask-SocketIO's Redis manager, exchanging JSON messages instead of pickles."""
+
+    name = 'redis-json'
+
+    def _publish(self, data):
+        payload = encode_message(data)
+        try:
+            return self.redis.publish(self.channel, payload)
+        except redis.exceptions.RedisError:
+            self._redis_connect()
+            return self.redis.publish(self.channel, payload)
+
+    def _listen(self):
+        yield from _decoded(super()._listen())
+
+
+def _decoded(messages) -> Iterator[Dict]:
+    for raw in messages:
+        try:
+            message = decode_message(raw)
+        except ValueError:
+            print("Ignoring a bus message that isn't JSON")
+            continue
+        if isinstance(message, dict):
+            yield message
+
+
+def socketio_queue_options(url: Optional[str]) -> Dict:
+    """Keyword arguments for SocketIO() that connect it to the configured queue."""
+    if not url:
+        return {}
+    scheme = urlparse(url).scheme
+    if scheme == 'local':
+        return {'client_manager': LocalBusManager(url)}
+    if scheme in ('redis', 'rediss'):
+        if redis is None:
+            raise RuntimeError('redis:// message queues need the redis package (pip install redis)')
+        return {'client_manager': JsonRedisManager(url)}
+    print(f"Warning: {scheme}:// message queues exchange pickled messages; keep the queue private to the app")
+    return {'message_queue': url}
+
+
+class SingleLeader:
+    """Leadership for a lone process: always the leader."""
+
+    def is_leader(self) -> bool:
+        return True
+
+    def start(self, socketio):
+        pass
+
+
+class FileLeaderLock:
+    """Leader election between processes on one host via an exclusive flock."""
+
+    def __init__(self, path: str, retry: float = 2.0):
+        self.path = path
+        self.retry = retry
+        self._file = None
+        self._task = None
+
+    def is_leader(self) -> bool:
+        if self._file is None:
+            self._try_acquire()
+        return self._file is not None
+
+    def _try_acquire(self):
+        handle = open(self.path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return
+        self._file = handle
+
+    def start(self, socketio):
+        if self._task is None:
+            self._task = socketio.start_background_task(self._run, socketio)
+
+    def _run(self, socketio):
+        # Take over if the current leader exits
+        while self._file is None:
+            self._try_acquire()
+            socketio.sleep(self.retry)
+
+
+class RedisLeaderLock:
+    """Leader election through a Redis key with a renewed lease."""
+
+    def __init__(self, url: str, key: str = 'catch-me-if-you-can:leader', ttl: int = LEADER_TTL):
+        if redis is None:
+            raise RuntimeError('redis:// message queues need the redis package (pip install redis)')
+        self.client = redis.Redis.from_url(url)
+        self.key = key
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self._leader = False
+        self._task = None
+
+    def is_leader(self) -> bool:
+        return self._leader
+
+    def _renew(self):
+        if self.client.set(self.key, self.token, nx=True, ex=self.ttl):
+            self._leader = True
+        elif self.client.get(self.key) == self.token.encode():
+            self.client.expire(self.key, self.ttl)
+            self._leader = True
+        else:
+            self._leader = False
+
+    def start(self, socketio):
+        if self._task is None:
+            self._renew()
+            self._task = socketio.start_background_task(self._run, socketio)
+
+    def _run(self, socketio):
+        while True:
+            socketio.sleep(self.ttl / 3)
+            try:
+                self._renew()
+            except Exception as e:
+                self._leader = False
+                print(f"Leader lease renewal failed: {e}")
+
+
+def leader_lock(url: Optional[str]):
+    """Leader election matching the configured queue."""
+    if not url:
+        return SingleLeader()
+    parsed = urlparse(url)
+    if parsed.scheme == 'local':
+        os.makedirs(parsed.path, exist_ok=True)
+        return FileLeaderLock(os.path.join(parsed.path, 'leader.lock'))
+    if parsed.scheme in ('redis', 'rediss'):
+        return RedisLeaderLock(url)
+    # No shared presence on other queues: every worker acts on its own state
+    return SingleLeader()
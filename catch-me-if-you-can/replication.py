@@ -0,0 +1,77 @@
+"""
+Replication of live state between workers over a pub/sub bus.
+Each worker publishes the changes it makes (presence fields, new users,
+pending tags, broadcast deltas) and applies the ones published by others,
+so every worker serves the same people, tags and state versions.
+Messages are JSON (pubsub.encode_message), so payloads hold plain values,
+datetimes and bytes only.
+"""
+
+import os
+import uuid
+from typing import Callable, Dict
+
+from pubsub import decode_message, encode_message
+
+
+class Replicator:
+    """Publishes local changes and dispatches remote ones to handlers by kind."""
+
+    def __init__(self, bus=None):
+        self.bus = bus
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers = {}
+        self._task = None
+
+        self.published = 0
+        self.applied = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.bus is not None
+
+    def on(self, kind: str, handler: Callable[[Dict], None]):
+        self._handlers[kind] = handler
+
+    def publish(self, kind: str, **payload):
+        if self.bus is None:
+            return
+        payload['kind'] = kind
+        payload['origin'] = self.origin
+        self.bus.publish(encode_message(payload))
+        self.published += 1
+
+    def start(self, socketio, context: Callable = None):
+        """Listen for remote changes in a background task, inside `context()` if given."""
+        if self.bus is not None and self._task is None:
+            self._task = socketio.start_background_task(self._run, context)
+
+    def _run(self, context):
+        for raw in self.bus.listen():
+            try:
+                message = decode_message(raw)
+                if message.get('origin') == self.origin:
+                    continue
+                handler = self._handlers.get(message['kind'])
+                if handler is None:
+                    continue
+                if context is not None:
+                    with context():
+                        handler(message)
+                else:
+                    handler(message)
+                self.applied += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Replication message failed: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'origin': self.origin,
+            'published': self.published,
+            'applied': self.applied,
+            'failed': self.failed,
+            'dropped': self.bus.dropped if self.bus is not None else 0
+        }
@@ -0,0 +1,188 @@
+"""
+Socket.IO rooms for targeted emits.
+Each socket is bound to its user on register_user and joins a room for
+them, plus rooms for the user's team and the zone they are in, so events that concern a few people
+go to those rooms instead of every connected client. Sockets that want the
+full state, rather than an area of it, sit in the state room for their
+wire format (JSON, or packed as in wire.py).
+"""
+
+from typing import Dict, Iterable, Optional
+
+# Room kinds, also the keys of the fan-out stats
+ROOM_KINDS = ('user', 'team', 'area', 'state')
+
+# Sockets receiving unfiltered state deltas and cluster changes, as JSON or packed
+STATE_ROOM = 'state:all'
+STATE_PACKED_ROOM = 'state:packed'
+
+
+def user_room(user_id) -> str:
+    return f'user:{user_id}'
+
+
+def team_room(team) -> str:
+    return f'team:{team}'
+
+
+def area_room(zone_name) -> str:
+    return f'area:{zone_name}'
+
+
+class Membership:
+    """The rooms one socket is in besides its user room."""
+
+    __slots__ = ('user_id', 'team', 'area')
+
+    def __init__(self, user_id, team=None, area=None):
+        self.user_id = user_id
+        self.team = team
+        self.area = area
+
+
+class RoomRouter:
+    """Keeps sockets in their user, team and area rooms and counts emit fan-out."""
+
+    def __init__(self, socketio, namespace: str = '/'):
+        self.socketio = socketio
+        self.namespace = namespace
+        self._members = {}   # sid -> Membership
+        self._sids = {}      # user id -> set of sids on this worker
+        self._connected = 0
+        self._packed = set()  # sids that asked for the packed wire format
+
+        self._fanout = {kind: {'emits': 0, 'recipients': 0} for kind in ROOM_KINDS + ('broadcast',)}
+        self.avoided = 0  # deliveries a broadcast would have made on top of the targeted ones
+
+    def connect(self, sid, packed: bool = False):
+        self._connected += 1
+        if packed:
+            self._packed.add(sid)
+        self._enter(sid, self._state_room(sid))
+
+    def is_packed(self, sid) -> bool:
+        return sid in self._packed
+
+    def packed_count(self) -> int:
+        return len(self._packed)
+
+    def _state_room(self, sid) -> str:
+        return STATE_PACKED_ROOM if sid in self._packed else STATE_ROOM
+
+    def follow_state(self, sid, everything: bool):
+        """Put a socket in or out of the state room (out while it has an area subscription)."""
+        if everything:
+            self._enter(sid, self._state_room(sid))
+        else:
+            self._leave_room(sid, self._state_room(sid))
+
+    def disconnect(self, sid) -> Optional[Membership]:
+        """Forget a socket; Socket.IO removes it from its rooms itself."""
+        self._connected = max(self._connected - 1, 0)
+        self._packed.discard(sid)
+        return self._forget(sid)
+
+    def _forget(self, sid) -> Optional[Membership]:
+        membership = self._members.pop(sid, None)
+        if membership is not None:
+            sids = self._sids.get(membership.user_id)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self._sids[membership.user_id]
+        return membership
+
+    def register(self, sid, user_id, team=None, area=None):
+        """Put a socket in the rooms for its user, team and area."""
+        previous = self._members.get(sid)
+        if previous is not None and previous.user_id != user_id:
+            self._leave(sid, previous)
+            self._forget(sid)
+
+        membership = self._members.get(sid)
+        if membership is None:
+            membership = self._members[sid] = Membership(user_id)
+            self._sids.setdefault(user_id, set()).add(sid)
+            self._enter(sid, user_room(user_id))
+        self._move(sid, membership, team, area)
+
+    def move(self, user_id, team=None, area=None):
+        """Move every local socket of a user to the rooms for a new team or area."""
+        for sid in self._sids.get(user_id, ()):
+            self._move(sid, self._members[sid], team, area)
+
+    def has_sockets(self, user_id) -> bool:
+        return user_id in self._sids
+
+    def user_of(self, sid):
+        """The user a socket registered as, or None."""
+        membership = self._members.get(sid)
+        return membership.user_id if membership is not None else None
+
+    def _move(self, sid, membership, team, area):
+        if team != membership.team:
+            if membership.team is not None:
+                self._leave_room(sid, team_room(membership.team))
+            if team is not None:
+                self._enter(sid, team_room(team))
+            membership.team = team
+        if area != membership.area:
+            if membership.area is not None:
+                self._leave_room(sid, area_room(membership.area))
+            if area is not None:
+                self._enter(sid, area_room(area))
+            membership.area = area
+
+    def _leave(self, sid, membership):
+        self._leave_room(sid, user_room(membership.user_id))
+        if membership.team is not None:
+            self._leave_room(sid, team_room(membership.team))
+        if membership.area is not None:
+            self._leave_room(sid, area_room(membership.area))
+
+    def _enter(self, sid, room):
+        self.socketio.server.enter_room(sid, room, namespace=self.namespace)
+
+    def _leave_room(self, sid, room):
+        self.socketio.server.leave_room(sid, room, namespace=self.namespace)
+
+    def emit(self, event: str, data, kind: str, rooms: Iterable[str]):
+        """Emit to the given rooms of one kind, counting recipients on this worker."""
+        rooms = list(dict.fromkeys(rooms))
+        if not rooms:
+            return
+        recipients = len({sid for sid, _ in self.socketio.server.manager.get_participants(self.namespace, rooms)})
+        stats = self._fanout[kind]
+        stats['emits'] += 1
+        stats['recipients'] += recipients
+        self.avoided += max(self._connected - recipients, 0)
+        self.socketio.emit(event, data, to=rooms)
+
+    def emit_to_users(self, event: str, data, *user_ids):
+        self.emit(event, data, 'user', [user_room(user_id) for user_id in user_ids])
+
+    def broadcast(self, event: str, data):
+        """Emit to every client, counted for comparison with targeted emits."""
+        stats = self._fanout['broadcast']
+        stats['emits'] += 1
+        stats['recipients'] += self._connected
+        self.socketio.emit(event, data)
+
+    def stats(self) -> Dict:
+        rooms = {kind: 0 for kind in ROOM_KINDS}
+        for name in self.socketio.server.manager.rooms.get(self.namespace, {}):
+            if isinstance(name, str) and ':' in name:
+                kind = name.split(':', 1)[0]
+                if kind in rooms:
+                    rooms[kind] += 1
+        fanout = {}
+        for kind, stats in self._fanout.items():
+            fanout[kind] = dict(stats, per_emit=round(stats['recipients'] / stats['emits'], 2) if stats['emits'] else 0)
+        return {
+            'connected': self._connected,
+            'packed': len(self._packed),
+            'registered': len(self._members),
+            'rooms': rooms,
+            'fanout': fanout,
+            'avoided_deliveries': self.avoided
+        }
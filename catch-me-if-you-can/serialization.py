@@ -0,0 +1,48 @@
+"""
+Version-stamped cache of serialised entities.
+Every broadcast tick serialises all active users and tags; with the cache
+only entities whose stamp changed since they were last built are
+serialised again. Unchanged ones reuse the very same dict, which also lets
+StateTracker skip them by identity when diffing.
+"""
+
+from typing import Callable, Dict, Hashable
+
+
+class SerializationCache:
+    """Serialised dicts by entity key, valid while the entity's stamp is unchanged."""
+
+    def __init__(self):
+        self._entries = {}  # key -> (stamp, dict)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, stamp: Hashable, build: Callable[[], Dict]) -> Dict:
+        """The cached dict for `key` if built at `stamp`, otherwise build() it and cache that."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        value = build()
+        self._entries[key] = (stamp, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+        }
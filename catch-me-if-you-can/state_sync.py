@@ -0,0 +1,141 @@
+"""
+Versioned state tracking for delta broadcasts.
+Keeps the last broadcast people/tags and a short log of deltas so clients only
+receive what changed, and can catch up from a known version over HTTP.
+"""
+
+from collections import deque
+from typing import Dict, List, Optional
+
+# How many past deltas to keep for clients catching up via /api/state?since=
+DELTA_HISTORY = 256
+
+def diff_items(old: Dict[int, Dict], new: Dict[int, Dict]) -> Dict:
+    """
+    Compare two id -> dict mappings.
+    Returns {'upserted': [...], 'removed': [ids]} with changed/added items and removed ids.
+    """
+    upserted = []
+    for item_id, item in new.items():
+        previous = old.get(item_id)
+        if previous is item:
+            continue  # Same cached dict, so unchanged
+        if previous is None or previous != item:
+            upserted.append(item)
+
+    removed = [item_id for item_id in old if item_id not in new]
+    return {'upserted': upserted, 'removed': removed}
+
+
+class StateTracker:
+    """Tracks broadcast state and produces monotonically versioned deltas."""
+
+    def __init__(self, history: int = DELTA_HISTORY):
+        self.version = 0
+        self._people = {}
+        self._tags = {}
+        self._log = deque(maxlen=history)  # (version, touched people ids, touched tag ids)
+
+    def update(self, people: List[Dict], tags: List[Dict]) -> Optional[Dict]:
+        """
+        Replace the tracked state and return the delta against the previous one.
+        Returns None when nothing changed, so callers can skip the emit.
+        """
+        new_people = {p['id']: p for p in people}
+        new_tags = {t['id']: t for t in tags}
+
+        people_changes = diff_items(self._people, new_people)
+        tag_changes = diff_items(self._tags, new_tags)
+
+        self._people = new_people
+        self._tags = new_tags
+
+        if not any((people_changes['upserted'], people_changes['removed'],
+                    tag_changes['upserted'], tag_changes['removed'])):
+            return None
+
+        self.version += 1
+        self._log.append((
+            self.version,
+            {p['id'] for p in people_changes['upserted']} | set(people_changes['removed']),
+            {t['id'] for t in tag_changes['upserted']} | set(tag_changes['removed'])
+        ))
+
+        return {
+            'version': self.version,
+            'base_version': self.version - 1,
+            'people': people_changes,
+            'tags': tag_changes
+        }
+
+    def apply(self, delta: Dict) -> bool:
+        """
+        Apply a delta produced by another worker's tracker.
+        Returns False, changing nothing, if it doesn't follow on from our version.
+        """
+        if delta['base_version'] != self.version:
+            return False
+
+        for person in delta['people']['upserted']:
+            self._people[person['id']] = person
+        for person_id in delta['people']['removed']:
+            self._people.pop(person_id, None)
+        for tag in delta['tags']['upserted']:
+            self._tags[tag['id']] = tag
+        for tag_id in delta['tags']['removed']:
+            self._tags.pop(tag_id, None)
+
+        self.version = delta['version']
+        self._log.append((
+            self.version,
+            {p['id'] for p in delta['people']['upserted']} | set(delta['people']['removed']),
+            {t['id'] for t in delta['tags']['upserted']} | set(delta['tags']['removed'])
+        ))
+        return True
+
+    def load_snapshot(self, snapshot: Dict):
+        """Replace the tracked state with a snapshot from another worker."""
+        self._people = {p['id']: p for p in snapshot['people']}
+        self._tags = {t['id']: t for t in snapshot['tags']}
+        self.version = snapshot['version']
+        self._log.clear()
+
+    def snapshot(self) -> Dict:
+        """Full state at the current version."""
+        return {
+            'version': self.version,
+            'people': list(self._people.values()),
+            'tags': list(self._tags.values())
+        }
+
+    def since(self, version: int) -> Optional[Dict]:
+        """
+        Merged delta from `version` up to the current version.
+        Returns None if `version` is unknown or too old, in which case callers
+        should fall back to snapshot().
+        """
+        if version > self.version or version < 0:
+            return None
+        if version < self.version and (not self._log or self._log[0][0] > version + 1):
+            return None
+
+        touched_people = set()
+        touched_tags = set()
+        for entry_version, people_ids, tag_ids in self._log:
+            if entry_version > version:
+                touched_people |= people_ids
+                touched_tags |= tag_ids
+
+        return {
+            'version': self.version,
+            'base_version': version,
+            'people': self._collect(self._people, touched_people),
+            'tags': self._collect(self._tags, touched_tags)
+        }
+
+    @staticmethod
+    def _collect(current: Dict[int, Dict], touched) -> Dict:
+        return {
+            'upserted': [current[i] for i in touched if i in current],
+            'removed': [i for i in touched if i not in current]
+        }
@@ -0,0 +1,121 @@
+/**
+ * Decoder for the packed state format (see wire.py for the layout).
+ * decodeState(arrayBuffer) returns the same object the JSON events carry.
+ */
+
+const WIRE_KIND_DELTA = 1;
+const WIRE_COORD_SCALE = 10000000;
+const WIRE_INT32_NONE = -2147483648;
+const WIRE_INT8_NONE = -128;
+const WIRE_PERSON_STRINGS = ['name', 'email', 'avatar_emoji', 'team', 'vibe', 'status'];
+
+class WireReader {
+    constructor(buffer) {
+        this.view = new DataView(buffer);
+        this.bytes = new Uint8Array(buffer);
+        this.offset = 0;
+    }
+
+    u8() { return this.view.getUint8(this.offset++); }
+    u32() { const v = this.view.getUint32(this.offset, true); this.offset += 4; return v; }
+    f64() { const v = this.view.getFloat64(this.offset, true); this.offset += 8; return v; }
+
+    column(n, size, read) {
+        const values = new Array(n);
+        for (let i = 0; i < n; i++) {
+            values[i] = read.call(this.view, this.offset, true);
+            this.offset += size;
+        }
+        return values;
+    }
+
+    i32s(n) { return this.column(n, 4, DataView.prototype.getInt32); }
+    i8s(n) { return this.column(n, 1, DataView.prototype.getInt8); }
+    u8s(n) { return this.column(n, 1, DataView.prototype.getUint8); }
+    u16s(n) { return this.column(n, 2, DataView.prototype.getUint16); }
+    indexes(n, width) { return width === 2 ? this.u16s(n) : this.column(n, 4, DataView.prototype.getUint32); }
+}
+
+function wireIso(offset, base) {
+    if (offset === WIRE_INT32_NONE) return null;
+    return new Date((base + offset) * 1000).toISOString().slice(0, 19);
+}
+
+function wireReadPeople(reader, strings, base, width) {
+    const n = reader.u32();
+    const ids = reader.i32s(n);
+    const text = {};
+    WIRE_PERSON_STRINGS.forEach(key => { text[key] = reader.indexes(n, width); });
+    const lats = reader.i32s(n);
+    const lons = reader.i32s(n);
+    const floors = reader.i8s(n);
+    const seen = reader.i32s(n);
+    const active = reader.u8s(n);
+
+    const people = new Array(n);
+    for (let i = 0; i < n; i++) {
+        const person = { id: ids[i] };
+        WIRE_PERSON_STRINGS.forEach(key => { person[key] = strings[text[key][i]]; });
+        person.latitude = lats[i] === WIRE_INT32_NONE ? null : lats[i] / WIRE_COORD_SCALE;
+        person.longitude = lons[i] === WIRE_INT32_NONE ? null : lons[i] / WIRE_COORD_SCALE;
+        person.floor = floors[i] === WIRE_INT8_NONE ? null : floors[i];
+        person.last_seen = wireIso(seen[i], base);
+        person.is_active = active[i] === 1;
+        people[i] = person;
+    }
+    return people;
+}
+
+function decodeState(buffer) {
+    const reader = new WireReader(buffer);
+    if (reader.u8() !== 0x43 || reader.u8() !== 0x57) throw new Error('Not a packed state payload');
+    reader.u8();  // format version
+    const kind = reader.u8();
+    const version = reader.u32();
+    const baseVersion = reader.u32();
+    const base = reader.f64();
+    const width = reader.u8();
+
+    const lengths = reader.u16s(reader.u32());
+    const decoder = new TextDecoder();
+    const strings = [null];
+    lengths.forEach(length => {
+        strings.push(decoder.decode(reader.bytes.subarray(reader.offset, reader.offset + length)));
+        reader.offset += length;
+    });
+
+    const people = wireReadPeople(reader, strings, base, width);
+    const removedPeople = kind === WIRE_KIND_DELTA ? reader.i32s(reader.u32()) : null;
+
+    const n = reader.u32();
+    const ids = reader.i32s(n);
+    const taggers = reader.i32s(n);
+    const taggeds = reader.i32s(n);
+    const created = reader.i32s(n);
+    const expires = reader.i32s(n);
+    const statuses = reader.indexes(n, width);
+    const tagPeople = {};
+    wireReadPeople(reader, strings, base, width).forEach(p => { tagPeople[p.id] = p; });
+
+    const tags = new Array(n);
+    for (let i = 0; i < n; i++) {
+        tags[i] = {
+            id: ids[i],
+            tagger: tagPeople[taggers[i]] || null,
+            tagged: tagPeople[taggeds[i]] || null,
+            created_at: wireIso(created[i], base),
+            expires_at: wireIso(expires[i], base),
+            status: strings[statuses[i]]
+        };
+    }
+
+    if (kind !== WIRE_KIND_DELTA) {
+        return { version, people, tags };
+    }
+    return {
+        version,
+        base_version: baseVersion,
+        people: { upserted: people, removed: removedPeople },
+        tags: { upserted: tags, removed: reader.i32s(reader.u32()) }
+    };
+}
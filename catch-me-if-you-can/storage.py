@@ -0,0 +1,172 @@
+"""
+Database engine profiles.
+DATABASE_URL picks one:
+  sqlite:///office.db      WAL journal with tuned pragmas, and a separate
+                           read-only pool so readers never wait on a writer
+  postgresql://...         pooled connections and batched executemany
+                           (needs psycopg2); DATABASE_READ_URL can point
+                           reads at a replica
+Both write presence back as one UPDATE ... WHERE id = ? statement,
+compiled once and run with executemany, so a flush is a single batch
+however many users moved.
+"""
+
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, create_engine, event
+from sqlalchemy.orm import Session
+
+# Connection settings for SQLite, applied to every new connection
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),      # Readers and the writer no longer block each other
+    ('synchronous', 'NORMAL'),    # Durable in WAL mode except for the last commits on power loss
+    ('busy_timeout', 5000),       # Wait this long (ms) for the write lock instead of failing
+    ('cache_size', -16000),       # Page cache size in KiB
+    ('temp_store', 'MEMORY'),
+    ('mmap_size', 128 * 1024 * 1024),
+)
+
+# Read-only SQLite connections kept open for queries on the read path
+SQLITE_READ_POOL_SIZE = 4
+
+# Postgres connection pool per worker
+POSTGRES_POOL = {
+    'pool_size': 10,
+    'max_overflow': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+}
+
+
+def database_url(url: str) -> str:
+    """Accept the postgres:// scheme hosting providers hand out, which SQLAlchemy rejects."""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+class StorageProfile:
+    """Engine options, per-connection setup, a read engine and bulk writes for one backend."""
+
+    name = 'default'
+
+    def __init__(self, url: str, read_url: Optional[str] = None):
+        self.url = url
+        self.read_url = read_url
+        self.engine = None
+        self.read_engine = None
+        self.rows_written = 0
+        self.batches = 0
+        self._updates = {}  # (table, columns) -> statement, so SQLAlchemy compiles each once
+
+    def engine_options(self) -> Dict:
+        """SQLALCHEMY_ENGINE_OPTIONS for the main engine."""
+        return {}
+
+    def install(self, engine):
+        """Set up connections of the app's engine and open the read engine."""
+        self.engine = engine
+        self.read_engine = create_engine(self.read_url) if self.read_url else engine
+
+    @contextmanager
+    def read_session(self):
+        """A session on the read engine, for queries that don't need the writer's connection."""
+        session = Session(self.read_engine)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def write_rows(self, session, model, rows: List[Dict]):
+        """Update existing rows of `model` by primary key 'id' in as few statements as possible."""
+        session.bulk_update_mappings(model, rows)
+        self._count(rows)
+
+    def _update(self, session, model, rows: List[Dict]):
+        """One UPDATE ... WHERE id = ? run with executemany; rows that no longer exist are skipped."""
+        table = model.__table__
+        columns = tuple(rows[0])
+        statement = self._updates.get((table.name, columns))
+        if statement is None:
+            # The key moves to its own bind name; SET takes the remaining keys of each row
+            statement = table.update().where(table.c.id == bindparam('row_id'))
+            self._updates[(table.name, columns)] = statement
+        session.execute(statement, [{('row_id' if name == 'id' else name): value for name, value in row.items()}
+                                    for row in rows])
+        self._count(rows)
+
+    def _count(self, rows):
+        self.batches += 1
+        self.rows_written += len(rows)
+
+    def stats(self) -> Dict:
+        stats = {'profile': self.name, 'batches': self.batches, 'rows_written': self.rows_written}
+        if self.engine is not None:
+            stats['pool'] = self.engine.pool.status()
+        if self.read_engine is not None and self.read_engine is not self.engine:
+            stats['read_pool'] = self.read_engine.pool.status()
+        return stats
+
+
+class SQLiteProfile(StorageProfile):
+    """WAL mode and tuned pragmas, with a separate pool of read-only connections."""
+
+    name = 'sqlite'
+
+    def install(self, engine):
+        self.engine = engine
+        event.listen(engine, 'connect', _set_pragmas)
+        database = engine.url.database
+        if not database or database == ':memory:':
+            self.read_engine = engine  # Another connection would see another database
+            return
+        self.read_engine = create_engine(engine.url, pool_size=SQLITE_READ_POOL_SIZE, max_overflow=0)
+        event.listen(self.read_engine, 'connect', _set_read_only_pragmas)
+
+    def write_rows(self, session, model, rows: List[Dict]):
+        self._update(session, model, rows)
+
+
+class PostgresProfile(StorageProfile):
+    """A bounded connection pool, with UPDATE executemany batched by psycopg2."""
+
+    name = 'postgresql'
+
+    def engine_options(self) -> Dict:
+        options = dict(POSTGRES_POOL)
+        if self.url.startswith('postgresql://') or self.url.startswith('postgresql+psycopg2://'):
+            # Also page ORM UPDATEs (e.g. connecting several tags) into one round trip
+            options['executemany_mode'] = 'values_plus_batch'
+        return options
+
+    def install(self, engine):
+        self.engine = engine
+        self.read_engine = create_engine(self.read_url, **POSTGRES_POOL) if self.read_url else engine
+
+    def write_rows(self, session, model, rows: List[Dict]):
+        self._update(session, model, rows)
+
+
+def _set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+def _set_read_only_pragmas(dbapi_connection, connection_record):
+    _set_pragmas(dbapi_connection, connection_record)
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA query_only=ON')
+    cursor.close()
+
+
+def storage_profile(url: str, read_url: Optional[str] = None) -> StorageProfile:
+    """The profile for a database URL."""
+    url = database_url(url)
+    if url.startswith('sqlite'):
+        return SQLiteProfile(url)
+    if url.startswith('postgresql'):
+        return PostgresProfile(url, database_url(read_url) if read_url else None)
+    return StorageProfile(url, read_url)
@@ -0,0 +1,132 @@
+"""
+In-memory index of pending tag requests keyed by participant.
+Lets a location update find the tags it might complete without a query;
+kept in sync as tags are created, connected and expired. A heap of
+expiry deadlines tells the sweeper exactly when the next tag is due.
+"""
+
+import heapq
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class PendingTag:
+    """The parts of a pending TagRequest needed for proximity checks."""
+
+    __slots__ = ('id', 'tagger_id', 'tagged_id', 'expires_at')
+
+    def __init__(self, id, tagger_id, tagged_id, expires_at=None):
+        self.id = id
+        self.tagger_id = tagger_id
+        self.tagged_id = tagged_id
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_tag(cls, tag) -> 'PendingTag':
+        return cls(tag.id, tag.tagger_id, tag.tagged_id, tag.expires_at)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'PendingTag':
+        return cls(data['id'], data['tagger_id'], data['tagged_id'], data.get('expires_at'))
+
+    def to_dict(self) -> Dict:
+        return {'id': self.id, 'tagger_id': self.tagger_id, 'tagged_id': self.tagged_id,
+                'expires_at': self.expires_at}
+
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        if self.expires_at is None:
+            return True
+        return (now or datetime.utcnow()) > self.expires_at
+
+
+class PendingTagIndex:
+    """Pending tags by id and by participant user id."""
+
+    def __init__(self):
+        self._tags = {}
+        self._by_user = {}
+        self._deadlines = []  # (expires_at, tag_id); stale entries are skipped lazily
+
+    def load(self, tags):
+        """Replace the index contents with the given pending TagRequest rows."""
+        self._tags = {}
+        self._by_user = {}
+        self._deadlines = []
+        for tag in tags:
+            self.add(tag)
+
+    def add(self, tag) -> PendingTag:
+        pending = PendingTag.from_tag(tag)
+        self._tags[pending.id] = pending
+        self._by_user.setdefault(pending.tagger_id, set()).add(pending.id)
+        self._by_user.setdefault(pending.tagged_id, set()).add(pending.id)
+        if pending.expires_at is not None:
+            heapq.heappush(self._deadlines, (pending.expires_at, pending.id))
+        return pending
+
+    def discard(self, tag_id) -> Optional[PendingTag]:
+        pending = self._tags.pop(tag_id, None)
+        if pending is None:
+            return None
+        for user_id in (pending.tagger_id, pending.tagged_id):
+            ids = self._by_user.get(user_id)
+            if ids is not None:
+                ids.discard(tag_id)
+                if not ids:
+                    del self._by_user[user_id]
+        return pending
+
+    def get(self, tag_id) -> Optional[PendingTag]:
+        return self._tags.get(tag_id)
+
+    def for_user(self, user_id, now: Optional[datetime] = None) -> List[PendingTag]:
+        """Unexpired pending tags the user is part of."""
+        ids = self._by_user.get(user_id)
+        if not ids:
+            return []
+        now = now or datetime.utcnow()
+        return [self._tags[i] for i in ids if not self._tags[i].is_expired(now)]
+
+    def has_pair(self, user_a, user_b) -> bool:
+        """True if there's a pending tag between the two users, in either direction."""
+        ids = self._by_user.get(user_a)
+        if not ids:
+            return False
+        for tag_id in ids:
+            tag = self._tags[tag_id]
+            if user_b in (tag.tagger_id, tag.tagged_id):
+                return True
+        return False
+
+    def next_deadline(self) -> Optional[datetime]:
+        """Earliest expiry among indexed tags, or None."""
+        self._drop_stale()
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def pop_expired(self, now: Optional[datetime] = None) -> List[PendingTag]:
+        """Remove and return every tag whose deadline has passed."""
+        now = now or datetime.utcnow()
+        expired = []
+        self._drop_stale()
+        while self._deadlines and self._deadlines[0][0] < now:
+            _, tag_id = heapq.heappop(self._deadlines)
+            pending = self.discard(tag_id)
+            if pending is not None:
+                expired.append(pending)
+            self._drop_stale()
+        return expired
+
+    def _drop_stale(self):
+        # Entries for tags that were connected or re-added since being pushed
+        while self._deadlines:
+            expires_at, tag_id = self._deadlines[0]
+            pending = self._tags.get(tag_id)
+            if pending is not None and pending.expires_at == expires_at:
+                return
+            heapq.heappop(self._deadlines)
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    def stats(self) -> Dict:
+        return {'pending': len(self._tags), 'users': len(self._by_user), 'deadlines': len(self._deadlines)}
@@ -0,0 +1,221 @@
+"""
+Area-of-interest subscriptions for state updates.
+A client can subscribe to a bounding box and/or a set of zones (by name, or
+by type as grouped in group_by_zone). State deltas and cluster changes are
+then filtered per subscriber, so a client zoomed into the office doesn't
+receive everyone moving around across town.
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from geo_utils import ZONE_TYPES, detect_zone
+
+
+class AreaOfInterest:
+    """A bounding box and/or zones; a point is inside if it's in any of them."""
+
+    __slots__ = ('bbox', 'zone_names', 'zone_types', 'zone_index')
+
+    def __init__(self, bbox: Optional[Tuple[float, float, float, float]] = None,
+                 zone_names=(), zone_types=(), zone_index=None):
+        self.bbox = bbox  # (south, west, north, east)
+        self.zone_names = frozenset(zone_names)
+        self.zone_types = frozenset(zone_types)
+        self.zone_index = zone_index
+
+    @classmethod
+    def parse(cls, bbox=None, zones=None, zone_index=None) -> Optional['AreaOfInterest']:
+        """
+        Build from a [south, west, north, east] box and/or a list of zone names
+        or types; comma-separated strings (query parameters) are accepted too.
+        Returns None if neither is given. Raises ValueError on bad input.
+        """
+        if isinstance(bbox, str):
+            bbox = bbox.split(',')
+        if isinstance(zones, str):
+            zones = [z for z in zones.split(',') if z]
+        if not bbox and not zones:
+            return None
+
+        box = None
+        if bbox:
+            if len(bbox) != 4:
+                raise ValueError('bbox needs south, west, north, east')
+            box = tuple(float(v) for v in bbox)
+            if box[0] > box[2]:
+                raise ValueError('bbox south is above north')
+
+        names, types = set(), set()
+        for zone in zones or ():
+            if zone in ZONE_TYPES:
+                types.add(zone)
+            elif zone_index is not None and zone_index.get(zone) is not None:
+                names.add(zone)
+            else:
+                raise ValueError(f"Unknown zone: {zone}")
+
+        return cls(box, names, types, zone_index)
+
+    @property
+    def key(self):
+        """Equal for subscriptions to the same area, so filtering can be shared."""
+        return self.bbox, self.zone_names, self.zone_types
+
+    def contains(self, latitude, longitude) -> bool:
+        if latitude is None or longitude is None:
+            return False
+
+        if self.bbox is not None:
+            south, west, north, east = self.bbox
+            if south <= latitude <= north:
+                # A box with west > east crosses the antimeridian
+                if (west <= longitude <= east) if west <= east else (longitude >= west or longitude <= east):
+                    return True
+
+        for name in self.zone_names:
+            if self.zone_index.contains(name, latitude, longitude):
+                return True
+
+        if self.zone_types:
+            zone = detect_zone(latitude, longitude, self.zone_index)
+            if zone is not None and zone['type'] in self.zone_types:
+                return True
+        return False
+
+    def contains_person(self, person: Dict) -> bool:
+        return self.contains(person.get('latitude'), person.get('longitude'))
+
+    def contains_cluster(self, cluster: Dict) -> bool:
+        """By the cluster's detected zone if it has one, otherwise by its centre."""
+        zone_name = cluster.get('zone')
+        if zone_name:
+            if zone_name in self.zone_names:
+                return True
+            zone = self.zone_index.get(zone_name) if self.zone_index is not None else None
+            if zone is not None and zone['type'] in self.zone_types:
+                return True
+        center = cluster.get('center')
+        return center is not None and self.contains(center['latitude'], center['longitude'])
+
+
+def filter_snapshot(snapshot: Dict, area: AreaOfInterest) -> Dict:
+    """A StateTracker snapshot with only the people inside the area."""
+    return dict(snapshot, people=[p for p in snapshot['people'] if area.contains_person(p)])
+
+
+def filter_delta(delta: Dict, area: AreaOfInterest) -> Dict:
+    """
+    A delta for a client that only holds people inside the area, without
+    knowing which ones it has: people who moved outside become removals.
+    """
+    upserted, removed = [], list(delta['people']['removed'])
+    for person in delta['people']['upserted']:
+        if area.contains_person(person):
+            upserted.append(person)
+        else:
+            removed.append(person['id'])
+    return dict(delta, people={'upserted': upserted, 'removed': removed})
+
+
+class Subscriber:
+    """A socket's area and the people and clusters it currently holds."""
+
+    __slots__ = ('area', 'people', 'clusters')
+
+    def __init__(self, area: AreaOfInterest, people, clusters):
+        self.area = area
+        self.people = people
+        self.clusters = clusters
+
+
+class AreaSubscriptions:
+    """Area subscribers on this worker and the filtered updates they get."""
+
+    def __init__(self):
+        self._subscribers = {}  # sid -> Subscriber
+
+        self.deltas_sent = 0
+        self.changes_in = 0    # person changes in the full deltas, per subscriber
+        self.changes_sent = 0  # person changes actually sent
+
+    def __contains__(self, sid) -> bool:
+        return sid in self._subscribers
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, sid, area: AreaOfInterest, snapshot: Dict, clusters: List[Dict]) -> Dict:
+        """Start filtering for a socket. Returns the filtered snapshot to send it first."""
+        filtered = filter_snapshot(snapshot, area)
+        self._subscribers[sid] = Subscriber(
+            area,
+            {p['id'] for p in filtered['people']},
+            {c['id'] for c in clusters if area.contains_cluster(c)}
+        )
+        return filtered
+
+    def unsubscribe(self, sid) -> bool:
+        return self._subscribers.pop(sid, None) is not None
+
+    def areas(self) -> Iterator[Tuple[str, AreaOfInterest]]:
+        for sid, subscriber in list(self._subscribers.items()):
+            yield sid, subscriber.area
+
+    def deltas(self, delta: Dict) -> Iterator[Tuple[str, Dict]]:
+        """
+        Each subscriber's slice of a state delta. Every subscriber gets one,
+        even if empty, so its version stays in step.
+        """
+        people = delta['people']
+        changes = len(people['upserted']) + len(people['removed'])
+        by_area = {}
+
+        for sid, subscriber in list(self._subscribers.items()):
+            # Subscribers to the same area share one containment pass
+            key = subscriber.area.key
+            split = by_area.get(key)
+            if split is None:
+                inside = [p for p in people['upserted'] if subscriber.area.contains_person(p)]
+                inside_ids = {p['id'] for p in inside}
+                outside_ids = {p['id'] for p in people['upserted'] if p['id'] not in inside_ids}
+                outside_ids.update(people['removed'])
+                split = by_area[key] = (inside, inside_ids, outside_ids)
+            inside, inside_ids, outside_ids = split
+
+            # Only people the client holds need removing
+            removed = subscriber.people & outside_ids
+            subscriber.people -= removed
+            subscriber.people |= inside_ids
+
+            self.deltas_sent += 1
+            self.changes_in += changes
+            self.changes_sent += len(inside) + len(removed)
+            yield sid, dict(delta, people={'upserted': inside, 'removed': list(removed)})
+
+    def cluster_events(self, events: List[Dict]) -> Iterator[Tuple[str, List[Dict]]]:
+        """Each subscriber's cluster events: clusters inside its area or leaving it."""
+        for sid, subscriber in list(self._subscribers.items()):
+            selected = []
+            for event in events:
+                cluster_id = event['cluster_id']
+                if subscriber.area.contains_cluster(event):
+                    subscriber.clusters.add(cluster_id)
+                elif cluster_id in subscriber.clusters:
+                    subscriber.clusters.discard(cluster_id)
+                else:
+                    continue
+                selected.append(event)
+                # Parts of a split stay close by; merged clusters are gone
+                subscriber.clusters.update(event.get('split_ids', ()))
+                subscriber.clusters.difference_update(event.get('merged_ids', ()))
+            if selected:
+                yield sid, selected
+
+    def stats(self) -> Dict:
+        return {
+            'subscribers': len(self._subscribers),
+            'areas': len({s.area.key for s in self._subscribers.values()}),
+            'deltas_sent': self.deltas_sent,
+            'person_changes_in': self.changes_in,
+            'person_changes_sent': self.changes_sent
+        }
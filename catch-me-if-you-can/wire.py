@@ -0,0 +1,284 @@
+"""
+Compact binary encoding for state snapshots and deltas.
+Clients that connect with auth {'wire': 'packed'} receive state_snapshot and
+state_delta as bytes in this layout instead of JSON; everyone else keeps
+JSON. static/js/wire.js decodes it back into the same dicts.
+
+Layout (little-endian):
+  header    magic 'CW', format version u8, kind u8 (0 snapshot, 1 delta),
+            state version u32, base version u32, time base f64 (epoch s),
+            string index width u8 (2 or 4)
+  strings   count u32, byte lengths u16[count], UTF-8 blob
+  people    count u32, then columns: id i32, name/email/avatar_emoji/team/
+            vibe/status string index, latitude/longitude i32 (1e-7 degrees),
+            floor i8, last_seen i32 (seconds from the time base), is_active u8
+  removed   count u32, ids i32[count]                       (deltas only)
+  tags      count u32, then columns: id/tagger_id/tagged_id i32,
+            created_at/expires_at i32 (seconds from the time base),
+            status string index
+  tag people  people block holding each tag's tagger and tagged
+  removed tags  count u32, ids i32[count]                   (deltas only)
+
+String index 0 and the i32/i8 minimum values stand for None. Timestamps
+keep whole seconds and coordinates 1e-7 degrees (about 1 cm).
+Values that don't fit never raise: coordinates that aren't finite numbers
+within +-180 and floors outside i8 are sent as None, other numbers are
+clamped to i32, non-string text is sent as its str() and strings are cut
+to the 65535 bytes a length holds.
+"""
+
+import math
+import struct
+import sys
+from array import array
+from datetime import datetime
+from typing import Dict, List
+
+MAGIC = b'CW'
+FORMAT_VERSION = 2
+KIND_SNAPSHOT = 0
+KIND_DELTA = 1
+
+COORD_SCALE = 10_000_000
+INT32_NONE = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+INT8_NONE = -128
+STRING_MAX_BYTES = 65535
+
+_HEADER = struct.Struct('<2sBBIIdB')
+_COUNT = struct.Struct('<I')
+
+PERSON_STRINGS = ('name', 'email', 'avatar_emoji', 'team', 'vibe', 'status')
+_EPOCH = datetime(1970, 1, 1)
+
+
+class _Strings:
+    """Interned string table; index 0 is None."""
+
+    def __init__(self):
+        self.index = {}
+        self.values = []
+
+    def ref(self, value) -> int:
+        if value is None:
+            return 0
+        if not isinstance(value, str):
+            value = str(value)
+        i = self.index.get(value)
+        if i is None:
+            self.values.append(value)
+            i = self.index[value] = len(self.values)
+        return i
+
+
+def _column(typecode: str, values) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _seconds(value) -> float:
+    return (datetime.fromisoformat(value) - _EPOCH).total_seconds()
+
+
+def _time_base(people: List[Dict], tags: List[Dict]) -> float:
+    stamps = [_seconds(p['last_seen']) for p in people if p.get('last_seen')]
+    stamps.extend(_seconds(t[key]) for t in tags for key in ('created_at', 'expires_at') if t.get(key))
+    return float(int(min(stamps))) if stamps else 0.0
+
+
+def _offset(value, base: float) -> int:
+    return INT32_NONE if not value else _int32(_seconds(value) - base)
+
+
+def _int32(value) -> int:
+    """An integer clamped into i32 (INT32_NONE excluded); 0 for anything that isn't a finite number."""
+    if type(value) is int and INT32_NONE < value <= INT32_MAX:
+        return value
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0
+    if not math.isfinite(value):
+        return 0
+    return int(max(INT32_NONE + 1, min(INT32_MAX, value)))
+
+
+def _fixed(value) -> int:
+    """A coordinate in 1e-7 degrees, or None for anything that isn't a finite number within +-180."""
+    if type(value) is float and -180.0 <= value <= 180.0:  # NaN fails the comparison too
+        return int(round(value * COORD_SCALE))
+    if type(value) is int and -180 <= value <= 180:
+        return value * COORD_SCALE
+    return INT32_NONE
+
+
+def _floor(value) -> int:
+    if type(value) is not int or not INT8_NONE < value <= 127:
+        return INT8_NONE
+    return value
+
+
+def _utf8(value: str) -> bytes:
+    encoded = value.encode('utf-8', 'replace')
+    if len(encoded) > STRING_MAX_BYTES:
+        # Cut on a character boundary so the client can still decode it
+        encoded = encoded[:STRING_MAX_BYTES].decode('utf-8', 'ignore').encode('utf-8')
+    return encoded
+
+
+def _people_block(people: List[Dict], strings: _Strings, base: float, index_code: str) -> List[bytes]:
+    parts = [_COUNT.pack(len(people)), _column('i', (_int32(p['id']) for p in people))]
+    for key in PERSON_STRINGS:
+        parts.append(_column(index_code, (strings.ref(p.get(key)) for p in people)))
+    parts.append(_column('i', (_fixed(p.get('latitude')) for p in people)))
+    parts.append(_column('i', (_fixed(p.get('longitude')) for p in people)))
+    parts.append(_column('b', (_floor(p.get('floor')) for p in people)))
+    parts.append(_column('i', (_offset(p.get('last_seen'), base) for p in people)))
+    parts.append(_column('B', (1 if p.get('is_active') else 0 for p in people)))
+    return parts
+
+
+def _ids_block(ids) -> List[bytes]:
+    ids = [_int32(i) for i in ids]
+    return [_COUNT.pack(len(ids)), _column('i', ids)]
+
+
+def encode_state(payload: Dict) -> bytes:
+    """Pack a StateTracker snapshot or delta."""
+    is_delta = 'base_version' in payload
+    if is_delta:
+        people = payload['people']['upserted']
+        tags = payload['tags']['upserted']
+    else:
+        people = payload['people']
+        tags = payload['tags']
+
+    # Each tag's tagger and tagged, once per person
+    tag_people = {}
+    for tag in tags:
+        for key in ('tagger', 'tagged'):
+            if tag.get(key):
+                tag_people[tag[key]['id']] = tag[key]
+    tag_people = list(tag_people.values())
+
+    base = _time_base(people + tag_people, tags)
+    strings = _Strings()
+    # Index width is decided up front from an upper bound on distinct strings
+    index_code = 'H' if (len(people) + len(tag_people)) * len(PERSON_STRINGS) + len(tags) < 65535 else 'I'
+
+    body = _people_block(people, strings, base, index_code)
+    if is_delta:
+        body += _ids_block(payload['people']['removed'])
+    body += [
+        _COUNT.pack(len(tags)),
+        _column('i', (t['id'] for t in tags)),
+        _column('i', (t['tagger']['id'] if t.get('tagger') else INT32_NONE for t in tags)),
+        _column('i', (t['tagged']['id'] if t.get('tagged') else INT32_NONE for t in tags)),
+        _column('i', (_offset(t.get('created_at'), base) for t in tags)),
+        _column('i', (_offset(t.get('expires_at'), base) for t in tags)),
+        _column(index_code, (strings.ref(t.get('status')) for t in tags)),
+    ]
+    body += _people_block(tag_people, strings, base, index_code)
+    if is_delta:
+        body += _ids_block(payload['tags']['removed'])
+
+    encoded = [_utf8(s) for s in strings.values]
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, KIND_DELTA if is_delta else KIND_SNAPSHOT,
+                          payload['version'], payload.get('base_version', 0), base,
+                          2 if index_code == 'H' else 4)
+    return b''.join([header, _COUNT.pack(len(encoded)), _column('H', (len(s) for s in encoded)), *encoded] + body)
+
+
+class _Reader:
+    def __init__(self, data: bytes, offset: int):
+        self.data = memoryview(data)
+        self.offset = offset
+
+    def count(self) -> int:
+        (value,) = _COUNT.unpack_from(self.data, self.offset)
+        self.offset += 4
+        return value
+
+    def column(self, typecode: str, n: int) -> array:
+        column = array(typecode)
+        size = column.itemsize * n
+        column.frombytes(self.data[self.offset:self.offset + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        self.offset += size
+        return column
+
+
+def _iso(offset: int, base: float):
+    if offset == INT32_NONE:
+        return None
+    return datetime.utcfromtimestamp(base + offset).isoformat()
+
+
+def _read_people(reader: _Reader, strings: List, base: float, index_code: str) -> List[Dict]:
+    n = reader.count()
+    ids = reader.column('i', n)
+    text = {key: reader.column(index_code, n) for key in PERSON_STRINGS}
+    lats = reader.column('i', n)
+    lons = reader.column('i', n)
+    floors = reader.column('b', n)
+    seen = reader.column('i', n)
+    active = reader.column('B', n)
+    people = []
+    for i in range(n):
+        person = {'id': ids[i]}
+        for key in PERSON_STRINGS:
+            person[key] = strings[text[key][i]]
+        person['latitude'] = None if lats[i] == INT32_NONE else lats[i] / COORD_SCALE
+        person['longitude'] = None if lons[i] == INT32_NONE else lons[i] / COORD_SCALE
+        person['floor'] = None if floors[i] == INT8_NONE else floors[i]
+        person['last_seen'] = _iso(seen[i], base)
+        person['is_active'] = bool(active[i])
+        people.append(person)
+    return people
+
+
+def decode_state(data: bytes) -> Dict:
+    """Inverse of encode_state, up to the precision noted above."""
+    magic, fmt, kind, version, base_version, base, width = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        raise ValueError('Not a packed state payload')
+    index_code = 'H' if width == 2 else 'I'
+
+    reader = _Reader(data, _HEADER.size)
+    lengths = reader.column('H', reader.count())
+    strings = [None]
+    for length in lengths:
+        strings.append(bytes(reader.data[reader.offset:reader.offset + length]).decode('utf-8'))
+        reader.offset += length
+
+    people = _read_people(reader, strings, base, index_code)
+    removed_people = list(reader.column('i', reader.count())) if kind == KIND_DELTA else None
+
+    n = reader.count()
+    columns = [reader.column('i', n) for _ in range(5)]
+    statuses = reader.column(index_code, n)
+    tag_people = {p['id']: p for p in _read_people(reader, strings, base, index_code)}
+    tags = []
+    for i in range(n):
+        tag_id, tagger_id, tagged_id, created, expires = (c[i] for c in columns)
+        tags.append({
+            'id': tag_id,
+            'tagger': tag_people.get(tagger_id),
+            'tagged': tag_people.get(tagged_id),
+            'created_at': _iso(created, base),
+            'expires_at': _iso(expires, base),
+            'status': strings[statuses[i]]
+        })
+
+    if kind == KIND_SNAPSHOT:
+        return {'version': version, 'people': people, 'tags': tags}
+    removed_tags = list(reader.column('i', reader.count()))
+    return {
+        'version': version,
+        'base_version': base_version,
+        'people': {'upserted': people, 'removed': removed_people},
+        'tags': {'upserted': tags, 'removed': removed_tags}
+    }
@@ -1,8 +1,25 @@
 """
 Zone definitions for the Office Vibes Tracker - Paddington Edition
 Each store/location has its own zone with a small radius to differentiate between them.
+The zones live in the database; ZoneRegistry holds them in memory for lookups
+and can reload them while the worker runs.
 """
 
+import json
+import os
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from geo_utils import ZONE_TYPES, ZoneIndex, get_zone_color, zone_bounds
+
+# Fields a zone is defined by, as in DEFAULT_ZONES and Zone.to_dict()
+ZONE_FIELDS = ('name', 'type', 'latitude', 'longitude', 'radius', 'floor', 'icon')
+
+# How often a zones file is checked for changes (seconds)
+ZONE_WATCH_INTERVAL = 5.0
+
 # Paddington Office and nearby locations
 DEFAULT_ZONES = [
     # === PADDINGTON OFFICE (Paddington Basin area) ===
@@ -437,6 +454,183 @@ DEFAULT_ZONES = [
 ]
 
 
+def prepare_zone(data: Dict) -> Dict:
+    """
+    A validated copy of a zone with its colour and bounding box
+    (lat_min, lat_max, lon_min, lon_max) added. Raises ValueError on bad input.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('A zone must be an object')
+    name = data.get('name')
+    if not name or not isinstance(name, str):
+        raise ValueError('A zone needs a name')
+    if data.get('type') not in ZONE_TYPES:
+        raise ValueError(f"Zone {name}: type must be one of {', '.join(ZONE_TYPES)}")
+    try:
+        zone = {
+            'name': name,
+            'type': data['type'],
+            'latitude': float(data['latitude']),
+            'longitude': float(data['longitude']),
+            'radius': float(data['radius']),
+            'floor': int(data['floor']) if data.get('floor') is not None else None,
+            'icon': data.get('icon')
+        }
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Zone {name}: latitude, longitude and radius must be numbers")
+    if not -90 <= zone['latitude'] <= 90 or not -180 <= zone['longitude'] <= 180:
+        raise ValueError(f"Zone {name}: coordinates out of range")
+    if zone['radius'] <= 0:
+        raise ValueError(f"Zone {name}: radius must be positive")
+
+    zone['color'] = get_zone_color(zone['type'])
+    zone['bounds'] = zone_bounds(zone)
+    return zone
+
+
+def prepare_zones(zones: Iterable[Dict]) -> List[Dict]:
+    """Every zone prepared, in order. Raises ValueError on a bad zone or a repeated name."""
+    prepared = [prepare_zone(zone) for zone in zones]
+    if len({zone['name'] for zone in prepared}) != len(prepared):
+        raise ValueError('Zone names must be unique')
+    return prepared
+
+
+class ZoneRegistry:
+    """
+    Zones in memory, looked up through a ZoneIndex. Reloading rebuilds that
+    same index in place, so the cluster engine and area filters holding it
+    see the new zones without a restart. Colours, bounding boxes and the
+    trigonometry lookups need are computed once per load.
+    """
+
+    def __init__(self, zones: Iterable[Dict] = ()):
+        self.index = ZoneIndex()
+        self.zones = []  # Prepared zone dicts, in load order
+        self.version = 0
+        self.loaded_at = None
+        self._listeners = []
+        self.load(zones)
+
+    def on_change(self, callback: Callable[[Dict], None]):
+        """Call `callback(changes)` after a load that added, removed or changed zones."""
+        self._listeners.append(callback)
+
+    def load(self, zones: Iterable[Dict]) -> Dict[str, List[str]]:
+        """
+        Replace every zone. Everything is validated before anything is swapped,
+        so a bad zone leaves the current ones in place. Returns the names added,
+        removed and changed.
+        """
+        prepared = prepare_zones(zones)
+        new = {zone['name']: zone for zone in prepared}
+
+        old = {zone['name']: zone for zone in self.zones}
+        changes = {
+            'added': [name for name in new if name not in old],
+            'removed': [name for name in old if name not in new],
+            'changed': [name for name, zone in new.items()
+                        if name in old and any(old[name][f] != zone[f] for f in ZONE_FIELDS)]
+        }
+
+        self.index.rebuild(prepared)
+        self.zones = prepared
+        self.version += 1
+        self.loaded_at = datetime.utcnow()
+        if any(changes.values()):
+            for callback in self._listeners:
+                callback(changes)
+        return changes
+
+    def load_from_db(self, Zone) -> Dict[str, List[str]]:
+        return self.load(zone.to_dict() for zone in Zone.query.order_by(Zone.id).all())
+
+    def get(self, name: str) -> Optional[Dict]:
+        return self.index.get(name)
+
+    def lookup(self, latitude: float, longitude: float) -> Optional[Dict]:
+        return self.index.lookup(latitude, longitude)
+
+    def __len__(self) -> int:
+        return len(self.zones)
+
+    def __iter__(self):
+        return iter(self.zones)
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
+            'zones': self.zones
+        }
+
+    def stats(self) -> Dict:
+        return {'zones': len(self.zones), 'version': self.version,
+                'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None}
+
+
+def save_zones(db, Zone, zones: List[Dict]) -> int:
+    """
+    Make the zones table hold exactly `zones`, matched by name. Returns rows written.
+    Raises ValueError, before writing anything, if a zone is bad or a name repeats.
+    """
+    prepared = prepare_zones(zones)
+    existing = {zone.name: zone for zone in Zone.query.all()}
+    for data in prepared:
+        zone = existing.pop(data['name'], None) or Zone(name=data['name'])
+        for field in ZONE_FIELDS[1:]:
+            setattr(zone, field, data[field])
+        db.session.add(zone)
+    for zone in existing.values():
+        db.session.delete(zone)
+    db.session.commit()
+    return len(prepared)
+
+
+def read_zones_file(path: str) -> List[Dict]:
+    """Zones from a JSON file holding a list of zones or {'zones': [...]}."""
+    with open(path) as f:
+        data = json.load(f)
+    zones = data.get('zones') if isinstance(data, dict) else data
+    if not isinstance(zones, list):
+        raise ValueError(f"{path} has no list of zones")
+    return zones
+
+
+class ZoneFileWatcher:
+    """Polls a zones file and calls `changed(zones)` whenever it is modified."""
+
+    def __init__(self, socketio, path: str, changed: Callable[[List[Dict]], None],
+                 interval: float = ZONE_WATCH_INTERVAL):
+        self.socketio = socketio
+        self.path = path
+        self.changed = changed
+        self.interval = interval
+        self._mtime = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def check(self) -> bool:
+        """Load the file if it changed since the last check. Returns True if it did."""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        self.changed(read_zones_file(self.path))
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Zones file {self.path} not loaded: {e}")
+            self.socketio.sleep(self.interval)
+
+
 def init_zones(db, Zone):
     """Initialize the database with default zones if empty."""
     if Zone.query.count() == 0:
@@ -451,5 +645,9 @@ def init_zones(db, Zone):
                 icon=zone_data.get('icon')
             )
             db.session.add(zone)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # Another worker starting at the same time seeded them
+            return
         print(f"Initialized {len(DEFAULT_ZONES)} default zones")